@@ -0,0 +1,130 @@
+# bench_index.py - build time, on-disk size and query latency of the BM25 chunk index
+# Indexes synthetic chunks (synth_corpus.py HAL sources + datasheet pages) or a real
+# chunks directory, then times identifier queries ("HAL_TIM_PWM_Start"), prose queries
+# and stage 4's related-chunk lookups. Results are appended to benchmarks/results/index.jsonl
+# and compared with the previous run on the same corpus and machine.
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import time
+from pathlib import Path
+
+from bench_pipeline import BENCH_DIR, git_commit
+import synth_corpus
+from bm25_index import BM25Index, build_index
+
+
+def synthetic_chunks(n, seed):
+    rng = random.Random(seed)
+    for i in range(n):
+        if i % 2:
+            periph = synth_corpus.PERIPHS[i // 2 % len(synth_corpus.PERIPHS)]
+            yield f"code_synthetic_file{i:05d}.txt", synth_corpus.hal_source(rng, f"{periph}{i // 48 or ''}")
+        else:
+            yield f"pdf_synthetic_chunk{i:05d}.txt", synth_corpus.datasheet_page(rng, i // 24, i % 24)
+
+
+def dir_chunks(chunks_dir):
+    for path in sorted(Path(chunks_dir).glob("*.txt")):
+        yield path.name, path.read_text(encoding="utf-8")
+
+
+def queries(index, n, seed):
+    # Half identifier lookups taken from the indexed text, half short prose questions
+    rng = random.Random(seed)
+    sample = [index.text(rng.choice(index.names)) for _ in range(min(200, len(index)))]
+    idents = sorted({w for text in sample for w in text.split() if "_" in w and w[:1].isupper()})
+    words = synth_corpus.WORDS + [p.upper() for p in synth_corpus.PERIPHS]
+    out = []
+    for i in range(n):
+        if i % 2 and idents:
+            out.append(rng.choice(idents).strip("(),;&*"))
+        else:
+            out.append(" ".join(rng.choice(words) for _ in range(rng.randint(3, 8))))
+    return out
+
+
+def percentiles(times_ms):
+    times_ms = sorted(times_ms)
+    pick = lambda p: round(times_ms[min(len(times_ms) - 1, int(p / 100 * len(times_ms)))], 3)  # noqa: E731
+    return {"p50": pick(50), "p95": pick(95), "p99": pick(99), "mean": round(statistics.fmean(times_ms), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=5000, help="synthetic chunks to index")
+    parser.add_argument("--chunks-dir", default=None, help="index this chunks directory instead")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work", default=str(BENCH_DIR / ".work"))
+    parser.add_argument("--results", default=str(BENCH_DIR / "results" / "index.jsonl"))
+    args = parser.parse_args()
+
+    out = Path(args.work) / "index"
+    source = dir_chunks(args.chunks_dir) if args.chunks_dir else synthetic_chunks(args.chunks, args.seed)
+    start = time.perf_counter()
+    meta = build_index(source, out)
+    build_s = time.perf_counter() - start  # includes generating / reading the chunks
+    start = time.perf_counter()
+    index = BM25Index(out)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    qs = queries(index, args.queries, args.seed)
+    index.search(qs[0], k=args.k)  # warm the page cache
+    search_ms = []
+    for q in qs:
+        t = time.perf_counter()
+        index.search(q, k=args.k)
+        search_ms.append((time.perf_counter() - t) * 1000)
+    related_ms = []
+    rng = random.Random(args.seed)
+    for name in (rng.choice(index.names) for _ in range(min(200, args.queries))):
+        text = index.text(name)
+        t = time.perf_counter()
+        index.related(name, text, k=3)
+        related_ms.append((time.perf_counter() - t) * 1000)
+
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "corpus": args.chunks_dir or f"synthetic-{args.chunks}-seed{args.seed}",
+        "machine": {"cpus": os.cpu_count(), "platform": platform.platform(), "python": platform.python_version()},
+        "docs": meta["docs"],
+        "terms": meta["terms"],
+        "postings": meta["postings"],
+        "build_s": round(build_s, 3),
+        "index_mb": round(meta["bytes"] / 2**20, 2),
+        "text_mb": round((out / "texts.bin").stat().st_size / 2**20, 2),
+        "load_ms": round(load_ms, 2),
+        "search_ms": percentiles(search_ms),
+        "related_ms": percentiles(related_ms),
+    }
+    results_file = Path(args.results)
+    prev = None
+    if results_file.exists():
+        for line in results_file.read_text().splitlines():
+            r = json.loads(line)
+            if r["corpus"] == record["corpus"] and r["machine"] == record["machine"]:
+                prev = r
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    shutil.rmtree(out, ignore_errors=True)
+
+    s, r = record["search_ms"], record["related_ms"]
+    print(f"{record['docs']} chunks, {record['terms']} terms, {record['postings']} postings")
+    print(f"build {record['build_s']:.2f}s, index {record['index_mb']:.1f} MB ({record['text_mb']:.1f} MB of it chunk text), load {record['load_ms']:.1f} ms")
+    print(f"search k={args.k}: p50 {s['p50']:.2f} ms, p95 {s['p95']:.2f} ms, p99 {s['p99']:.2f} ms")
+    print(f"related (stage 4): p50 {r['p50']:.2f} ms, p95 {r['p95']:.2f} ms, p99 {r['p99']:.2f} ms")
+    if prev:
+        print(f"vs {prev['commit']}: build {prev['build_s']:.2f}s, search p50 {prev['search_ms']['p50']:.2f} ms, p99 {prev['search_ms']['p99']:.2f} ms")
+    print(f"Results appended to {results_file}")
+
+
+if __name__ == "__main__":
+    main()
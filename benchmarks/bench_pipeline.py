@@ -0,0 +1,184 @@
+# bench_pipeline.py - end-to-end CPU-only benchmark of stages 2, 3, 3b, 4 (stub model) and 5
+# Builds (or reuses) a synthetic corpus (synth_corpus.py), then for each repeat runs every
+# stage in a fresh interpreter against a scratch copy of it, exactly like the CLI would,
+# and reads back the stage's instrument.py run report. Medians are appended as one JSON
+# line to benchmarks/results/pipeline.jsonl and compared with the previous comparable run.
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+PIPELINE_DIR = BENCH_DIR.parent / "data_pipeline"
+sys.path.insert(0, str(PIPELINE_DIR))
+
+STAGES = [
+    ("stage_2_extract", ["--force"]),
+    ("stage_3_chunk", []),
+    ("stage_3b_schedule", []),
+    ("stage_4_generate", ["--backend", "stub"]),
+    ("stage_4b_compile_check", []),
+    ("stage_5_finalize", []),
+]
+
+
+def point_config_at(root):
+    # Re-root every data path in CONFIG under the scratch directory
+    import config
+    from config import CONFIG
+    for key, value in CONFIG.items():
+        if isinstance(value, str) and value.startswith(config.BASE_DIR):
+            CONFIG[key] = str(root) + value[len(config.BASE_DIR):]
+    CONFIG["local_code_dir"] = str(root / "local_sources" / "my_code")
+    CONFIG["local_extra_pdfs"] = str(root / "local_sources" / "extra_pdfs")
+    CONFIG["repos"] = {"stm32cubef4": {"url": "", "include_folders": ["Documentation", "Drivers", "Projects"]}}
+    CONFIG["target_pairs"] = 10**9  # stage 4: go through every chunk
+    return CONFIG
+
+
+def run_child(stage, root, argv):
+    # Runs inside the fresh interpreter: one stage against the scratch tree
+    point_config_at(Path(root))
+    import importlib
+    module = importlib.import_module(stage)
+    getattr(module, stage)(module.parse_args(argv))
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", "data_pipeline"], cwd=BENCH_DIR.parent, capture_output=True, text=True).stdout.strip()
+        return out.stdout.strip() + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def corpus(work, scale, seed):
+    import synth_corpus
+    version = hashlib.sha256((BENCH_DIR / "synth_corpus.py").read_bytes()).hexdigest()[:8]
+    root = work / f"corpus-x{scale:g}-seed{seed}-{version}"
+    if not (root / "done").exists():
+        shutil.rmtree(root, ignore_errors=True)
+        start = time.perf_counter()
+        synth_corpus.generate(root, scale, seed)
+        (root / "done").write_text("")
+        print(f"Generated synthetic corpus in {time.perf_counter() - start:.1f}s → {root}")
+    db = root / "data" / "artifacts.db"
+    if not db.exists():
+        # Stage 5 reads pairs from the artifact store: load the synthetic pair files once
+        from artifact_store import ArtifactStore
+        store = ArtifactStore(db)
+        store.import_files(pairs_dir=root / "data" / "generated_pairs")
+        store.close()
+    return root
+
+
+def fresh_run_dir(corpus_root, run_root):
+    # Inputs are shared read-only; everything a stage writes starts empty
+    shutil.rmtree(run_root, ignore_errors=True)
+    (run_root / "data").mkdir(parents=True)
+    os.symlink(corpus_root / "data" / "raw_downloads", run_root / "data" / "raw_downloads")
+    shutil.copy(corpus_root / "data" / "artifacts.db", run_root / "data" / "artifacts.db")
+
+
+def run_stage(stage, argv, run_root, verbose):
+    cmd = [sys.executable, __file__, "--child", stage, "--run-dir", str(run_root), "--"] + argv
+    env = dict(os.environ, HF_HUB_OFFLINE="1")  # a tokenizer that isn't cached locally falls back to estimates at once
+    result = subprocess.run(cmd, cwd=PIPELINE_DIR, capture_output=not verbose, text=True, env=env)
+    if result.returncode:
+        sys.exit(f"{stage} failed:\n{(result.stdout or '')[-2000:]}{(result.stderr or '')[-2000:]}")
+    reports = sorted((run_root / "data" / "reports" / "runs").glob(f"{stage}-*.json"), key=os.path.getmtime)
+    return json.loads(reports[-1].read_text())
+
+
+def summarize(runs):
+    # runs: [report, ...] for one stage -> medians + the item counts of the last run
+    return {
+        "wall_s": round(statistics.median(r["wall_s"] for r in runs), 3),
+        "cpu_s": round(statistics.median(r["cpu_s"] + r["children_cpu_s"] for r in runs), 3),
+        "peak_rss_mb": round(max(r["peak_rss_mb"] for r in runs), 1),
+        "read_mb": round(statistics.median((r["read_bytes"] or 0) for r in runs) / 2**20, 1),
+        "write_mb": round(statistics.median((r["write_bytes"] or 0) for r in runs) / 2**20, 1),
+        "items": runs[-1]["items"],
+        "items_per_s": {k: round(v / statistics.median(r["wall_s"] for r in runs), 1) for k, v in runs[-1]["items"].items()},
+    }
+
+
+def previous(results_file, record):
+    if not results_file.exists():
+        return None
+    match = None
+    for line in results_file.read_text().splitlines():
+        try:
+            r = json.loads(line)
+        except ValueError:
+            continue
+        if all(r.get(k) == record[k] for k in ("scale", "seed", "pdf_backend", "machine")):
+            match = r
+    return match
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=float, default=1.0, help="corpus size multiplier (1 ≈ 4 PDFs × 24 pages, 240 repo files, 2k pairs)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--pdf-backend", default=None, help="stage 2 PDF backend (default: CONFIG pdf_backend)")
+    parser.add_argument("--work", default=str(BENCH_DIR / ".work"), help="corpus + scratch directory")
+    parser.add_argument("--results", default=str(BENCH_DIR / "results" / "pipeline.jsonl"))
+    parser.add_argument("--verbose", action="store_true", help="show stage output")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--run-dir", help=argparse.SUPPRESS)
+    parser.add_argument("stage_args", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run_child(args.child, args.run_dir, args.stage_args)
+
+    work = Path(args.work)
+    corpus_root = corpus(work, args.scale, args.seed)
+    runs = {stage: [] for stage, _ in STAGES}
+    for i in range(args.repeats):
+        run_root = work / "run"
+        fresh_run_dir(corpus_root, run_root)
+        for stage, argv in STAGES:
+            if stage == "stage_2_extract" and args.pdf_backend:
+                argv = argv + ["--backend", args.pdf_backend]
+            report = run_stage(stage, argv, run_root, args.verbose)
+            runs[stage].append(report)
+            print(f"  repeat {i + 1}/{args.repeats} {stage:22s} {report['wall_s']:7.2f}s")
+
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "scale": args.scale,
+        "seed": args.seed,
+        "repeats": args.repeats,
+        "pdf_backend": args.pdf_backend,
+        "machine": {"cpus": os.cpu_count(), "platform": platform.platform(), "python": platform.python_version()},
+        "stages": {stage: summarize(reports) for stage, reports in runs.items()},
+    }
+    results_file = Path(args.results)
+    prev = previous(results_file, record)
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+    print(f"\n{'stage':22s} {'wall s':>8s} {'cpu s':>8s} {'rss MB':>8s}  {'vs ' + prev['commit'] if prev else ''}")
+    for stage, s in record["stages"].items():
+        delta = ""
+        if prev and stage in prev["stages"]:
+            before = prev["stages"][stage]["wall_s"]
+            delta = f"{(s['wall_s'] - before) / before:+.0%}" if before else ""
+        print(f"{stage:22s} {s['wall_s']:8.2f} {s['cpu_s']:8.2f} {s['peak_rss_mb']:8.0f}  {delta}")
+    print(f"Results appended to {results_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# bench_prefix_cache.py - prefill cost per chunk with and without the shared-prefix KV cache
+# Runs on CPU. Uses a small HF model (--model) or, with --tiny, a randomly initialised
+# Qwen2-shaped model plus a BPE tokenizer trained on the prompts (no downloads at all).
+import argparse
+import os
+import statistics
+import sys
+import time
+from itertools import islice
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "data_pipeline"))
+from config import CONFIG  # noqa: E402
+from artifact_store import ArtifactStore  # noqa: E402
+from generation import TransformersBackend  # noqa: E402
+from stage_4_generate import PROMPT_PREFIX, build_prompt  # noqa: E402
+
+
+def load_chunks(n):
+    if os.path.exists(CONFIG["artifact_db"]):
+        texts = [text for _, _, text in islice(ArtifactStore(CONFIG["artifact_db"]).iter_chunks(), n)]
+        if texts:
+            return texts
+    # No corpus yet: register-description-like filler of varying length
+    line = "GPIOx_MODER configures the I/O direction mode, HAL_GPIO_Init() writes it for each pin.\n"
+    return [line * (5 + 7 * i) for i in range(n)]
+
+
+def tiny_model(texts):
+    import torch
+    from tokenizers import Regex, Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+    tok = Tokenizer(models.BPE(unk_token="<unk>"))
+    # Newline runs are their own pre-token, like Qwen's tokenizer, so the prefix/chunk boundary is stable
+    tok.pre_tokenizer = pre_tokenizers.Sequence([pre_tokenizers.Split(Regex(r"\s*[\r\n]+"), "isolated"),
+                                                 pre_tokenizers.ByteLevel(add_prefix_space=False)])
+    tok.decoder = decoders.ByteLevel()
+    tok.train_from_iterator(texts, trainers.BpeTrainer(vocab_size=2000, special_tokens=["<unk>", "<eos>"],
+                                                       initial_alphabet=pre_tokenizers.ByteLevel.alphabet()))
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tok, eos_token="<eos>", pad_token="<eos>")
+    torch.manual_seed(0)
+    config = Qwen2Config(vocab_size=len(tokenizer), hidden_size=256, intermediate_size=768, num_hidden_layers=4,
+                         num_attention_heads=8, num_key_value_heads=2, max_position_embeddings=16384)
+    return Qwen2ForCausalLM(config).eval(), tokenizer
+
+
+def time_prefill(backend, prompts, batch_size, repeats):
+    # max_new_tokens=1 makes generate() cost ≈ prefill
+    params = {"max_new_tokens": 1, "temperature": 1.0, "top_p": 1.0, "repetition_penalty": 1.0, "do_sample": False}
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(0, len(prompts), batch_size):
+            backend.generate(prompts[i:i + batch_size], params)
+        times.append((time.perf_counter() - start) / len(prompts))
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--tiny", action="store_true", help="random tiny model, fully offline")
+    parser.add_argument("--chunks", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    prompts = [build_prompt(c) for c in load_chunks(args.chunks)]
+    if args.tiny:
+        model, tokenizer = tiny_model(prompts)
+    else:
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.model)
+        model = AutoModelForCausalLM.from_pretrained(args.model).eval()
+    backend = TransformersBackend(model, tokenizer, device="cpu")
+
+    prefix_tokens = len(tokenizer(PROMPT_PREFIX)["input_ids"])
+    prompt_tokens = backend.count_tokens(prompts)
+    uncached = time_prefill(backend, prompts, args.batch_size, args.repeats)
+    start = time.perf_counter()
+    backend.set_prefix(PROMPT_PREFIX)
+    prefix_once = time.perf_counter() - start
+    cached = time_prefill(backend, prompts, args.batch_size, args.repeats)
+
+    avg_prompt = statistics.mean(prompt_tokens)
+    print(f"Prefix: {prefix_tokens} tokens (prefilled once in {prefix_once * 1000:.0f} ms)")
+    print(f"Prompts: {len(prompts)}, avg {avg_prompt:.0f} tokens → avg {avg_prompt - prefix_tokens:.0f} tokens prefilled with the cache")
+    print(f"Prompts served from the prefix cache: {backend.prefix_hits}/{len(prompts) * args.repeats}")
+    print(f"Prefill per chunk: {uncached * 1000:.1f} ms uncached vs {cached * 1000:.1f} ms cached ({uncached / cached:.2f}x, batch size {args.batch_size})")
+
+
+if __name__ == "__main__":
+    main()
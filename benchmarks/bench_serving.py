@@ -0,0 +1,212 @@
+# bench_serving.py - latency and throughput of the exported models behind an OpenAI-compatible server
+# Replays the test split (stm32_f405_test.jsonl; every turn up to the last assistant
+# answer) as streamed /v1/chat/completions requests, once per model and --concurrency
+# level. A model is a quantization served under its own name, e.g. after merge_export.py:
+#   ollama create stm32-coder-q5_k_m -f Modelfile   (FROM ./stm32-coder_q5_k_m)
+#   ollama create stm32-coder-q4_k_m -f Modelfile   (FROM ./stm32-coder_q4_k_m)
+# Per request: time to first token, end-to-end latency, completion tokens and decode
+# tokens/s; per run: p50/p95/p99 of those and aggregate tokens/s. Results are appended to
+# benchmarks/results/serving.jsonl and compared with the previous comparable run.
+# --stub benchmarks a local deterministic server (stub_server.py) instead: no GPU, no
+# model, for CI.
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import requests
+
+from bench_pipeline import BENCH_DIR, git_commit
+from bench_index import percentiles
+import stub_server
+import synth_corpus
+from config import CONFIG
+
+ROLES = {"system": "system", "human": "user", "user": "user", "gpt": "assistant", "assistant": "assistant"}
+
+
+def load_requests(path, limit, seed):
+    # -> [messages]: each test conversation without its final assistant answer
+    out = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            turns = [{"role": ROLES.get(t.get("from"), t.get("from")), "content": t.get("value", "")}
+                     for t in json.loads(line).get("conversations", [])]
+            last = max((i for i, t in enumerate(turns) if t["role"] == "assistant"), default=len(turns))
+            if any(t["role"] == "user" for t in turns[:last]):
+                out.append(turns[:last])
+    random.Random(seed).shuffle(out)  # the same subset every run with --limit
+    return out[:limit]
+
+
+def synthetic_requests(n, seed):
+    rng = random.Random(seed)
+    return [[{"role": "user", "content": f"How do I configure {rng.choice(synth_corpus.PERIPHS).upper()} "
+                                         + " ".join(rng.choice(synth_corpus.WORDS) for _ in range(rng.randint(5, 30)))}]
+            for _ in range(n)]
+
+
+_local = threading.local()
+
+
+def stream_chat(url, model, messages, max_tokens, temperature, timeout):
+    # One streamed request -> {"ttft_ms", "latency_ms", "tokens", "decode_tok_s"} or {"error"}
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()  # one connection pool per worker thread
+    payload = {"model": model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature,
+               "stream": True, "stream_options": {"include_usage": True}}
+    start = time.perf_counter()
+    first = None
+    events = 0
+    usage = None
+    try:
+        with session.post(url, json=payload, stream=True, timeout=timeout) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                event = json.loads(data)
+                usage = event.get("usage") or usage
+                if any((c.get("delta") or {}).get("content") for c in event.get("choices") or []):
+                    first = first or time.perf_counter()
+                    events += 1
+    except (requests.RequestException, ValueError) as e:
+        return {"error": str(e)}
+    end = time.perf_counter()
+    if first is None:
+        return {"error": "empty reply"}
+    tokens = (usage or {}).get("completion_tokens") or events  # servers without usage stream one token per event
+    return {"ttft_ms": (first - start) * 1000, "latency_ms": (end - start) * 1000, "tokens": tokens,
+            "decode_tok_s": (tokens - 1) / (end - first) if tokens > 1 and end > first else None}
+
+
+def run_level(url, model, convs, concurrency, args):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda m: stream_chat(url, model, m, args.max_tokens, args.temperature, args.timeout), convs))
+    wall = time.perf_counter() - start
+    ok = [r for r in results if "error" not in r]
+    errors = [r["error"] for r in results if "error" in r]
+    tokens = sum(r["tokens"] for r in ok)
+    decode = [r["decode_tok_s"] for r in ok if r["decode_tok_s"]]
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall_s": round(wall, 3),
+        "completion_tokens": tokens,
+        "tok_s": round(tokens / wall, 1),
+        "req_s": round(len(ok) / wall, 2),
+        "ttft_ms": percentiles([r["ttft_ms"] for r in ok]) if ok else None,
+        "latency_ms": percentiles([r["latency_ms"] for r in ok]) if ok else None,
+        "decode_tok_s_p50": round(statistics.median(decode), 1) if decode else None,
+    }
+
+
+def previous(results_file, record):
+    if not results_file.exists():
+        return None
+    match = None
+    for line in results_file.read_text().splitlines():
+        try:
+            r = json.loads(line)
+        except ValueError:
+            continue
+        if all(r.get(k) == record[k] for k in ("endpoint", "data", "requests", "max_tokens", "machine")):
+            match = r
+    return match
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--endpoint", default=CONFIG["openai_base_url"], help="OpenAI-compatible base URL (Ollama: .../v1)")
+    parser.add_argument("--models", nargs="+", default=["q5_k_m=stm32-coder-q5_k_m", "q4_k_m=stm32-coder-q4_k_m"],
+                        help="label=served model name, one per quantization")
+    parser.add_argument("--data", default=str(Path(CONFIG["final_dir"]) / "stm32_f405_test.jsonl"))
+    parser.add_argument("--limit", type=int, default=64, help="test conversations replayed per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--temperature", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stub", action="store_true", help="serve a local deterministic stub instead (CI)")
+    parser.add_argument("--stub-token-ms", type=float, default=2.0)
+    parser.add_argument("--stub-slots", type=int, default=4)
+    parser.add_argument("--results", default=str(BENCH_DIR / "results" / "serving.jsonl"))
+    args = parser.parse_args()
+
+    server = None
+    endpoint = args.endpoint
+    if args.stub:
+        server, endpoint = stub_server.start(token_ms=args.stub_token_ms, slots=args.stub_slots)
+    if os.path.exists(args.data):
+        convs, data = load_requests(args.data, args.limit, args.seed), args.data
+    elif args.stub:
+        convs, data = synthetic_requests(args.limit, args.seed), f"synthetic-{args.limit}-seed{args.seed}"
+    else:
+        raise SystemExit(f"{args.data} not found: run stage 5 first, point --data at a test split, or use --stub")
+    url = endpoint.rstrip("/") + "/chat/completions"
+    print(f"{len(convs)} conversations from {data} → {'stub server' if args.stub else url}")
+
+    runs = []
+    for spec in args.models:
+        label, _, model = spec.partition("=")
+        model = model or label
+        # First request loads the model (Ollama swaps models on demand): timed, but kept out of the stats
+        load = stream_chat(url, model, convs[0], 1, args.temperature, args.timeout)
+        if "error" in load:
+            print(f"⚠️ {label} ({model}): {load['error']} (skipping)")
+            continue
+        print(f"{label} ({model}): loaded / first token in {load['latency_ms'] / 1000:.1f}s")
+        for c in args.concurrency:
+            run = {"label": label, "model": model, "load_s": round(load["latency_ms"] / 1000, 2), **run_level(url, model, convs, c, args)}
+            runs.append(run)
+            if run["ttft_ms"]:
+                t, l = run["ttft_ms"], run["latency_ms"]
+                print(f"  concurrency {c:3d}: TTFT p50 {t['p50']:.0f} / p95 {t['p95']:.0f} / p99 {t['p99']:.0f} ms, "
+                      f"latency p50 {l['p50'] / 1000:.2f} / p95 {l['p95'] / 1000:.2f} / p99 {l['p99'] / 1000:.2f} s, "
+                      f"{run['tok_s']:.1f} tok/s total, {run['decode_tok_s_p50'] or 0:.1f} tok/s per request"
+                      + (f", {run['errors']} errors" if run["errors"] else ""))
+            else:
+                print(f"  concurrency {c:3d}: all {run['requests']} requests failed ({run['first_error']})")
+    if server:
+        server.shutdown()
+
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "endpoint": "stub" if args.stub else endpoint,
+        "data": data,
+        "requests": len(convs),
+        "max_tokens": args.max_tokens,
+        "machine": {"cpus": os.cpu_count(), "platform": platform.platform(), "python": platform.python_version()},
+        "runs": runs,
+    }
+    results_file = Path(args.results)
+    prev = previous(results_file, record)
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+    if prev:
+        before = {(r["label"], r["concurrency"]): r for r in prev["runs"]}
+        for run in runs:
+            b = before.get((run["label"], run["concurrency"]))
+            if b and b["tok_s"] and b["latency_ms"] and run["latency_ms"]:
+                print(f"vs {prev['commit']}: {run['label']} @ {run['concurrency']}: {(run['tok_s'] - b['tok_s']) / b['tok_s']:+.0%} tok/s, "
+                      f"p50 latency {(run['latency_ms']['p50'] - b['latency_ms']['p50']) / b['latency_ms']['p50']:+.0%}")
+    print(f"Results appended to {results_file}")
+
+
+if __name__ == "__main__":
+    main()
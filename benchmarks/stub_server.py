@@ -0,0 +1,110 @@
+# stub_server.py - deterministic OpenAI-compatible stand-in for Ollama / llama.cpp server
+# Serves /v1/chat/completions and /v1/completions (streamed or not) and /v1/models, with a
+# simple latency model: prefill_ms per prompt token before the first token, then token_ms
+# per generated token, and at most `slots` requests decoding at once (the rest queue, like
+# a server with a fixed number of parallel slots). Replies are derived from the prompt, so
+# runs are repeatable. Used by bench_serving.py --stub; also runs standalone:
+#   python benchmarks/stub_server.py --port 8999
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("HAL_GPIO_WritePin", "GPIOA", "GPIO_PIN_5", "HAL_Delay", "TIM2", "RCC", "->", "CR1", "|=", "while", "(1)",
+         "{", "}", ";", "void", "uint32_t", "configure", "the", "timer", "clock", "interrupt", "handler", "enable")
+
+
+def reply_tokens(prompt, n):
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+    return [rng.choice(WORDS) + " " for _ in range(n)]
+
+
+def make_handler(token_ms, prefill_ms, slots, reply_len):
+    gate = threading.BoundedSemaphore(slots)
+
+    class Handler(BaseHTTPRequestHandler):
+        def _json(self, obj, status=200):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/v1/models":
+                return self._json({"object": "list", "data": [{"id": "stub", "object": "model"}]})
+            self._json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            path = self.path.rstrip("/")
+            if path not in ("/v1/chat/completions", "/v1/completions"):
+                return self._json({"error": "not found"}, 404)
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            chat = path.endswith("chat/completions")
+            prompt = "\n".join(m.get("content") or "" for m in body.get("messages", [])) if chat else body.get("prompt", "")
+            prompt_tokens = max(1, len(prompt) // 4)
+            tokens = reply_tokens(prompt, min(body.get("max_tokens") or reply_len, reply_len))
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+            base = {"id": "stub-" + hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12], "model": body.get("model", "stub"),
+                    "object": "chat.completion.chunk" if chat else "text_completion", "created": int(time.time())}
+            piece = (lambda t: {"index": 0, "delta": {"content": t}}) if chat else (lambda t: {"index": 0, "text": t})
+            with gate:
+                time.sleep(prefill_ms * prompt_tokens / 1000)
+                if not body.get("stream"):
+                    time.sleep(token_ms * len(tokens) / 1000)
+                    text = "".join(tokens)
+                    choice = {"index": 0, "message": {"role": "assistant", "content": text}} if chat else {"index": 0, "text": text}
+                    return self._json({**base, "object": "chat.completion" if chat else "text_completion",
+                                       "choices": [{**choice, "finish_reason": "length"}], "usage": usage})
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                try:
+                    for t in tokens:
+                        self.wfile.write(b"data: " + json.dumps({**base, "choices": [piece(t)]}).encode("utf-8") + b"\n\n")
+                        self.wfile.flush()
+                        time.sleep(token_ms / 1000)
+                    final = {**base, "choices": [{**piece(""), "finish_reason": "length"}]}
+                    if (body.get("stream_options") or {}).get("include_usage"):
+                        final["usage"] = usage
+                    self.wfile.write(b"data: " + json.dumps(final).encode("utf-8") + b"\n\ndata: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client went away: stop generating, as real servers do
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def start(host="127.0.0.1", port=0, token_ms=5.0, prefill_ms=0.05, slots=4, reply_len=256):
+    # Serves on a background thread -> (server, base_url); server.shutdown() stops it
+    server = ThreadingHTTPServer((host, port), make_handler(token_ms, prefill_ms, slots, reply_len))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic OpenAI-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--token-ms", type=float, default=5.0, help="delay per generated token")
+    parser.add_argument("--prefill-ms", type=float, default=0.05, help="delay per prompt token before the first token")
+    parser.add_argument("--slots", type=int, default=4, help="requests generating at once")
+    parser.add_argument("--reply-tokens", type=int, default=256, help="reply length (capped by max_tokens)")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.token_ms, args.prefill_ms, args.slots, args.reply_tokens))
+    print(f"Stub server on http://{args.host}:{args.port}/v1 ({args.slots} slots, {args.token_ms} ms/token)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# synth_corpus.py - deterministic fake STM32 corpus for offline benchmarks
+# Writes, under <root>/data (same layout as the real pipeline):
+#   raw_downloads/pdfs/*.pdf            datasheet / reference-manual style text (needs pymupdf)
+#   raw_downloads/repos/stm32cubef4/    Cube-style Drivers/ + Projects/ + Documentation/ git repo,
+#                                       with example projects that copy each other like the real one
+#   generated_pairs/*.jsonl             ShareGPT pairs incl. duplicates and malformed lines
+# Everything scales linearly with --scale and is reproducible from --seed.
+import argparse
+import json
+import random
+import shutil
+import subprocess
+from pathlib import Path
+
+PERIPHS = ["gpio", "rcc", "tim", "uart", "usart", "i2c", "spi", "dma", "adc", "dac", "rtc", "can",
+           "flash", "pwr", "exti", "iwdg", "wwdg", "sdio", "crc", "rng", "hash", "cryp", "eth", "usb"]
+BOARDS = ["STM32F4-Discovery", "STM32F401-Nucleo", "STM32F411E-Discovery", "STM32F429I-Discovery",
+          "STM32446E_EVAL", "STM32F412G-Discovery", "NUCLEO-F446RE", "NUCLEO-F413ZH"]
+WORDS = ("register bit field reset value configures enables selects clock prescaler interrupt flag "
+         "status mode output input alternate function pull-up pull-down speed channel transfer "
+         "buffer peripheral counter compare capture request priority vector address offset").split()
+
+
+def sentence(rng, n=None):
+    return " ".join(rng.choice(WORDS) for _ in range(n or rng.randint(8, 20))).capitalize() + "."
+
+
+def datasheet_page(rng, doc, page):
+    periph = rng.choice(PERIPHS).upper()
+    lines = [f"RM{doc:04d} Rev {rng.randint(1, 19)}   {page + 1}/...", "", f"{page // 8 + 1}.{page % 8 + 1} {periph} registers", ""]
+    for r in range(rng.randint(4, 9)):
+        reg = f"{periph}_{rng.choice(['CR', 'SR', 'DR', 'CCR', 'ARR', 'PSC', 'CFGR', 'IER'])}{r}"
+        lines.append(f"{reg} register (Address offset: 0x{r * 4:02X}, Reset value: 0x{rng.getrandbits(32):08X})")
+        for b in range(rng.randint(2, 6)):
+            lines.append(f"Bit {31 - b * 3}:{29 - b * 3} {reg[:4]}{b}: {sentence(rng)}")
+        lines.append(" ".join(sentence(rng) for _ in range(rng.randint(2, 5))))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def write_pdfs(rng, out_dir, n_docs, pages):
+    import pymupdf
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for d in range(n_docs):
+        doc = pymupdf.open()
+        for p in range(pages):
+            page = doc.new_page()
+            page.insert_textbox(page.rect + (50, 50, -50, -50), datasheet_page(rng, d, p), fontsize=7)
+        doc.save(out_dir / f"synthetic_rm{d:02d}.pdf")
+
+
+def hal_source(rng, periph):
+    P = periph.upper()
+    funcs = []
+    for name in ["Init", "DeInit", "MspInit", "Start", "Stop", "Start_IT", "Start_DMA", "IRQHandler", "GetState"]:
+        body = "\n".join(f"  hx->Instance->{rng.choice(['CR1', 'CR2', 'SR', 'DR'])} {rng.choice(['|=', '&= ~', '='])} {P}_FLAG_{rng.randint(0, 15)};  /* {sentence(rng, 6)} */"
+                         for _ in range(rng.randint(3, 12)))
+        funcs.append(f"/**\n  * @brief  {sentence(rng)}\n  * @param  hx pointer to a {P}_HandleTypeDef structure\n  * @retval HAL status\n  */\n"
+                     f"HAL_StatusTypeDef HAL_{P}_{name}({P}_HandleTypeDef *hx)\n{{\n  if (hx == NULL)\n  {{\n    return HAL_ERROR;\n  }}\n{body}\n  return HAL_OK;\n}}\n")
+    return f'/* stm32f4xx_hal_{periph}.c - {P} HAL module driver */\n#include "stm32f4xx_hal.h"\n\n' + "\n".join(funcs)
+
+
+def hal_header(rng, periph):
+    P = periph.upper()
+    defines = "\n".join(f"#define {P}_FLAG_{i:<4d} (0x{1 << i:08X}U)  /*!< {sentence(rng, 5)} */" for i in range(16))
+    return (f"#ifndef __STM32F4xx_HAL_{P}_H\n#define __STM32F4xx_HAL_{P}_H\n\ntypedef struct\n{{\n  {P}_TypeDef *Instance;\n"
+            f"  uint32_t State;\n}} {P}_HandleTypeDef;\n\n{defines}\n\n#endif\n")
+
+
+def example_main(rng, periph, board, template):
+    # Real Cube examples are near-copies of one template per peripheral
+    lines = template.splitlines()
+    for _ in range(rng.randint(0, 3)):
+        lines.insert(rng.randrange(len(lines)), f"  /* {board}: {sentence(rng, 6)} */")
+    return "\n".join(lines) + "\n"
+
+
+def write_repo(rng, repo_dir, n_periph, examples_per_periph):
+    if repo_dir.exists():
+        shutil.rmtree(repo_dir)
+    drv = repo_dir / "Drivers" / "STM32F4xx_HAL_Driver"
+    (drv / "Src").mkdir(parents=True)
+    (drv / "Inc").mkdir(parents=True)
+    periphs = (PERIPHS * (n_periph // len(PERIPHS) + 1))[:n_periph]
+    for i, periph in enumerate(periphs):
+        name = periph if i < len(PERIPHS) else f"{periph}{i // len(PERIPHS)}"
+        (drv / "Src" / f"stm32f4xx_hal_{name}.c").write_text(hal_source(rng, name))
+        (drv / "Inc" / f"stm32f4xx_hal_{name}.h").write_text(hal_header(rng, name))
+        template = ("#include \"main.h\"\n\nint main(void)\n{\n  HAL_Init();\n  SystemClock_Config();\n"
+                    + "\n".join(f"  HAL_{name.upper()}_{rng.choice(['Init', 'Start', 'Start_IT'])}(&h{name}{k});" for k in range(rng.randint(3, 8)))
+                    + "\n  while (1)\n  {\n  }\n}\n")
+        for e in range(examples_per_periph):
+            board = BOARDS[e % len(BOARDS)]
+            ex_dir = repo_dir / "Projects" / board / "Examples" / name.upper() / f"{name.upper()}_Example{e // len(BOARDS)}"
+            (ex_dir / "Src").mkdir(parents=True, exist_ok=True)
+            (ex_dir / "Src" / "main.c").write_text(example_main(rng, name, board, template))
+            (ex_dir / "readme.md").write_text(f"# {name.upper()} example on {board}\n\n" + "\n".join(sentence(rng) for _ in range(10)))
+    docs = repo_dir / "Documentation"
+    docs.mkdir()
+    for periph in periphs[:8]:
+        (docs / f"{periph}_overview.md").write_text(f"# {periph.upper()}\n\n" + "\n\n".join(" ".join(sentence(rng) for _ in range(6)) for _ in range(20)))
+    # Commit it so stage 2 reads the git index like it does for real clones
+    try:
+        subprocess.run(["git", "init", "-q"], cwd=repo_dir, check=True)
+        subprocess.run(["git", "add", "-A"], cwd=repo_dir, check=True)
+        subprocess.run(["git", "-c", "user.name=bench", "-c", "user.email=bench@localhost", "commit", "-q", "-m", "synthetic"],
+                       cwd=repo_dir, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        pass  # stage 2 falls back to walking the tree
+
+
+def write_pairs(rng, out_dir, n_pairs, dup_rate=0.05, bad_rate=0.01):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+    for i in range(n_pairs):
+        if written and rng.random() < dup_rate:
+            # Same conversation, different key order / whitespace (stage 5 must still catch it)
+            convs = [{"value": t["value"], "from": t["from"]} for t in rng.choice(written)["conversations"]]
+            line = json.dumps({"conversations": convs}, indent=rng.choice([None, 1]))
+            line = line.replace("\n", " ")
+        else:
+            periph = rng.choice(PERIPHS).upper()
+            ex = {"conversations": [
+                {"from": "user", "value": f"How do I configure {periph} on the Thing Plus? {sentence(rng)}"},
+                {"from": "assistant", "value": f"```c\nHAL_{periph}_Init(&h{periph.lower()});\n```\n" + " ".join(sentence(rng) for _ in range(rng.randint(3, 12)))},
+            ]}
+            written.append(ex)
+            line = json.dumps(ex, ensure_ascii=False)
+        if rng.random() < bad_rate:
+            line = line[: len(line) // 2]  # truncated generation
+        (out_dir / f"synthetic_{i // 8:05d}_pairs_{i % 8:03d}.jsonl").write_text(line + "\n", encoding="utf-8")
+
+
+def generate(root, scale=1.0, seed=0):
+    rng = random.Random(seed)
+    data = Path(root) / "data"
+    write_pdfs(rng, data / "raw_downloads" / "pdfs", n_docs=max(1, round(4 * scale)), pages=24)
+    write_repo(rng, data / "raw_downloads" / "repos" / "stm32cubef4", n_periph=max(2, round(24 * scale)), examples_per_periph=8)
+    write_pairs(rng, data / "generated_pairs", n_pairs=max(10, round(2000 * scale)))
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root", help="directory to create data/ in")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(f"Synthetic corpus written to {generate(args.root, args.scale, args.seed)}")
+
+
+if __name__ == "__main__":
+    main()
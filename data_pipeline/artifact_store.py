@@ -0,0 +1,363 @@
+# artifact_store.py - chunks, generations and pairs in one SQLite database (WAL mode)
+# Replaces one file per chunk (data/chunks/*.txt) and per pair (data/generated_pairs/*.jsonl).
+# Rows are keyed by content hash and remember where they came from:
+#   chunks       sha256 of the text; name, source document (extracted .md) and repo path
+#                for code; active = part of the latest stage 3 run (older chunks stay, so
+#                pairs made from them keep their provenance)
+#   generations  stage 4 job key (chunk + settings, see ledger.py); chunk, model, token
+#                counts, stop reason, raw output
+#   pairs        blake2b of the canonical conversation (stage 5's dedup key); chunk,
+#                generation, source document, the example as JSON. Only the latest
+#                generation of a chunk keeps pairs
+#   compile_checks  verdict cache of compile_check.py: key (code block + toolchain) -> ok, error
+#   pair_checks  stage 4b's verdict per pair (pass / fail / none = no C code) and the
+#                toolchain it was checked with
+# Writes are batched into one transaction each; in WAL mode readers (stage 4's prep
+# thread, an export) don't block on a stage that is writing.
+#   python artifact_store.py export   # the old chunks/ + generated_pairs/ file layout
+#   python artifact_store.py import   # load an existing file layout into the store
+#   python artifact_store.py stats
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from itertools import batched
+from pathlib import Path
+import orjson
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    hash TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    source TEXT,
+    source_path TEXT,
+    text TEXT NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1,
+    created REAL
+);
+CREATE INDEX IF NOT EXISTS chunks_active_name ON chunks (active, name);
+CREATE TABLE IF NOT EXISTS generations (
+    key TEXT PRIMARY KEY,
+    chunk_hash TEXT,
+    model TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    stop_reason TEXT,
+    pairs INTEGER,
+    invalid INTEGER,
+    error TEXT,
+    output TEXT,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS pairs (
+    hash TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    chunk_hash TEXT,
+    generation_key TEXT,
+    source TEXT,
+    data TEXT NOT NULL,
+    created REAL
+);
+CREATE INDEX IF NOT EXISTS pairs_name ON pairs (name);
+CREATE INDEX IF NOT EXISTS pairs_chunk ON pairs (chunk_hash);
+CREATE TABLE IF NOT EXISTS compile_checks (
+    key TEXT PRIMARY KEY,
+    ok INTEGER NOT NULL,
+    error TEXT,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS pair_checks (
+    pair_hash TEXT PRIMARY KEY,
+    toolchain TEXT,
+    blocks INTEGER,
+    failed INTEGER,
+    verdict TEXT NOT NULL,
+    error TEXT,
+    created REAL
+);
+"""
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def pair_hash(ex):
+    # Canonical JSON (sorted keys, no whitespace): key order and formatting differences
+    # between generations map to the same pair. Stage 5 dedups and splits by it
+    return hashlib.blake2b(orjson.dumps(ex["conversations"], option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+
+def chunk_source(name, text):
+    # -> (source document, repo path). Chunk names start with the extracted file's stem
+    # (pdf_rm0090_chunk012, code_stm32cubef4_file0042_chunk000, ..._pack003), code chunks
+    # with their "### File: <path>" header
+    stem = Path(name).stem
+    for marker in ("_file", "_chunk"):
+        if marker in stem:
+            stem = stem.rsplit(marker, 1)[0]
+            break
+    path = None
+    if text.startswith("### File: "):
+        path = text[len("### File: "):].split("\n", 1)[0]
+    return f"{stem}.md", path
+
+
+def pair_name(chunk_name, i):
+    # Same stem the pair files always had: <chunk>_pairs_003
+    return f"{Path(chunk_name).stem}_pairs_{i:03d}"
+
+
+class ArtifactStore:
+    def __init__(self, path, batch_size=1000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self.conn.executescript(SCHEMA)
+
+    @property
+    def conn(self):
+        # One connection per thread (stage 4 reads chunk text on its prep thread). WAL keeps
+        # the default synchronous=FULL: a committed batch survives a crash, which the job
+        # ledger relies on
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # chunks
+
+    def replace_chunks(self, chunks):
+        # chunks: (name, text) stream, written as the active set in one transaction, so readers
+        # see either the previous run's chunks or this run's. -> number of chunks
+        now = time.time()
+        n = 0
+        with self.conn as conn:
+            conn.execute("UPDATE chunks SET active = 0 WHERE active")
+            for batch in batched(chunks, self.batch_size):
+                rows = [(text_hash(text), name, *chunk_source(name, text), text, now) for name, text in batch]
+                conn.executemany("INSERT INTO chunks (hash, name, source, source_path, text, active, created) VALUES (?, ?, ?, ?, ?, 1, ?) "
+                                 "ON CONFLICT (hash) DO UPDATE SET name = excluded.name, source = excluded.source, "
+                                 "source_path = excluded.source_path, active = 1", rows)
+                n += len(rows)
+        return n
+
+    def iter_chunks(self):
+        # (hash, name, text) of the active chunks, by name
+        yield from self.conn.execute("SELECT hash, name, text FROM chunks WHERE active ORDER BY name")
+
+    def chunk_text(self, chunk_hash):
+        row = self.conn.execute("SELECT text FROM chunks WHERE hash = ?", (chunk_hash,)).fetchone()
+        return row[0] if row else None
+
+    def chunk_sources(self, hashes):
+        # {hash: source document}
+        out = {}
+        for batch in batched(hashes, 500):
+            q = f"SELECT hash, source FROM chunks WHERE hash IN ({','.join('?' * len(batch))})"
+            out.update(self.conn.execute(q, batch))
+        return out
+
+    # generations + pairs
+
+    def add_results(self, generations, pairs):
+        # One bulk transaction for a batch of stage 4 results:
+        #   generations: dicts with the generations columns
+        #   pairs: (chunk name, chunk hash, generation key, [examples])
+        # A chunk's new pairs supersede the ones an earlier generation of it left (as
+        # rewriting its pair files did): those are deleted, and a conversation both produced
+        # moves over to the new generation. -> pairs newly stored
+        now = time.time()
+        sources = self.chunk_sources({h for _, h, _, _ in pairs if h})
+        rows = [(pair_hash(ex), pair_name(name, i), h, key, sources.get(h), json.dumps(ex, ensure_ascii=False), now)
+                for name, h, key, examples in pairs for i, ex in enumerate(examples)]
+        with self.conn as conn:
+            conn.executemany("INSERT OR REPLACE INTO generations (key, chunk_hash, model, prompt_tokens, completion_tokens, stop_reason, "
+                             "pairs, invalid, error, output, created) VALUES (:key, :chunk_hash, :model, :prompt_tokens, "
+                             ":completion_tokens, :stop_reason, :pairs, :invalid, :error, :output, :created)",
+                             [{"error": None, "output": None, **g, "created": now} for g in generations])
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO pairs (hash, name, chunk_hash, generation_key, source, data, created) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            stored = conn.total_changes - before
+            conn.executemany("UPDATE pairs SET name = ?, chunk_hash = ?, generation_key = ?, source = ? "
+                             "WHERE hash = ? AND generation_key IS NOT ?", [(r[1], r[2], r[3], r[4], r[0], r[3]) for r in rows])
+            conn.executemany("DELETE FROM pairs WHERE chunk_hash = ? AND generation_key IS NOT ?",
+                             [(h, key) for _, h, key, examples in pairs if h and examples])
+            return stored
+
+    def iter_pairs(self, checks=False):
+        # (name, pair_hash, JSON text), in the order the pair files used to sort in;
+        # checks=True adds stage 4b's verdict (None for pairs it hasn't checked)
+        if checks:
+            yield from self.conn.execute("SELECT p.name, p.hash, p.data, c.verdict FROM pairs p LEFT JOIN pair_checks c ON c.pair_hash = p.hash "
+                                         "ORDER BY p.name, p.rowid")
+        else:
+            yield from self.conn.execute("SELECT name, hash, data FROM pairs ORDER BY name, rowid")
+
+    # compile checks
+
+    def pairs_to_check(self, toolchain, after=0, limit=1000, recheck=False):
+        # -> [(rowid, hash, JSON text)] of pairs without a verdict from this toolchain, from
+        # rowid `after` on (page through with the last rowid returned)
+        if recheck:
+            return self.conn.execute("SELECT rowid, hash, data FROM pairs WHERE rowid > ? ORDER BY rowid LIMIT ?", (after, limit)).fetchall()
+        return self.conn.execute("SELECT p.rowid, p.hash, p.data FROM pairs p LEFT JOIN pair_checks c ON c.pair_hash = p.hash "
+                                 "WHERE p.rowid > ? AND (c.toolchain IS NULL OR c.toolchain != ?) ORDER BY p.rowid LIMIT ?",
+                                 (after, toolchain, limit)).fetchall()
+
+    def cached_checks(self, keys):
+        # {key: (ok, error)} for the code blocks checked before
+        out = {}
+        for batch in batched(keys, 500):
+            q = f"SELECT key, ok, error FROM compile_checks WHERE key IN ({','.join('?' * len(batch))})"
+            out.update((key, (bool(ok), error)) for key, ok, error in self.conn.execute(q, batch))
+        return out
+
+    def add_checks(self, checks, pair_checks):
+        # One transaction: checks (key, ok, error) for the block cache, pair_checks
+        # (pair hash, toolchain, blocks, failed, verdict, error)
+        now = time.time()
+        with self.conn as conn:
+            conn.executemany("INSERT OR REPLACE INTO compile_checks (key, ok, error, created) VALUES (?, ?, ?, ?)",
+                             [(*c, now) for c in checks])
+            conn.executemany("INSERT OR REPLACE INTO pair_checks (pair_hash, toolchain, blocks, failed, verdict, error, created) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", [(*c, now) for c in pair_checks])
+
+    def check_summary(self):
+        # {verdict: pairs} over the pairs in the store
+        return dict(self.conn.execute("SELECT c.verdict, COUNT(*) FROM pair_checks c JOIN pairs p ON p.hash = c.pair_hash GROUP BY c.verdict"))
+
+    def counts(self):
+        q = lambda sql: self.conn.execute(sql).fetchone()[0]  # noqa: E731
+        return {"chunks": q("SELECT COUNT(*) FROM chunks WHERE active"), "chunks_inactive": q("SELECT COUNT(*) FROM chunks WHERE NOT active"),
+                "generations": q("SELECT COUNT(*) FROM generations"), "pairs": q("SELECT COUNT(*) FROM pairs"),
+                "pairs_checked": q("SELECT COUNT(*) FROM pair_checks"), "compile_checks": q("SELECT COUNT(*) FROM compile_checks")}
+
+    def signature(self, table):
+        # Cheap content fingerprint for main.py: the active chunk hashes; for pairs (added, or
+        # deleted when superseded) and pair_checks (replaced, which gives a row a new rowid)
+        # their count and last rowid
+        h = hashlib.sha256()
+        if table == "chunks":
+            for (chunk_hash,) in self.conn.execute("SELECT hash FROM chunks WHERE active ORDER BY hash"):
+                h.update(chunk_hash.encode("ascii"))
+        else:
+            h.update(repr(self.conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {table}").fetchone()).encode("ascii"))
+        return h.hexdigest()
+
+    # file layout
+
+    def export(self, chunks_dir=None, pairs_dir=None):
+        # -> (chunk files, pair files) written in the layout stages 3 and 4 used to produce
+        n_chunks = n_pairs = 0
+        if chunks_dir:
+            chunks_dir = Path(chunks_dir)
+            chunks_dir.mkdir(parents=True, exist_ok=True)
+            names = set()
+            for _, name, text in self.iter_chunks():
+                chunks_dir.joinpath(name).write_text(text, encoding="utf-8")
+                names.add(name)
+            for old in chunks_dir.glob("*.txt"):
+                if old.name not in names:
+                    old.unlink()
+            n_chunks = len(names)
+        if pairs_dir:
+            pairs_dir = Path(pairs_dir)
+            pairs_dir.mkdir(parents=True, exist_ok=True)
+            current, f = None, None
+            for name, _, data in self.iter_pairs():
+                if name != current:
+                    if f:
+                        f.close()
+                    f = open(pairs_dir / f"{name}.jsonl", "w", encoding="utf-8")
+                    current = name
+                    n_pairs += 1
+                f.write(data + "\n")
+            if f:
+                f.close()
+        return n_chunks, n_pairs
+
+    def import_files(self, chunks_dir=None, pairs_dir=None):
+        # Loads an existing file layout: chunks become the active set, pairs are linked to
+        # the chunk of the same name when it's known. -> (chunks, pairs stored, malformed lines)
+        n_chunks = stored = bad = 0
+        if chunks_dir and any(Path(chunks_dir).glob("*.txt")):
+            files = sorted(Path(chunks_dir).glob("*.txt"))
+            n_chunks = self.replace_chunks((f.name, f.read_text(encoding="utf-8")) for f in files)
+        if pairs_dir:
+            by_name = {name: h for h, name in self.conn.execute("SELECT hash, name FROM chunks ORDER BY active, created")}
+            batch = []
+            for f in sorted(Path(pairs_dir).glob("*.jsonl")):
+                examples = []
+                for line in f.read_bytes().splitlines():
+                    if not line.strip():
+                        continue
+                    try:
+                        ex = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        bad += 1
+                        continue
+                    if not isinstance(ex, dict) or not isinstance(ex.get("conversations"), list):
+                        bad += 1
+                        continue
+                    examples.append(ex)
+                chunk = f.stem.rsplit("_pairs_", 1)[0] + ".txt"
+                batch.append((f.stem, by_name.get(chunk), examples))
+                if len(batch) >= self.batch_size:
+                    stored += self._import_pairs(batch)
+                    batch = []
+            stored += self._import_pairs(batch)
+        return n_chunks, stored, bad
+
+    def _import_pairs(self, batch):
+        # The file name is kept as the pair name, so an export gives the same files back
+        now = time.time()
+        sources = self.chunk_sources({h for _, h, _ in batch if h})
+        rows = [(pair_hash(ex), stem, h, None, sources.get(h), json.dumps(ex, ensure_ascii=False), now)
+                for stem, h, examples in batch for ex in examples]
+        with self.conn as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO pairs (hash, name, chunk_hash, generation_key, source, data, created) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            return conn.total_changes - before
+
+
+def main():
+    import argparse
+    from config import CONFIG
+    parser = argparse.ArgumentParser(description="Chunk / generation / pair store (data/artifacts.db)")
+    parser.add_argument("command", choices=["export", "import", "stats"])
+    parser.add_argument("--db", default=CONFIG["artifact_db"])
+    parser.add_argument("--chunks-dir", default=CONFIG["chunks_dir"])
+    parser.add_argument("--pairs-dir", default=CONFIG["generated_dir"])
+    parser.add_argument("--no-chunks", action="store_true", help="leave chunk files out")
+    parser.add_argument("--no-pairs", action="store_true", help="leave pair files out")
+    args = parser.parse_args()
+
+    store = ArtifactStore(args.db)
+    chunks_dir = None if args.no_chunks else args.chunks_dir
+    pairs_dir = None if args.no_pairs else args.pairs_dir
+    start = time.perf_counter()
+    if args.command == "export":
+        n_chunks, n_pairs = store.export(chunks_dir, pairs_dir)
+        print(f"✓ Exported {n_chunks} chunk files → {chunks_dir} and {n_pairs} pair files → {pairs_dir} in {time.perf_counter() - start:.1f}s")
+    elif args.command == "import":
+        n_chunks, n_pairs, bad = store.import_files(chunks_dir, pairs_dir)
+        print(f"✓ Imported {n_chunks} chunks and {n_pairs} new pairs ({bad} malformed lines skipped) in {time.perf_counter() - start:.1f}s")
+    for k, v in store.counts().items():
+        print(f"   {k}: {v}")
+    print(f"   {args.db}: {store.path.stat().st_size / 2**20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# bm25_index.py - compact on-disk BM25 index over the chunks (built by stage 3)
+# Identifiers are indexed whole and by their parts, so HAL_TIM_PWM_Start matches both
+# "HAL_TIM_PWM_Start" and "PWM start", and RCC_AHB1ENR matches "AHB1ENR". Layout of
+# data/index/ (every array is loaded with mmap, so opening the index costs milliseconds):
+#   terms.npy         uint64 xxh3 hash of every term, sorted (lookup = searchsorted)
+#   offsets.npy       int64 [terms + 1] start of each term's postings
+#   doc_ids.npy       uint32 postings: documents containing the term, ascending
+#   tfs.npy           uint16 postings: term frequency in that document
+#   doc_len.npy       uint32 indexed terms per document
+#   texts.bin         utf-8 chunk texts back to back, text_offsets.npy int64 [docs + 1]
+#   meta.json         names, k1, b, average length, build stats
+import json
+import math
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+import numpy as np
+import xxhash
+
+WORD_RE = re.compile(r"0[xX][0-9A-Fa-f]+|[A-Za-z_][A-Za-z0-9_]*|\d+")
+# Parts of an identifier: CamelCase words, ALLCAPS runs (with trailing digits: AHB1, CR1), digits
+PART_RE = re.compile(r"[A-Z]+[0-9]*(?![a-z])|[A-Z]?[a-z]+[0-9]*|[0-9]+")
+STOPWORDS = frozenset("""a an and are as at be by for from has have if in into is it its of on or that the
+this to was were will with you your can not no do does we our which when then than also may must""".split())
+
+
+_expansions = {}  # word -> its terms; corpus vocabularies are small, so this is nearly always a hit
+
+
+def _expand(word):
+    lower = word.lower()
+    if lower.startswith("0x"):
+        return (lower,)
+    pieces = [lower]
+    for seg in word.split("_"):
+        pieces.append(seg.lower())
+        parts = PART_RE.findall(seg)
+        if len(parts) > 1:
+            pieces.extend(p.lower() for p in parts)
+    return tuple(p for p in dict.fromkeys(pieces) if len(p) > 1 and p not in STOPWORDS)
+
+
+def tokenize(text):
+    # RCC_AHB1ENR -> rcc_ahb1enr, rcc, ahb1enr, ahb1, enr
+    terms = []
+    for word in WORD_RE.findall(text):
+        expanded = _expansions.get(word)
+        if expanded is None:
+            if len(_expansions) > 500_000:
+                _expansions.clear()
+            expanded = _expansions[word] = _expand(word)
+        terms.extend(expanded)
+    return terms
+
+
+def term_hash(term):
+    return xxhash.xxh3_64_intdigest(term.encode("utf-8"))
+
+
+def build_index(chunks, out_dir, k1=1.2, b=0.75):
+    # chunks: (name, text) stream. Written to a temp dir and swapped in, so readers never
+    # see half an index. Returns meta.
+    start = time.perf_counter()
+    out_dir = Path(out_dir)
+    tmp = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    postings = {}  # term hash -> ([doc ids], [tfs])
+    names, doc_len, text_offsets = [], [], [0]
+    with open(tmp / "texts.bin", "wb") as texts_f:
+        for doc, (name, text) in enumerate(chunks):
+            counts = {}
+            terms = tokenize(text)
+            for t in terms:
+                counts[t] = counts.get(t, 0) + 1
+            for t, tf in counts.items():
+                entry = postings.setdefault(term_hash(t), ([], []))
+                entry[0].append(doc)
+                entry[1].append(min(tf, 65535))
+            data = text.encode("utf-8")
+            texts_f.write(data)
+            text_offsets.append(text_offsets[-1] + len(data))
+            names.append(name)
+            doc_len.append(len(terms))
+
+    hashes = np.fromiter(postings.keys(), dtype=np.uint64, count=len(postings))
+    order = np.argsort(hashes)
+    lists = list(postings.values())
+    sizes = np.fromiter((len(lists[i][0]) for i in order), dtype=np.int64, count=len(order))
+    offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    doc_ids = np.empty(offsets[-1], dtype=np.uint32)
+    tfs = np.empty(offsets[-1], dtype=np.uint16)
+    for j, i in enumerate(order.tolist()):
+        doc_ids[offsets[j]:offsets[j + 1]] = lists[i][0]
+        tfs[offsets[j]:offsets[j + 1]] = lists[i][1]
+    np.save(tmp / "terms.npy", hashes[order])
+    np.save(tmp / "offsets.npy", offsets)
+    np.save(tmp / "doc_ids.npy", doc_ids)
+    np.save(tmp / "tfs.npy", tfs)
+    np.save(tmp / "doc_len.npy", np.asarray(doc_len, dtype=np.uint32))
+    np.save(tmp / "text_offsets.npy", np.asarray(text_offsets, dtype=np.int64))
+    meta = {
+        "docs": len(names),
+        "terms": int(len(hashes)),
+        "postings": int(offsets[-1]),
+        "avg_len": float(np.mean(doc_len)) if doc_len else 0.0,
+        "k1": k1,
+        "b": b,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "build_seconds": round(time.perf_counter() - start, 3),
+        "names": names,
+    }
+    (tmp / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    meta["bytes"] = sum(f.stat().st_size for f in tmp.iterdir())
+    old = out_dir.with_name(out_dir.name + ".old")
+    shutil.rmtree(old, ignore_errors=True)
+    if out_dir.exists():
+        os.replace(out_dir, old)
+    os.replace(tmp, out_dir)
+    shutil.rmtree(old, ignore_errors=True)
+    return meta
+
+
+class BM25Index:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / "meta.json").read_text(encoding="utf-8"))
+        self.names = self.meta["names"]
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        load = lambda name: np.load(self.path / name, mmap_mode="r")  # noqa: E731
+        self.terms = load("terms.npy")
+        self.offsets = load("offsets.npy")
+        self.doc_ids = load("doc_ids.npy")
+        self.tfs = load("tfs.npy")
+        self.text_offsets = load("text_offsets.npy")
+        k1, b, avg = self.meta["k1"], self.meta["b"], self.meta["avg_len"] or 1.0
+        # Length part of the BM25 denominator, once per document
+        self.norm = (k1 * (1 - b + b * load("doc_len.npy") / avg)).astype(np.float32)
+        self.texts = np.memmap(self.path / "texts.bin", dtype=np.uint8, mode="r") if self.text_offsets[-1] else b""
+
+    def __len__(self):
+        return len(self.names)
+
+    def _postings(self, term):
+        h = np.uint64(term_hash(term))
+        j = int(np.searchsorted(self.terms, h))
+        if j == len(self.terms) or self.terms[j] != h:
+            return None
+        return self.doc_ids[self.offsets[j]:self.offsets[j + 1]], self.tfs[self.offsets[j]:self.offsets[j + 1]]
+
+    def idf(self, df):
+        n = len(self.names)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k=5, exclude=()):
+        # -> [(name, score)] best first
+        scores = np.zeros(len(self.names), dtype=np.float32)
+        k1 = self.meta["k1"]
+        for term in set(tokenize(query)):
+            hit = self._postings(term)
+            if hit is None:
+                continue
+            docs, tfs = hit
+            tf = tfs.astype(np.float32)
+            scores[docs] += self.idf(len(docs)) * tf * (k1 + 1) / (tf + self.norm[docs])
+        for name in exclude:
+            if name in self.ids:
+                scores[self.ids[name]] = 0
+        top = np.argpartition(-scores, min(k, len(scores) - 1))[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.names[i], float(scores[i])) for i in top.tolist() if scores[i] > 0]
+
+    def key_terms(self, text, n=32):
+        # The n rarest (highest-idf) terms of a text: a compact query for "more like this"
+        dfs = {}
+        for term in set(tokenize(text)):
+            hit = self._postings(term)
+            if hit is not None and len(hit[0]) > 1:  # df 1: only in this text itself
+                dfs[term] = len(hit[0])
+        return " ".join(sorted(dfs, key=lambda t: (dfs[t], t))[:n])
+
+    def related(self, name, text, k=3):
+        return self.search(self.key_terms(text), k=k, exclude=[name])
+
+    def text(self, name):
+        i = self.ids[name]
+        return bytes(self.texts[self.text_offsets[i]:self.text_offsets[i + 1]]).decode("utf-8")
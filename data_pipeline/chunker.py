@@ -0,0 +1,268 @@
+# chunker.py - lazy, mmap-backed chunking of the extracted markdown
+# Chunks are sized in tokens of the generation model (token_budget.py), so each one fills
+# the prompt budget stage 4 has for it. Output is identical to running langchain's
+# splitter over the whole file with the same length function, but no file is ever held
+# in memory as a whole. ChunkPacker then merges small neighbours from the same source.
+import codecs
+import io
+import mmap
+import os
+from collections import deque
+from pathlib import Path
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+BLOCK_SIZE = 1 << 22
+
+CODE_SEPARATORS = ["\n### ", "\n## ", "\n# ", "\nenum ", "\nstruct ", "\nunion ", "\nvoid ", "\nint ", "\n#define ", "\n\n", "\n", " "]
+DOC_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+
+def iter_text_blocks(path, block_size=None):
+    # Decode through mmap with universal newlines, exactly like Path.read_text would
+    block_size = block_size or BLOCK_SIZE
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(), translate=True)
+            size = len(mm)
+            for pos in range(0, size, block_size):
+                yield decoder.decode(mm[pos:pos + block_size], final=pos + block_size >= size)
+
+
+def iter_split(path, sep):
+    # Streaming equivalent of text.split(sep)
+    buf = ""
+    for block in iter_text_blocks(path):
+        scan = max(0, len(buf) - len(sep) + 1)  # a match may straddle the block boundary
+        buf += block
+        pos = 0
+        while (i := buf.find(sep, max(pos, scan))) >= 0:
+            yield buf[pos:i]
+            pos = i + len(sep)
+        buf = buf[pos:]
+    yield buf
+
+
+def contains(path, sep):
+    tail = ""
+    for block in iter_text_blocks(path):
+        if sep in tail + block[:len(sep)] or sep in block:
+            return True
+        tail = block[-(len(sep) - 1):] if len(sep) > 1 else ""
+    return False
+
+
+class _MergeState:
+    # Incremental version of TextSplitter._merge_splits (same popping rules, same strip)
+    def __init__(self, chunk_size, chunk_overlap, separator="", length_function=len):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separator = separator
+        self.length = length_function
+        self.sep_len = length_function(separator)
+        self.current = deque()
+        self.lengths = deque()
+        self.total = 0
+
+    def _join(self):
+        text = self.separator.join(self.current).strip()
+        return text or None
+
+    def feed(self, d):
+        len_ = self.length(d)
+        if self.total + len_ + (self.sep_len if self.current else 0) > self.chunk_size:
+            if self.current:
+                doc = self._join()
+                if doc is not None:
+                    yield doc
+                while self.total > self.chunk_overlap or (
+                    self.total + len_ + (self.sep_len if self.current else 0) > self.chunk_size and self.total > 0
+                ):
+                    self.total -= self.lengths[0] + (self.sep_len if len(self.current) > 1 else 0)
+                    self.current.popleft()
+                    self.lengths.popleft()
+        self.current.append(d)
+        self.lengths.append(len_)
+        self.total += len_ + (self.sep_len if len(self.current) > 1 else 0)
+
+    def flush(self):
+        if self.current or self.total:
+            doc = self._join()
+            if doc is not None:
+                yield doc
+        self.current = deque()
+        self.lengths = deque()
+        self.total = 0
+
+
+class Chunker:
+    def __init__(self, counter, max_tokens, overlap_tokens=64, min_tokens=50):
+        # counter: token_budget.TokenCounter; every size below is in its tokens
+        self.counter = counter
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min_tokens
+        # Splitters are built once per document type (and per fallback level), not per section
+        self.code_splitter = RecursiveCharacterTextSplitter(
+            separators=CODE_SEPARATORS,
+            chunk_size=max_tokens,
+            chunk_overlap=0,
+            length_function=counter.count,
+            is_separator_regex=False
+        )
+        self.doc_splitters = {}
+
+    def _doc_splitter(self, separators):
+        key = tuple(separators)
+        if key not in self.doc_splitters:
+            self.doc_splitters[key] = RecursiveCharacterTextSplitter(
+                separators=list(separators),
+                chunk_size=self.max_tokens,
+                chunk_overlap=self.overlap_tokens,
+                length_function=self.counter.count,
+                is_separator_regex=False
+            )
+        return self.doc_splitters[key]
+
+    def iter_file_sections(self, md_file):
+        # (index, section) for every "### File:" section, same numbering as text.split("\n### ")
+        for i, section in enumerate(iter_split(md_file, "\n### ")):
+            if i == 0 and not section.startswith("### "):
+                # First part before any ###, skip if empty
+                continue
+            yield i, ("### " + section) if i > 0 else section
+
+    def iter_code_chunks(self, md_file, stats):
+        stem = Path(md_file).stem
+        count = self.counter.count
+        for i, section in self.iter_file_sections(md_file):
+            n_tokens = count(section)
+            if n_tokens <= self.max_tokens:
+                # Keep whole
+                stats["whole"] += 1
+                stats["total_size"] += len(section)
+                stats["total_tokens"] += n_tokens
+                yield f"{stem}_file{i:04d}.txt", section
+                continue
+            # Split with enhanced separators, then buffer sub-chunks back up to the limit
+            buffer = []
+            buffer_size = 0
+            chunk_count = 0
+            for sub in self.code_splitter.split_text(section):
+                n = count(sub) + 1  # + the joining newline
+                if buffer_size + n > self.max_tokens and buffer:
+                    combined = "\n".join(buffer)
+                    stats["total_size"] += len(combined)
+                    stats["total_tokens"] += buffer_size
+                    yield f"{stem}_file{i:04d}_chunk{chunk_count:03d}.txt", combined
+                    chunk_count += 1
+                    buffer = [sub]
+                    buffer_size = n
+                else:
+                    buffer.append(sub)
+                    buffer_size += n
+            # Yield remaining buffer
+            if buffer:
+                combined = "\n".join(buffer)
+                stats["total_size"] += len(combined)
+                stats["total_tokens"] += buffer_size
+                yield f"{stem}_file{i:04d}_chunk{chunk_count:03d}.txt", combined
+                chunk_count += 1
+            if chunk_count > 0:
+                stats["split_files"] += 1
+                stats["split_chunks"] += chunk_count
+
+    def iter_doc_splits(self, md_file):
+        # Streaming RecursiveCharacterTextSplitter.split_text for the paragraph splitter
+        sep = next((s for s in DOC_SEPARATORS if s and contains(md_file, s)), "")
+        if not sep:
+            # No whitespace at all: tiny or degenerate file, let langchain handle it
+            text = "".join(iter_text_blocks(md_file))
+            yield from self._doc_splitter(DOC_SEPARATORS).split_text(text)
+            return
+        rest = DOC_SEPARATORS[DOC_SEPARATORS.index(sep) + 1:]
+        merge = _MergeState(self.max_tokens, self.overlap_tokens, length_function=self.counter.count)
+        for n, piece in enumerate(iter_split(md_file, sep)):
+            s = piece if n == 0 else sep + piece  # keep_separator=True keeps it at the start
+            if not s:
+                continue
+            if self.counter.count(s) < self.max_tokens:
+                yield from merge.feed(s)
+                continue
+            yield from merge.flush()
+            if not rest:
+                yield s
+            else:
+                yield from self._doc_splitter(rest).split_text(s)
+        yield from merge.flush()
+
+    def iter_doc_chunks(self, md_file):
+        # PDFs and web: paragraph-based
+        stem = Path(md_file).stem
+        for i, chunk in enumerate(self.iter_doc_splits(md_file)):
+            if self.counter.count(chunk) < self.min_tokens:
+                continue
+            yield f"{stem}_chunk{i:03d}.txt", chunk
+
+    def iter_chunks(self, extracted_dir, stats):
+        # (chunk_name, text) for the whole corpus, one file section at a time
+        for md_file in Path(extracted_dir).glob("*.md"):
+            file_type = md_file.stem.split('_')[0]  # e.g., 'code', 'pdf', 'web'
+            if file_type == 'code':
+                yield from self.iter_code_chunks(md_file, stats)
+            else:
+                yield from self.iter_doc_chunks(md_file)
+
+
+class ChunkPacker:
+    # Greedily merges consecutive small chunks from the same source (one PDF / web page, or
+    # one directory of a repo) into a single chunk of at most max_tokens, so a prompt
+    # carries a whole page of related context instead of one short file or a page tail.
+    # A merged chunk is named after its first member: <first>_pack<members>.txt
+    def __init__(self, counter, max_tokens, joiner="\n\n"):
+        self.counter = counter
+        self.max_tokens = max_tokens
+        self.joiner = joiner
+        self.joiner_tokens = counter.count(joiner)
+        self.chunks_in = 0
+        self.packed = 0  # chunks that went into a multi-member pack
+        self.packs = 0
+
+    @staticmethod
+    def source(name, text):
+        # Code sections start with "### File: <path>"; group them by directory, counting
+        # Src/ and Inc/ as part of their project (a Cube example's readme, main.c and main.h)
+        if text.startswith("### File: "):
+            path = text[len("### File: "):text.find("\n")] if "\n" in text else text[len("### File: "):]
+            folder = Path(path).parent
+            if folder.name.lower() in ("src", "inc", "include"):
+                folder = folder.parent
+            return name.rsplit("_file", 1)[0], str(folder)
+        for marker in ("_file", "_chunk"):
+            if marker in name:
+                return name.rsplit(marker, 1)[0], None
+        return name, None
+
+    def _flush(self, members):
+        if len(members) == 1:
+            return members[0]
+        self.packed += len(members)
+        self.packs += 1
+        first = Path(members[0][0]).stem
+        return f"{first}_pack{len(members):03d}.txt", self.joiner.join(text for _, text in members)
+
+    def pack(self, chunks):
+        members, key, total = [], None, 0
+        for name, text in chunks:
+            self.chunks_in += 1
+            n = self.counter.count(text)
+            k = self.source(name, text)
+            if members and (k != key or total + self.joiner_tokens + n > self.max_tokens):
+                yield self._flush(members)
+                members, total = [], 0
+            members.append((name, text))
+            key = k
+            total += n + (self.joiner_tokens if len(members) > 1 else 0)
+        if members:
+            yield self._flush(members)
@@ -0,0 +1,208 @@
+# compile_check.py - does the C code in a generated pair compile against the STM32F4 HAL?
+# Fenced ```c / ```cpp blocks are pulled out of the assistant turns and run through
+# `gcc -fsyntax-only` (arm-none-eabi-gcc when installed) with the HAL / CMSIS headers of the
+# cloned STM32CubeF4 repo. No object code is produced, so a check is mostly header
+# parsing: the headers are precompiled once per toolchain (prelude_*.h.gch).
+# A block passes when it compiles as a file or, if it's just statements, as a function
+# body ("GPIO_InitStruct.Pin = ...; HAL_GPIO_Init(...);"). Calling a HAL_ / LL_ function
+# the headers don't declare fails too: C only warns about it, but that's an invented API.
+# Verdicts are cached by key(): hash of the block + toolchain signature (see artifact_store.py).
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+
+FENCE_RE = re.compile(r"```[ \t]*([\w+]*)[^\n]*\n(.*?)```", re.S)
+LANGS = {"c": "c", "h": "c", "cpp": "c++", "c++": "c++", "cxx": "c++", "cc": "c++", "hpp": "c++"}
+ASSISTANT_ROLES = ("gpt", "assistant")
+
+# Column-0 function definition: "void MX_TIM2_Init(void)", "int main(void) {"; "while (1)" isn't one
+FUNC_DEF_RE = re.compile(r"^(?!(?:if|for|while|switch|do|else|return)\b)[A-Za-z_][\w \t*]*\([^;{}]*\)[ \t]*\{?[ \t]*$", re.M)
+INVENTED_API_RE = re.compile(r"implicit declaration of function '(?:__)?(?:HAL|LL)_\w*'")
+INCLUDE_RE = re.compile(r"^[ \t]*#[ \t]*include\b")
+HANDLE_RE = re.compile(r"'h(?:adc|tim|uart|usart|i2c|spi|i2s|dac|can|rtc|iwdg|wwdg|rng|crc|sd|pcd)\w*' (?:undeclared|was not declared)")
+
+# Where STM32CubeF4 keeps its headers (HAL driver and CMSIS device are git submodules)
+HEADER_DIRS = ["Drivers/STM32F4xx_HAL_Driver/Inc", "Drivers/CMSIS/Device/ST/STM32F4xx/Include",
+               "Drivers/CMSIS/Include", "Drivers/CMSIS/Core/Include"]
+ARM_FLAGS = ["-mcpu=cortex-m4", "-mthumb", "-mfpu=fpv4-sp-d16", "-mfloat-abi=hard"]
+# -Werror=implicit-int: "HAL_Foo(hx, BAR);" at file scope would otherwise pass as a K&R
+# declaration with warnings and never get compiled as statements
+LANG_FLAGS = {"c": ["-std=gnu11", "-Werror=implicit-int"], "c++": ["-std=gnu++17"]}
+
+# The handles CubeMX declares in main.c, for snippets that use them without declaring them
+HANDLES = {
+    "ADC": ["hadc1", "hadc2", "hadc3"], "TIM": [f"htim{i}" for i in range(1, 15)],
+    "UART": [f"huart{i}" for i in range(1, 7)], "I2C": ["hi2c1", "hi2c2", "hi2c3"],
+    "SPI": ["hspi1", "hspi2", "hspi3"], "I2S": ["hi2s2", "hi2s3"], "DAC": ["hdac"], "CAN": ["hcan1", "hcan2"],
+    "RTC": ["hrtc"], "IWDG": ["hiwdg"], "WWDG": ["hwwdg"], "RNG": ["hrng"], "CRC": ["hcrc"], "SD": ["hsd"],
+}
+
+MAIN_H = """/* main.h - stand-in for the CubeMX-generated header (compile_check.py) */
+#ifndef __MAIN_H
+#define __MAIN_H
+#if __has_include("stm32f4xx_hal.h")
+#include "stm32f4xx_hal.h"
+#endif
+#ifdef __cplusplus
+extern "C" {
+#endif
+void Error_Handler(void);
+void SystemClock_Config(void);
+#ifdef __cplusplus
+}
+#endif
+#endif
+"""
+
+PRELUDE_UNIT = """#if __has_include("stm32f4xx_hal.h")
+#include "stm32f4xx_hal.h"
+#else
+#include <stdint.h>
+#include <stddef.h>
+#endif
+"""
+
+PRELUDE_PROJECT = '#include "main.h"\n' + "".join(
+    f"#ifdef HAL_{module}_MODULE_ENABLED\nextern {module}_HandleTypeDef {', '.join(names)};\n#endif\n"
+    for module, names in HANDLES.items())
+
+PRELUDES = {"unit": PRELUDE_UNIT, "project": PRELUDE_PROJECT}
+
+
+def extract_blocks(ex):
+    # -> [(language, code)] for the C / C++ fences in the assistant turns of one pair
+    blocks = []
+    for turn in ex.get("conversations") or []:
+        if not isinstance(turn, dict) or turn.get("from") not in ASSISTANT_ROLES or not isinstance(turn.get("value"), str):
+            continue
+        for tag, code in FENCE_RE.findall(turn["value"]):
+            lang = LANGS.get(tag.lower())
+            if lang and code.strip():
+                blocks.append((lang, code))
+    return blocks
+
+
+def find_compiler(cc=None):
+    # The cross compiler checks what the board would build; the host gcc parses the same C
+    for name in [cc] if cc else ["arm-none-eabi-gcc", "gcc"]:
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+def header_dirs(cube_dir):
+    cube_dir = Path(cube_dir)
+    return [str(cube_dir / d) for d in HEADER_DIRS if (cube_dir / d).is_dir() and any((cube_dir / d).glob("*.h"))]
+
+
+def _error_lines(stderr):
+    lines = [line.replace("<stdin>:", "", 1) for line in stderr.splitlines()
+             if ": error:" in line or ": fatal error:" in line or "data definition has no type" in line
+             or INVENTED_API_RE.search(line)]
+    return "\n".join(lines[:3])[:400]
+
+
+class Toolchain:
+    def __init__(self, cc, include_dirs, defines=(), work_dir="data/cache/compile_check", timeout=60):
+        self.cc = cc
+        self.include_dirs = [str(Path(d).resolve()) for d in include_dirs]
+        self.flags = (ARM_FLAGS if "arm-none-eabi" in Path(cc).name else []) + [f"-D{d}" for d in defines]
+        self.timeout = timeout
+        self.env = {**os.environ, "LC_ALL": "C"}  # ASCII quotes in diagnostics, for the regexes above
+        self.compiles = 0
+        self._lock = threading.Lock()
+        version = subprocess.run([cc, "--version"], capture_output=True, text=True).stdout.split("\n", 1)[0]
+
+        # Signature: compiler, flags, preludes and the headers' names / sizes / mtimes, so a
+        # repo update or a different compiler invalidates every cached verdict
+        lang_flags = [flag for flags in LANG_FLAGS.values() for flag in flags]
+        h = hashlib.sha256("\0".join([version, *lang_flags, *self.flags, *self.include_dirs, MAIN_H, *PRELUDES.values()]).encode("utf-8"))
+        for d in self.include_dirs:
+            for name in sorted(os.listdir(d)):
+                st = os.stat(os.path.join(d, name))
+                h.update(f"{name}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8", "surrogateescape"))
+        self.signature = h.hexdigest()
+        self.version = version
+        self.shim_dir = Path(work_dir) / self.signature[:16]
+
+    def key(self, lang, code):
+        return hashlib.sha256(f"{self.signature}\0{lang}\0{code}".encode("utf-8", "surrogateescape")).hexdigest()
+
+    def _cmd(self, lang, *extra):
+        return [self.cc, *extra, *LANG_FLAGS[lang], *self.flags, "-fmax-errors=5", "-fno-diagnostics-show-caret",
+                "-fdiagnostics-color=never", "-I", str(self.shim_dir.resolve()), *[f"-I{d}" for d in self.include_dirs]]
+
+    def prepare(self):
+        # Shim headers + precompiled preludes, once per signature. -> number of PCHs built
+        # (gcc silently falls back to the plain header when one is missing or stale)
+        if (self.shim_dir / "ready").exists():
+            return 0
+        self.shim_dir.mkdir(parents=True, exist_ok=True)
+        (self.shim_dir / "main.h").write_text(MAIN_H, encoding="utf-8")
+        has_conf = any(Path(d, "stm32f4xx_hal_conf.h").exists() for d in self.include_dirs)
+        if not has_conf and any(Path(d, "stm32f4xx_hal_conf_template.h").exists() for d in self.include_dirs):
+            # What a project's own hal_conf would be: the template, with every module enabled
+            (self.shim_dir / "stm32f4xx_hal_conf.h").write_text('#include "stm32f4xx_hal_conf_template.h"\n', encoding="utf-8")
+        built = 0
+        for mode, text in PRELUDES.items():
+            header = self.shim_dir / f"prelude_{mode}.h"
+            header.write_text(text, encoding="utf-8")
+            gch = self.shim_dir / f"prelude_{mode}.h.gch"
+            gch.mkdir(exist_ok=True)
+            for lang in LANG_FLAGS:
+                r = subprocess.run(self._cmd(lang, "-x", f"{lang}-header", str(header), "-o", str(gch / f"{lang}.gch")),
+                                   capture_output=True, text=True, env=self.env)
+                built += r.returncode == 0
+        (self.shim_dir / "ready").write_text(self.version, encoding="utf-8")
+        return built
+
+    def _compile(self, lang, mode, source):
+        # -> (ok, error); ok is None when the compiler didn't finish
+        cmd = self._cmd(lang, "-fsyntax-only", "-x", lang) + ["-include", str((self.shim_dir / f"prelude_{mode}.h").resolve()), "-"]
+        with self._lock:
+            self.compiles += 1
+        try:
+            r = subprocess.run(cmd, input=source, capture_output=True, text=True, env=self.env, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            return None, f"compiler timed out after {self.timeout}s"
+        error = _error_lines(r.stderr)
+        if r.returncode != 0 and not error:
+            error = r.stderr.strip()[:400] or f"exit status {r.returncode}"
+        return not error, error or None
+
+    def check(self, lang, code):
+        # -> (ok, error) for one block
+        ok, error = self._compile(lang, "unit", code)
+        if ok is not False:
+            return ok, error
+        if not FUNC_DEF_RE.search(code):
+            return self._compile(lang, "project", as_function_body(code))
+        if HANDLE_RE.search(error):
+            # Functions using main.c's handles (htim2, huart1) without declaring them
+            return self._compile(lang, "project", code)
+        return ok, error
+
+
+def as_function_body(code):
+    # Statements -> the body of a function in a CubeMX project. #includes move above the
+    # function (blank lines stay in their place) and #line keeps the block's line numbers
+    includes, body = [], []
+    for line in code.split("\n"):
+        if INCLUDE_RE.match(line):
+            includes.append(line)
+            line = ""
+        body.append(line)
+    return "\n".join(includes) + "\nvoid compile_check_snippet(void)\n{\n#line 1\n" + "\n".join(body) + "\n}\n"
+
+
+def error_kind(error):
+    # First diagnostic without location and quoted names, for the report's error histogram:
+    # "3:5: error: 'htim9' undeclared (...)" -> "error: '…' undeclared (...)"
+    first = error.split("\n", 1)[0]
+    first = re.sub(r"^\d+:\d+: ", "", first)
+    return re.sub(r"'[^']*'", "'…'", first)[:120]
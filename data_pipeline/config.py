@@ -27,7 +27,7 @@ CONFIG = {
     "repos": {
         "stm32cubef4": {
             "url": "https://github.com/STMicroelectronics/STM32CubeF4.git",
-            "include_folders": ["Documentation", "Drivers", "Middlewares"]
+            "include_folders": ["Documentation", "Drivers", "Middlewares"]  # also the sparse checkout; optional "ref": branch or tag
         },
         "stm32_codes": {
             "url": "https://github.com/OkBeiRohan/STM32-Codes.git",
@@ -35,6 +35,10 @@ CONFIG = {
         },
     },
     
+    # Extra PDFs scraped from the ST product page (stage_1_download.py --links)
+    "pdf_links_file": os.path.join(BASE_DIR, "website-pdf-links.txt"),
+    "download_workers": 4,
+    
     "web": {
         "sparkfun_hookup": "https://learn.sparkfun.com/tutorials/stm32-thing-plus-hookup-guide/all",
     },
@@ -43,16 +47,69 @@ CONFIG = {
     "local_code_dir": "../local_sources/my_code",
     "local_extra_pdfs": "../local_sources/extra_pdfs",
     
+    # Chunk dedup (MinHash + LSH): estimated Jaccard similarity above which chunks count as copies
+    "dedup_threshold": 0.85,
+    "dedup_num_perm": 128,
+    "schedule_similarity": 0.5,    # stage 3b: overlap with already scheduled chunks is penalized from here
+    
     # Generation settings
     "pairs_per_chunk": 8,          # 8 high-quality convos per chunk → ~100-150 chunks = 800-1200 pairs
-    "max_chunk_tokens": 3000,
+    "max_chunk_tokens": 3500,      # chunk budget in model tokens (stage 3 sizes/packs to it, stage 4 truncates to it)
+    "chunk_overlap_tokens": 64,    # overlap between consecutive doc chunks
+    "chunk_min_tokens": 50,        # shorter doc chunks (page furniture) are dropped
+    "tokenizer_model": "unsloth/Qwen2.5-Coder-7B-Instruct",  # tokenizer used for all token budgets
+    "gen_backend": "unsloth",      # unsloth | openai (Ollama / llama.cpp server) | stub (CPU-only, deterministic)
+    "gen_model": "unsloth/Qwen2.5-Coder-7B-Instruct",
+    "gen_max_seq_length": 8192,
+    "gen_max_new_tokens": 4096,
+    "gen_temperature": 0.6,
+    "gen_top_p": 0.92,
+    "gen_repetition_penalty": 1.1,
+    "gen_max_batch_size": 8,
+    "gen_max_batch_tokens": 40960,  # batch_size * (prompt + max_new_tokens) budget for the KV cache
+    "openai_base_url": "http://localhost:11434/v1",
+    "openai_model": "qwen2.5-coder:7b",
+    "index_server_port": 8765,     # index_server.py (search API + context-injecting chat proxy)
+    "gen_prefetch": 64,            # prompts read + tokenized ahead of the generation worker
+    "gen_post_workers": 4,         # threads parsing output and writing pair files
+    "gen_context_chunks": 0,       # related chunks (BM25, data/index) added to each prompt while the token budget allows
+    "gen_max_attempts": 3,         # a chunk that fails this often is skipped on later runs
+    "gen_flush_every": 64,         # chunks per bulk transaction into the artifact store (a hard kill redoes at most this many)
+    "val_fraction": 0.05,          # stage 5 splits are assigned from each example's hash
+    "test_fraction": 0.05,
+    
+    # Compile check of the generated C code (stage 4b), headers from the stm32cubef4 clone
+    "compile_check_cc": None,      # None: arm-none-eabi-gcc if installed, else gcc
+    "compile_check_defines": ["STM32F405xx", "USE_HAL_DRIVER"],
+    "compile_check_include_dirs": [],  # extra header dirs, searched after the Cube ones
+    "compile_check_workers": os.cpu_count(),
+    "compile_check_failures": "drop",  # stage 5: drop | tag (adds "compile_check": verdict) | keep
+    
+    # Extraction settings
+    "pdf_backend": "pymupdf4llm",  # pymupdf4llm | pymupdf | pdftotext (pdftotext is always the fallback)
+    "pdf_pages_per_shard": 32,
+    "repo_read_workers": 8,
+    "repo_clone_depth": 1,         # commits fetched per clone / update (0: full history)
     
     # Paths
     "raw_pdfs_dir": os.path.join(BASE_DIR, "data/raw_downloads/pdfs"),
     "raw_repos_dir": os.path.join(BASE_DIR, "data/raw_downloads/repos"),
     "raw_web_dir": os.path.join(BASE_DIR, "data/raw_downloads/web"),
+    "download_manifest": os.path.join(BASE_DIR, "data/raw_downloads/manifest.json"),
+    "repo_manifest": os.path.join(BASE_DIR, "data/raw_downloads/repos.json"),  # commit each repo is at
     "extracted_dir": os.path.join(BASE_DIR, "data/extracted"),
-    "chunks_dir": os.path.join(BASE_DIR, "data/chunks"),
+    "pdf_page_cache_dir": os.path.join(BASE_DIR, "data/cache/pdf_pages"),
+    "artifact_db": os.path.join(BASE_DIR, "data/artifacts.db"),  # chunks, generations, pairs (artifact_store.py)
+    "chunks_dir": os.path.join(BASE_DIR, "data/chunks"),  # chunks_dir / generated_dir: artifact_store.py export
+    "index_dir": os.path.join(BASE_DIR, "data/index"),
     "generated_dir": os.path.join(BASE_DIR, "data/generated_pairs"),
     "final_dir": os.path.join(BASE_DIR, "data/final"),
+    "gen_ledger": os.path.join(BASE_DIR, "data/state/stage4_ledger.jsonl"),
+    "chunk_schedule": os.path.join(BASE_DIR, "data/state/chunk_schedule.json"),
+    "reports_dir": os.path.join(BASE_DIR, "data/reports"),  # run reports (instrument.py) go to runs/
+    "gen_yield_report": os.path.join(BASE_DIR, "data/reports/stage4_yield.json"),
+    "dedup_report": os.path.join(BASE_DIR, "data/reports/dedup_clusters.json"),
+    "schedule_report": os.path.join(BASE_DIR, "data/reports/schedule.json"),
+    "compile_check_dir": os.path.join(BASE_DIR, "data/cache/compile_check"),  # shim headers + precompiled preludes
+    "compile_check_report": os.path.join(BASE_DIR, "data/reports/compile_check.json"),
 }
\ No newline at end of file
@@ -0,0 +1,222 @@
+# dedup.py - streaming near-duplicate removal for chunks (MinHash + LSH)
+# Signatures use one-permutation hashing over word shingles (TOKEN_NGRAM consecutive
+# tokens, each token hashed in full), computed for a whole batch of chunks at once in
+# numpy; the LSH index then keeps the first chunk of every near-duplicate cluster as its
+# representative. Whole tokens matter for register tables: RCC_AHB1ENR_GPIOAEN and
+# RCC_AHB2ENR_OTGFSEN share their first bytes but are different symbols.
+import json
+import time
+from pathlib import Path
+import numpy as np
+
+EMPTY = np.uint32(0xFFFFFFFF)
+_IS_WORD = np.zeros(256, dtype=bool)
+_IS_WORD[list(b"0123456789_abcdefghijklmnopqrstuvwxyz")] = True
+_IS_WORD[0x80:] = True  # UTF-8 letters stay inside their word
+TOKEN_NGRAM = 4  # tokens per shingle
+GROUP_BYTES = 1 << 22  # texts are hashed in groups of about this size (the prefix arrays take 8x)
+_BASE = np.uint64(0x9E3779B97F4A7C15)  # odd, so invertible mod 2^64
+_BASE_INV = np.uint64(pow(int(_BASE), -1, 1 << 64))
+
+
+def _mix(h):
+    # splitmix64 finalizer, element-wise on uint64 (wraps mod 2^64)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def _powers(base, n):
+    # base^0 .. base^(n-1) mod 2^64
+    out = np.full(n, base, dtype=np.uint64)
+    out[:1] = 1
+    return np.cumprod(out, out=out)
+
+
+def token_hashes(data):
+    # -> (start offset, 64-bit hash) of every word token in data. Polynomial hash mod 2^64
+    # from prefix sums, so every token is hashed in full without a Python loop:
+    # hash(data[i:j]) = (prefix[j] - prefix[i]) * base^-i
+    b = np.frombuffer(data, dtype=np.uint8)
+    edges = np.diff(_IS_WORD[b].astype(np.int8), prepend=0, append=0)
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    with np.errstate(over="ignore"):
+        prefix = np.zeros(len(b) + 1, dtype=np.uint64)
+        np.cumsum(b.astype(np.uint64) * _powers(_BASE, len(b)), out=prefix[1:])
+        h = (prefix[ends] - prefix[starts]) * _powers(_BASE_INV, len(b))[starts]
+    return starts, _mix(h)
+
+
+def lsh_params(threshold, num_perm):
+    # bands * rows == num_perm, S-curve midpoint (1/b)^(1/r) closest to the threshold
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        err = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or err < best[0]:
+            best = (err, bands, rows)
+    return best[1], best[2]
+
+
+class MinHashLSH:
+    def __init__(self, threshold=0.85, num_perm=128, seed=3407):
+        if num_perm & (num_perm - 1):
+            raise ValueError("num_perm must be a power of two")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bin_shift = np.uint64(64 - (num_perm.bit_length() - 1))
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        rng = np.random.default_rng(seed)
+        self.salt = np.uint64(rng.integers(1, 1 << 62))
+        self.band_mult = rng.integers(1, 1 << 62, size=self.rows, dtype=np.uint64) | np.uint64(1)
+        self.gram_mult = rng.integers(1, 1 << 62, size=TOKEN_NGRAM, dtype=np.uint64) | np.uint64(1)
+        self.tables = [dict() for _ in range(self.bands)]
+        self.rep_sigs = []  # signature of every representative, by representative id
+
+    def signatures(self, texts):
+        # (len(texts), num_perm) uint32 signature matrix for a batch
+        docs = [t.lower().encode("utf-8") for t in texts]
+        sig = np.full((len(docs), self.num_perm), EMPTY, dtype=np.uint32)
+        first = 0
+        while first < len(docs):
+            last, size = first + 1, len(docs[first])
+            while last < len(docs) and size + len(docs[last]) <= GROUP_BYTES:
+                size += len(docs[last]) + 1
+                last += 1
+            h, seg = self._shingles(docs[first:last])
+            bins = (h >> self.bin_shift).astype(np.int64)
+            np.minimum.at(sig.ravel(), (seg + first) * self.num_perm + bins, (h & np.uint64(0xFFFFFFFF)).astype(np.uint32))
+            first = last
+        # Densify empty bins (short chunks) from the next filled bin, circularly
+        empty = sig == EMPTY
+        if empty.any():
+            P = self.num_perm
+            pos = np.arange(2 * P)
+            idx = np.where(np.tile(~empty, 2), pos, 2 * P)
+            nxt = np.minimum.accumulate(idx[:, ::-1], axis=1)[:, ::-1][:, :P] % P
+            sig = np.take_along_axis(sig, nxt, axis=1)
+        return sig
+
+    def _shingles(self, docs):
+        # -> (shingle hashes, doc index of each) for a group of encoded docs. Whitespace and
+        # punctuation only separate tokens, so reindenting or reflowing barely matters;
+        # docs shorter than TOKEN_NGRAM tokens fall back to single tokens
+        n = TOKEN_NGRAM
+        data = b"\n".join(docs)  # the separator also keeps tokens from spanning two docs
+        ends = np.cumsum(np.fromiter((len(d) + 1 for d in docs), dtype=np.int64, count=len(docs)))
+        starts, tok = token_hashes(data)
+        seg = np.searchsorted(ends, starts, side="right")
+        m = len(tok) - n + 1
+        with np.errstate(over="ignore"):
+            if m > 0:
+                gram = tok[:m] * self.gram_mult[0]
+                for k in range(1, n):
+                    gram += tok[k:m + k] * self.gram_mult[k]
+                inside = seg[:m] == seg[n - 1:]
+                h, hseg = gram[inside], seg[:m][inside]
+            else:
+                h, hseg = np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+            short = (np.bincount(seg, minlength=len(docs)) < n)[seg]
+            h = np.concatenate([h, tok[short] * self.gram_mult[0]])
+            hseg = np.concatenate([hseg, seg[short]])
+        return _mix(h ^ self.salt), hseg
+
+    def band_keys(self, sig):
+        bands = sig.reshape(len(sig), self.bands, self.rows).astype(np.uint64)
+        return (bands * self.band_mult).sum(axis=2)
+
+    def query_insert(self, sig, keys):
+        # Representative id this signature duplicates, or insert it as a new representative
+        seen = set()
+        for band, key in enumerate(keys.tolist()):
+            rep = self.tables[band].get(key)
+            if rep is None or rep in seen:
+                continue
+            seen.add(rep)
+            if np.count_nonzero(self.rep_sigs[rep] == sig) / self.num_perm >= self.threshold:
+                return rep, False
+        return self.insert(sig, keys), True
+
+    def insert(self, sig, keys):
+        rep = len(self.rep_sigs)
+        self.rep_sigs.append(sig)
+        for band, key in enumerate(keys.tolist()):
+            self.tables[band].setdefault(key, rep)
+        return rep
+
+    def max_similarity(self, sig, keys):
+        # Highest estimated Jaccard similarity to any indexed signature sharing a band
+        # (pairs well below the threshold rarely collide and count as 0)
+        best = 0.0
+        seen = set()
+        for band, key in enumerate(keys.tolist()):
+            rep = self.tables[band].get(key)
+            if rep is None or rep in seen:
+                continue
+            seen.add(rep)
+            best = max(best, np.count_nonzero(self.rep_sigs[rep] == sig) / self.num_perm)
+        return best
+
+
+class ChunkDeduper:
+    # Wraps a (name, text) chunk stream and only passes through cluster representatives
+    def __init__(self, threshold=0.85, num_perm=128, batch_size=2048):
+        self.lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self.batch_size = batch_size
+        self.rep_names = []
+        self.clusters = {}  # rep id -> [duplicate names]
+        self.seen = 0
+        self.elapsed = 0.0
+
+    def filter(self, chunks):
+        batch = []
+        for item in chunks:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield from self._process(batch)
+                batch = []
+        if batch:
+            yield from self._process(batch)
+
+    def _process(self, batch):
+        start = time.perf_counter()
+        sigs = self.lsh.signatures([text for _, text in batch])
+        keys = self.lsh.band_keys(sigs)
+        kept = []
+        for (name, text), sig, key in zip(batch, sigs, keys):
+            rep, is_new = self.lsh.query_insert(sig, key)
+            if is_new:
+                self.rep_names.append(name)
+                kept.append((name, text))
+            else:
+                self.clusters.setdefault(rep, []).append(name)
+        self.seen += len(batch)
+        self.elapsed += time.perf_counter() - start
+        return kept
+
+    @property
+    def dropped(self):
+        return sum(len(v) for v in self.clusters.values())
+
+    def report(self):
+        clusters = sorted(
+            ({"representative": self.rep_names[rep], "size": len(dups) + 1, "duplicates": dups} for rep, dups in self.clusters.items()),
+            key=lambda c: -c["size"],
+        )
+        return {
+            "threshold": self.lsh.threshold,
+            "num_perm": self.lsh.num_perm,
+            "bands": self.lsh.bands,
+            "rows": self.lsh.rows,
+            "chunks_in": self.seen,
+            "chunks_kept": len(self.rep_names),
+            "chunks_dropped": self.dropped,
+            "seconds": round(self.elapsed, 3),
+            "clusters": clusters,
+        }
+
+    def write_report(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(self.report(), indent=2), encoding="utf-8")
@@ -0,0 +1,214 @@
+# downloader.py - pooled, concurrent, resumable downloads with a manifest
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tqdm import tqdm
+
+HEADERS = {
+    'accept-encoding': 'identity',  # Range offsets and Content-Length must count the bytes we store
+    'accept-language': 'en-GB,en;q=0.7',
+    'sec-ch-ua': '"Not(A:Brand";v="8", "Chromium";v="144", "Brave";v="144"',
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36'
+}
+
+CHUNK_SIZE = 1 << 16
+
+
+def make_session(pool_size=4, retries=3):
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET", "HEAD"])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+
+def sha256_file(path, chunk_size=CHUNK_SIZE):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def parse_links_file(path):
+    # Lines look like "<title> || <url>" (console dump from the ST documentation page)
+    links = {}
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        if " || " not in line:
+            continue
+        url = line.rsplit(" || ", 1)[1].strip()
+        if not urlparse(url).path.lower().endswith(".pdf"):
+            continue  # skip .zip (SVD/IBIS/BSDL) bundles, stage 2 only reads PDFs
+        name = re.sub(r"[^a-z0-9_]+", "_", Path(urlparse(url).path).stem.lower()).strip("_")
+        if url not in links.values():
+            links[name] = url
+    return links
+
+
+class Manifest:
+    # name -> {url, etag, last_modified, size, sha256, complete, fetched_at}
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.entries = {}
+        if self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text(encoding="utf-8"))
+            except ValueError:
+                print(f"⚠️ Manifest {self.path.name} is corrupt, revalidating everything")
+
+    def get(self, name):
+        with self.lock:
+            return dict(self.entries.get(name, {}))
+
+    def update(self, name, **fields):
+        with self.lock:
+            self.entries.setdefault(name, {}).update(fields)
+            self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.entries, indent=2, sort_keys=True), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+class Downloader:
+    def __init__(self, manifest, workers=4, session=None, timeout=60, verify=False):
+        self.manifest = manifest
+        self.workers = workers
+        self.session = session or make_session(pool_size=workers)
+        self.timeout = timeout
+        self.verify = verify  # re-hash files on disk instead of trusting size
+
+    def fetch_all(self, jobs, force=False):
+        # jobs: {name: (url, dest_path)} -> {name: status}
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.fetch, name, url, dest, force): name for name, (url, dest) in jobs.items()}
+            for fut in tqdm(as_completed(futures), total=len(futures), unit="file"):
+                name = futures[fut]
+                try:
+                    results[name] = fut.result()
+                except Exception as e:
+                    results[name] = "failed"
+                    tqdm.write(f"⚠️ {name}: {e}")
+        return results
+
+    def fetch(self, name, url, dest, force=False):
+        dest = Path(dest)
+        entry = self.manifest.get(name)
+        if not force and dest.exists() and entry.get("complete") and entry.get("url") == url:
+            if self._is_intact(dest, entry):
+                return self._revalidate(name, url, dest, entry)
+            tqdm.write(f"⚠️ {dest.name} does not match manifest, re-downloading")
+        elif not force and dest.exists() and not entry:
+            if self._adopt(name, url, dest):
+                return "adopted"
+        return self._download(name, url, dest, entry if not force else {})
+
+    def _adopt(self, name, url, dest):
+        # File from before the manifest existed: keep it if the server agrees on its size
+        try:
+            r = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+        except requests.RequestException:
+            return False
+        size = dest.stat().st_size
+        if not r.ok or r.headers.get("Content-Length") != str(size):
+            return False
+        self.manifest.update(name, url=url, etag=r.headers.get("ETag"), last_modified=r.headers.get("Last-Modified"),
+                             size=size, sha256=sha256_file(dest), complete=True, fetched_at=time.time())
+        return True
+
+    def _is_intact(self, dest, entry):
+        if dest.stat().st_size != entry.get("size"):
+            return False
+        return not self.verify or sha256_file(dest) == entry.get("sha256")
+
+    def _revalidate(self, name, url, dest, entry):
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        if not headers:
+            return "cached"  # nothing to revalidate against, size matched
+        try:
+            r = self.session.head(url, headers=headers, timeout=self.timeout, allow_redirects=True)
+        except requests.RequestException as e:
+            tqdm.write(f"⚠️ Could not revalidate {dest.name} ({e}), keeping local copy")
+            return "cached"
+        if r.status_code == 304:
+            return "not-modified"
+        if not r.ok:
+            return "cached"
+        # Some servers ignore conditionals on HEAD, compare validators ourselves
+        if entry.get("etag"):
+            unchanged = r.headers.get("ETag") == entry["etag"]
+        else:
+            unchanged = r.headers.get("Last-Modified") == entry["last_modified"]
+        if unchanged:
+            return "not-modified"
+        tqdm.write(f"↻ {dest.name} changed upstream")
+        return self._download(name, url, dest, {})
+
+    def _download(self, name, url, dest, entry):
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        part = dest.with_name(dest.name + ".part")
+        offset = part.stat().st_size if part.exists() else 0
+        validator = entry.get("etag") or entry.get("last_modified")
+        headers = {}
+        if offset and validator and entry.get("url") == url:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+        else:
+            offset = 0
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+            if r.status_code == 416:
+                # Range beyond end: the partial is stale, start over
+                part.unlink(missing_ok=True)
+                return self._download(name, url, dest, {})
+            r.raise_for_status()
+            resumed = r.status_code == 206
+            if not resumed:
+                offset = 0
+            etag = r.headers.get("ETag")
+            last_modified = r.headers.get("Last-Modified")
+            self.manifest.update(name, url=url, etag=etag, last_modified=last_modified, complete=False)
+
+            h = hashlib.sha256()
+            if resumed:
+                with open(part, "rb") as f:
+                    for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                        h.update(block)
+            expected = r.headers.get("Content-Length")
+            written = 0
+            with open(part, "ab" if resumed else "wb") as f:
+                for block in r.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(block)
+                    h.update(block)
+                    written += len(block)
+            if expected is not None and written != int(expected):
+                raise IOError(f"short read ({written}/{expected} bytes), will resume next run")
+
+        size = offset + written
+        if dest.suffix == ".pdf":
+            with open(part, "rb") as f:
+                if f.read(5) != b"%PDF-":
+                    part.unlink()
+                    raise IOError("response is not a PDF (blocked or moved?)")
+        os.replace(part, dest)
+        self.manifest.update(name, size=size, sha256=h.hexdigest(), complete=True, fetched_at=time.time())
+        return "resumed" if resumed else "downloaded"
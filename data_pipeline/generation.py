@@ -0,0 +1,344 @@
+# generation.py - batched prompt → completion engine with pluggable backends
+import copy
+import hashlib
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from pair_parser import PairParser, PairStopper
+
+
+class Backend:
+    name = "base"
+
+    def count_tokens(self, prompts):
+        # Rough default (~4 chars/token); backends with a tokenizer override this
+        return [max(1, len(p) // 4) for p in prompts]
+
+    def set_prefix(self, prefix):
+        # Shared prompt preamble; backends that can reuse its KV cache override this
+        pass
+
+    def generate(self, prompts, params):
+        # -> [{"text", "prompt_tokens", "completion_tokens", "stop_reason"}] in prompt order.
+        # params["stop_after_pairs"] (optional): stop each completion early once that many
+        # valid pairs have streamed out, or once it has derailed (see pair_parser.py)
+        raise NotImplementedError
+
+
+class TransformersBackend(Backend):
+    # The Unsloth/transformers model stage 4 always used, now fed left-padded batches
+    name = "unsloth"
+
+    def __init__(self, model, tokenizer, device="cuda"):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.prefix = None
+        self.prefix_ids_list = None
+        self.prefix_cache = None
+        self.prefix_hits = 0  # prompts served from the prefix cache
+        self.prep_tokenizer = None  # own copy for the prefetch thread (HF fast tokenizers aren't thread-safe)
+        self.encoded = {}  # prompt -> ids from count_tokens, so generate() doesn't tokenize twice
+
+    @classmethod
+    def from_unsloth(cls, model_name, max_seq_length=8192, load_in_4bit=True, device="cuda"):
+        from unsloth import FastLanguageModel
+        model, tokenizer = FastLanguageModel.from_pretrained(
+            model_name=model_name,
+            max_seq_length=max_seq_length,
+            dtype=None,
+            load_in_4bit=load_in_4bit,
+        )
+        FastLanguageModel.for_inference(model)
+        return cls(model, tokenizer, device=device)
+
+    def count_tokens(self, prompts):
+        if self.prep_tokenizer is None:
+            self.prep_tokenizer = copy.deepcopy(self.tokenizer)
+        ids = self.prep_tokenizer(prompts)["input_ids"]
+        if len(self.encoded) > 4096:
+            self.encoded.clear()  # prompts that never reached generate()
+        self.encoded.update(zip(prompts, ids))
+        return [len(row) for row in ids]
+
+    def set_prefix(self, prefix):
+        # Prefill the shared preamble once; every batch starts from a copy of this cache
+        import torch
+        self.prefix = prefix
+        self.prefix_ids_list = self.tokenizer(prefix)["input_ids"]
+        prefix_ids = torch.tensor([self.prefix_ids_list], device=self.device)
+        with torch.no_grad():
+            self.prefix_cache = self.model(input_ids=prefix_ids, use_cache=True).past_key_values
+
+    def _encode(self, prompts):
+        ids = [self.encoded.pop(p, None) for p in prompts]
+        missing = [p for p, row in zip(prompts, ids) if row is None]
+        if missing:
+            fresh = iter(self.tokenizer(missing)["input_ids"])
+            ids = [row if row is not None else next(fresh) for row in ids]
+        if self.prefix_cache is not None:
+            # Whole prompts are tokenized (so ids match the uncached path exactly); the cache
+            # is only used when every row really starts with the prefix tokens
+            n = len(self.prefix_ids_list)
+            if all(len(row) > n and row[:n] == self.prefix_ids_list for row in ids):
+                self.prefix_hits += len(ids)
+                return self._encode_with_prefix([row[n:] for row in ids])
+        return self.tokenizer.pad({"input_ids": ids}, return_tensors="pt").to(self.device), {}
+
+    def _encode_with_prefix(self, suffixes):
+        # [prefix | left padding | chunk]: the padding sits after the cached prefix and is
+        # masked out; generate() derives position ids from the mask, so chunk positions
+        # continue right after the prefix and only the chunk tokens are prefilled.
+        import torch
+        n = len(self.prefix_ids_list)
+        width = max(len(s) for s in suffixes)
+        pad = self.tokenizer.pad_token_id
+        input_ids = [self.prefix_ids_list + [pad] * (width - len(s)) + s for s in suffixes]
+        attention_mask = [[1] * n + [0] * (width - len(s)) + [1] * len(s) for s in suffixes]
+        inputs = {
+            "input_ids": torch.tensor(input_ids, device=self.device),
+            "attention_mask": torch.tensor(attention_mask, device=self.device),
+        }
+        cache = copy.deepcopy(self.prefix_cache)
+        cache.batch_repeat_interleave(len(suffixes))
+        return inputs, {"past_key_values": cache}
+
+    def generate(self, prompts, params):
+        inputs, extra = self._encode(prompts)
+        stopper = None
+        if params.get("stop_after_pairs"):
+            stopper = PairStopper(self.tokenizer, len(prompts), params["stop_after_pairs"])
+            extra["stopping_criteria"] = [stopper]
+        outputs = self.model.generate(
+            **inputs,
+            **extra,
+            max_new_tokens=params["max_new_tokens"],
+            temperature=params["temperature"],
+            top_p=params["top_p"],
+            do_sample=params.get("do_sample", True),
+            repetition_penalty=params["repetition_penalty"],
+            pad_token_id=self.tokenizer.pad_token_id,
+        )
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+        prompt_lens = inputs["attention_mask"].sum(dim=1).tolist()
+        stop_reasons = stopper.stop_reasons() if stopper else [None] * len(prompts)
+        results = []
+        for row, prompt_tokens, stop_reason in zip(new_tokens, prompt_lens, stop_reasons):
+            completion = int((row != self.tokenizer.pad_token_id).sum())
+            results.append({
+                "text": self.tokenizer.decode(row, skip_special_tokens=True),
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion,
+                "stop_reason": stop_reason,
+            })
+        return results
+
+
+class OpenAIBackend(Backend):
+    # Any OpenAI-compatible /v1/completions server (Ollama, llama.cpp server, vLLM)
+    name = "openai"
+
+    def __init__(self, base_url, model, api_key=None, timeout=600):
+        self.url = base_url.rstrip("/") + "/completions"
+        self.model = model
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+        self.timeout = timeout
+        self.cache_prompt = False
+
+    def set_prefix(self, prefix):
+        # llama.cpp server keeps the shared prefix in its slot KV cache when asked to
+        self.cache_prompt = True
+
+    def _complete(self, prompt, params):
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "max_tokens": params["max_new_tokens"],
+            "temperature": params["temperature"],
+            "top_p": params["top_p"],
+            "repeat_penalty": params["repetition_penalty"],
+        }
+        if self.cache_prompt:
+            payload["cache_prompt"] = True
+        if params.get("stop_after_pairs"):
+            return self._complete_stream(prompt, payload, PairParser(params["stop_after_pairs"]))
+        r = self.session.post(self.url, timeout=self.timeout, json=payload)
+        r.raise_for_status()
+        body = r.json()
+        usage = body.get("usage", {})
+        text = body["choices"][0]["text"]
+        return {
+            "text": text,
+            "prompt_tokens": usage.get("prompt_tokens", len(prompt) // 4),
+            "completion_tokens": usage.get("completion_tokens", len(text) // 4),
+            "stop_reason": None,
+        }
+
+    def _complete_stream(self, prompt, payload, parser):
+        # SSE stream; dropping the connection once the parser is satisfied aborts the
+        # request on the server (llama.cpp, vLLM and Ollama all cancel on disconnect)
+        payload["stream"] = True
+        pieces = []
+        with self.session.post(self.url, timeout=self.timeout, json=payload, stream=True) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                piece = choices[0].get("text") or ""
+                pieces.append(piece)  # one event per token on the servers above
+                if parser.feed(piece):
+                    break
+        text = "".join(pieces)
+        return {
+            "text": text,
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(pieces),
+            "stop_reason": parser.stop_reason,
+        }
+
+    def generate(self, prompts, params):
+        # The server does its own continuous batching; we just keep a batch in flight
+        with ThreadPoolExecutor(max_workers=len(prompts)) as pool:
+            return list(pool.map(lambda p: self._complete(p, params), prompts))
+
+
+class StubBackend(Backend):
+    # Deterministic fake model: same prompt → same JSONL, no GPU, no network
+    name = "stub"
+
+    def __init__(self, pairs_per_chunk=8):
+        self.pairs_per_chunk = pairs_per_chunk
+
+    def count_tokens(self, prompts):
+        return [len(p.split()) for p in prompts]
+
+    def generate(self, prompts, params):
+        results = []
+        for prompt in prompts:
+            rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+            words = prompt.split() or ["STM32"]
+            lines = []
+            # Like a real model, keeps going past the requested count unless stopped
+            for _ in range(self.pairs_per_chunk + 2):
+                question = " ".join(rng.choice(words) for _ in range(12))
+                answer = " ".join(rng.choice(words) for _ in range(rng.randint(40, 120)))
+                lines.append(json.dumps({"conversations": [
+                    {"from": "user", "value": f"How do I use {question}?"},
+                    {"from": "assistant", "value": f"```c\n// {answer}\n```"},
+                ]}))
+            lines.append("Let me know if you need more examples for this board!")
+            stop_reason = None
+            if params.get("stop_after_pairs"):
+                parser = PairParser(params["stop_after_pairs"])
+                for n, line in enumerate(lines):
+                    if parser.feed(line + "\n"):
+                        lines = lines[:n + 1]
+                        break
+                stop_reason = parser.stop_reason
+            text = "\n".join(lines)
+            completion = min(len(text.split()), params["max_new_tokens"])
+            results.append({"text": text, "prompt_tokens": len(words), "completion_tokens": completion,
+                            "stop_reason": stop_reason})
+        return results
+
+
+def make_backend(name, config, args=None):
+    if name == "unsloth":
+        return TransformersBackend.from_unsloth(config["gen_model"], max_seq_length=config["gen_max_seq_length"])
+    if name == "openai":
+        return OpenAIBackend(getattr(args, "endpoint", None) or config["openai_base_url"],
+                             getattr(args, "endpoint_model", None) or config["openai_model"])
+    if name == "stub":
+        return StubBackend(config["pairs_per_chunk"])
+    raise ValueError(f"unknown backend {name}")
+
+
+class GenerationEngine:
+    # Buckets prompts by token length and sizes each batch so that
+    # batch_size * (longest prompt + max_new_tokens) stays inside max_batch_tokens.
+    def __init__(self, backend, params, max_batch_size=8, max_batch_tokens=32768, bucket_width=256):
+        self.backend = backend
+        self.params = params
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.bucket_width = bucket_width
+        self.stats = {"prompts": 0, "batches": 0, "prompt_tokens": 0, "padded_prompt_tokens": 0,
+                      "completion_tokens": 0, "seconds": 0.0}
+
+    def plan_batches(self, items):
+        # items: [(key, prompt, n_tokens)] -> [[item, ...], ...], shortest prompts first
+        buckets = {}
+        for item in items:
+            buckets.setdefault(-(-item[2] // self.bucket_width), []).append(item)
+        batches = []
+        for bucket in sorted(buckets):
+            batch = []
+            for item in sorted(buckets[bucket], key=lambda it: it[2]):
+                cost = (len(batch) + 1) * (item[2] + self.params["max_new_tokens"])  # sorted, so item is the longest
+                if batch and (len(batch) >= self.max_batch_size or cost > self.max_batch_tokens):
+                    batches.append(batch)
+                    batch = []
+                batch.append(item)
+            if batch:
+                batches.append(batch)
+        return batches
+
+    def run(self, items, window=256):
+        # items: iterable of (key, prompt); yields (key, result) a batch at a time.
+        # Prompts are planned in windows so callers can stop early (target_pairs).
+        pending = []
+        for key, prompt in items:
+            pending.append((key, prompt))
+            if len(pending) >= window:
+                yield from self._run_window(pending)
+                pending = []
+        if pending:
+            yield from self._run_window(pending)
+
+    def _run_window(self, pending):
+        counts = self.backend.count_tokens([p for _, p in pending])
+        for batch in self.plan_batches([(k, p, n) for (k, p), n in zip(pending, counts)]):
+            results = self.generate_batch(batch)
+            for (key, _, _), result in zip(batch, results):
+                yield key, result
+
+    def generate_batch(self, batch):
+        # batch: [(key, prompt, n_tokens)] from plan_batches -> results in the same order
+        start = time.perf_counter()
+        try:
+            results = self.backend.generate([p for _, p, _ in batch], self.params)
+        except Exception as e:
+            # Report the whole batch as failed and keep going (e.g. OOM, endpoint down)
+            print(f"⚠️ Batch of {len(batch)} failed: {e}")
+            results = [{"text": "", "error": str(e), "prompt_tokens": 0, "completion_tokens": 0, "stop_reason": None}] * len(batch)
+        self.stats["seconds"] += time.perf_counter() - start
+        self.stats["prompts"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["prompt_tokens"] += sum(n for _, _, n in batch)
+        self.stats["padded_prompt_tokens"] += len(batch) * max(n for _, _, n in batch)
+        self.stats["completion_tokens"] += sum(r["completion_tokens"] for r in results)
+        return results
+
+    def throughput(self):
+        s = self.stats
+        secs = s["seconds"] or 1e-9
+        return {
+            "backend": self.backend.name,
+            "prompts": s["prompts"],
+            "batches": s["batches"],
+            "prompts_per_s": s["prompts"] / secs,
+            "tokens_per_s": (s["prompt_tokens"] + s["completion_tokens"]) / secs,
+            "completion_tokens_per_s": s["completion_tokens"] / secs,
+            "padding_efficiency": s["prompt_tokens"] / s["padded_prompt_tokens"] if s["padded_prompt_tokens"] else 1.0,
+        }
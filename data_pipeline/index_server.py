@@ -0,0 +1,109 @@
+# index_server.py - small local HTTP API over the BM25 chunk index (data/index)
+#   GET  /search?q=HAL_TIM_PWM_Start&k=5   -> {"results": [{"chunk", "score", "text"}], "took_ms"}
+#   GET  /context?q=...&k=3                -> {"context": "..."} ready to paste into a prompt
+#   POST /v1/chat/completions              -> OpenAI-compatible proxy to openai_base_url (Ollama
+#        serving the Modelfile) that first puts the top-k chunks for the last user message
+#        into a system message. Point Continue.dev at http://127.0.0.1:8765/v1 to use it.
+#   GET  /health
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import requests
+from config import CONFIG
+from bm25_index import BM25Index
+
+
+def format_context(index, query, k=3, max_chars=6000):
+    parts, used = [], 0
+    for name, _ in index.search(query, k=k):
+        text = index.text(name)[:max_chars - used]
+        if not text:
+            break
+        parts.append(f"--- {name} ---\n{text}")
+        used += len(text)
+    return "\n\n".join(parts)
+
+
+def make_handler(index, upstream, k, max_chars):
+    class Handler(BaseHTTPRequestHandler):
+        def _json(self, obj, status=200):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            q = parse_qs(url.query)
+            query = q.get("q", [""])[0]
+            n = int(q.get("k", [k])[0])
+            start = time.perf_counter()
+            if url.path == "/health":
+                self._json({"ok": True, "chunks": len(index)})
+            elif url.path == "/search":
+                hits = index.search(query, k=n)
+                self._json({"results": [{"chunk": name, "score": round(score, 4), "text": index.text(name)} for name, score in hits],
+                            "took_ms": round((time.perf_counter() - start) * 1000, 2)})
+            elif url.path == "/context":
+                self._json({"context": format_context(index, query, n, max_chars),
+                            "took_ms": round((time.perf_counter() - start) * 1000, 2)})
+            else:
+                self._json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            if urlparse(self.path).path.rstrip("/") != "/v1/chat/completions":
+                return self._json({"error": "not found"}, 404)
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            messages = body.get("messages", [])
+            question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+            if isinstance(question, list):  # content parts
+                question = " ".join(p.get("text", "") for p in question if isinstance(p, dict))
+            context = format_context(index, question, k, max_chars)
+            if context:
+                note = {"role": "system", "content": "Reference material from the STM32 documentation and examples:\n\n" + context}
+                body["messages"] = [note] + messages
+            try:
+                upstream_resp = requests.post(f"{upstream.rstrip('/')}/chat/completions", json=body,
+                                              stream=bool(body.get("stream")), timeout=600)
+            except requests.RequestException as e:
+                return self._json({"error": f"upstream unreachable: {e}"}, 502)
+            self.send_response(upstream_resp.status_code)
+            self.send_header("Content-Type", upstream_resp.headers.get("Content-Type", "application/json"))
+            self.end_headers()  # HTTP/1.0: the body ends when the connection closes, so streams pass straight through
+            for block in upstream_resp.iter_content(chunk_size=None):
+                self.wfile.write(block)
+                self.wfile.flush()
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Query API over the BM25 chunk index")
+    parser.add_argument("--index", default=CONFIG["index_dir"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=CONFIG["index_server_port"])
+    parser.add_argument("--upstream", default=CONFIG["openai_base_url"], help="OpenAI-compatible server the chat proxy forwards to")
+    parser.add_argument("--k", type=int, default=3, help="chunks injected per chat request")
+    parser.add_argument("--max-context-chars", type=int, default=6000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = BM25Index(args.index)
+    print(f"✓ Index {args.index}: {len(index)} chunks, {index.meta['terms']} terms (loaded in {(time.perf_counter() - start) * 1000:.0f} ms)")
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(index, args.upstream, args.k, args.max_context_chars))
+    print(f"Serving on http://{args.host}:{args.port} (search, context, /v1/chat/completions → {args.upstream})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
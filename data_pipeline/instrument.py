@@ -0,0 +1,187 @@
+# instrument.py - per-stage timing / memory / IO / throughput, written as a JSON run report
+# Usage: decorate a stage entry point with @instrumented("stage_3_chunk") and call
+# count("chunks", n) / note("dedup", {...}) from anywhere while it runs (any thread).
+# Outside an instrumented stage both are no-ops, so library modules can call them freely.
+# Pool workers that aren't our children (forkserver / spawn start them from a server
+# process, so RUSAGE_CHILDREN never sees them) report their usage with worker_usage().
+# CPU time and IO bytes are process-wide: when main.py runs nodes concurrently their
+# reports overlap.
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from config import CONFIG
+
+_active = []  # running StageRuns (main.py runs independent stages side by side)
+_lock = threading.Lock()
+
+
+def peak_rss_mb(children=False):
+    if sys.platform == "win32":
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2**20
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10  # bytes on macOS, KiB on Linux
+
+
+def io_bytes():
+    # Bytes this process asked to read / write (incl. page-cache hits), where the OS reports it
+    try:
+        import psutil
+        c = psutil.Process().io_counters()
+        return getattr(c, "read_chars", c.read_bytes), getattr(c, "write_chars", c.write_bytes)
+    except (ImportError, AttributeError, OSError):
+        return None, None
+
+
+def cpu_times():
+    # (this process, finished child processes) user+sys seconds
+    t = os.times()
+    return t.user + t.system, t.children_user + t.children_system
+
+
+def add_instrument_args(parser):
+    parser.add_argument("--profile", action="store_true", help="run under cProfile; top functions go into the run report")
+    parser.add_argument("--trace-mem", action="store_true", help="track Python allocations with tracemalloc (slow)")
+
+
+class StageRun:
+    def __init__(self, stage, args=None):
+        self.stage = stage
+        self.thread = threading.get_ident()
+        self.args = args
+        self.items = {}
+        self.notes = {}
+        self.worker_cpu_s = 0.0
+        self.worker_peak_rss_mb = 0.0
+        self.profile = getattr(args, "profile", False)
+        self.trace_mem = getattr(args, "trace_mem", False)
+
+    def count(self, name, n=1):
+        with _lock:
+            self.items[name] = self.items.get(name, 0) + n
+
+    def note(self, key, value):
+        with _lock:
+            self.notes[key] = value
+
+    def worker_usage(self, cpu_s, peak_rss_mb):
+        with _lock:
+            self.worker_cpu_s += cpu_s
+            self.worker_peak_rss_mb = max(self.worker_peak_rss_mb, peak_rss_mb)
+
+    def __enter__(self):
+        self.started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.io0 = io_bytes()
+        self.cpu0 = cpu_times()
+        self.t0 = time.perf_counter()
+        if self.trace_mem:
+            tracemalloc.start(10)
+        self.profiler = cProfile.Profile() if self.profile else None
+        if self.profiler:
+            self.profiler.enable()
+        _active.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.t0
+        _active.remove(self)
+        if self.profiler:
+            self.profiler.disable()
+        cpu1 = cpu_times()
+        io1 = io_bytes()
+        report = {
+            "stage": self.stage,
+            "started_at": self.started_at,
+            "status": "ok" if exc_type is None else f"error: {exc_type.__name__}: {exc}",
+            "args": dict(vars(self.args)) if self.args is not None else {},
+            "wall_s": round(wall, 3),
+            "cpu_s": round(cpu1[0] - self.cpu0[0], 3),
+            # Child processes we waited for (compilers, fork pools) + what pool workers reported
+            "children_cpu_s": round(cpu1[1] - self.cpu0[1] + self.worker_cpu_s, 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "children_peak_rss_mb": round(max(peak_rss_mb(children=True) if sys.platform != "win32" else 0.0,
+                                              self.worker_peak_rss_mb), 1),
+            "read_bytes": io1[0] - self.io0[0] if io1[0] is not None else None,
+            "write_bytes": io1[1] - self.io0[1] if io1[1] is not None else None,
+            "items": dict(self.items),
+            "items_per_s": {k: round(v / wall, 3) for k, v in self.items.items()} if wall > 0 else {},
+            "notes": self.notes,
+        }
+        if self.profiler:
+            report["profile"] = self._profile_top(CONFIG["reports_dir"])
+        if self.trace_mem:
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:15]
+            tracemalloc.stop()
+            report["tracemalloc"] = {"current_mb": round(current / 2**20, 1), "peak_mb": round(peak / 2**20, 1),
+                                     "top": [f"{s.traceback} {s.size / 2**20:.1f} MB ({s.count} blocks)" for s in top]}
+        self.write(report)
+        return False
+
+    def _profile_top(self, out_dir):
+        stamp = self.started_at.replace(":", "")
+        path = Path(out_dir) / "profiles" / f"{self.stage}-{stamp}.prof"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.profiler.dump_stats(path)  # open with snakeviz / pstats
+        buf = io.StringIO()
+        pstats.Stats(self.profiler, stream=buf).sort_stats("cumulative").print_stats(25)
+        return {"file": str(path), "top_cumulative": buf.getvalue().splitlines()}
+
+    def write(self, report):
+        runs = Path(CONFIG["reports_dir"]) / "runs"
+        runs.mkdir(parents=True, exist_ok=True)
+        path = runs / f"{self.stage}-{self.started_at.replace(':', '')}-{os.getpid()}.json"
+        path.write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+        rates = ", ".join(f"{v:,} {k} ({report['items_per_s'].get(k, 0):.1f}/s)" for k, v in report["items"].items())
+        mb = lambda b: f"{b / 2**20:.0f} MB" if b is not None else "?"  # noqa: E731
+        print(f"[{self.stage}] {report['wall_s']:.1f}s wall, {report['cpu_s'] + report['children_cpu_s']:.1f}s CPU, "
+              f"peak RSS {report['peak_rss_mb']:.0f} MB, read {mb(report['read_bytes'])}, wrote {mb(report['write_bytes'])}"
+              + (f"; {rates}" if rates else "") + f" → {path}")
+
+
+def _current():
+    # The run started on this thread, else the most recent one (worker threads of a stage)
+    runs = list(_active)
+    for run in reversed(runs):
+        if run.thread == threading.get_ident():
+            return run
+    return runs[-1] if runs else None
+
+
+def count(name, n=1):
+    run = _current()
+    if run:
+        run.count(name, n)
+
+
+def note(key, value):
+    run = _current()
+    if run:
+        run.note(key, value)
+
+
+def worker_usage(cpu_s, peak_rss_mb):
+    # CPU seconds / peak RSS a pool worker measured for its task (pdf_extract.py's shards)
+    run = _current()
+    if run:
+        run.worker_usage(cpu_s, peak_rss_mb)
+
+
+def instrumented(stage):
+    # Wraps a stage_N_xxx(args) entry point in a StageRun
+    def wrap(fn):
+        @functools.wraps(fn)
+        def run(args, *a, **kw):
+            with StageRun(stage, args):
+                return fn(args, *a, **kw)
+        return run
+    return wrap
@@ -0,0 +1,98 @@
+# ledger.py - crash-safe record of which stage 4 chunks are done
+# Append-only JSONL: every state change is one line, flushed and fsynced before we move
+# on, and the last line for a key wins. A torn final line (crash mid-write) is ignored.
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+
+def job_key(chunk_text, params):
+    # Same chunk + same generation settings → same key, whatever the file is called
+    h = hashlib.sha256(chunk_text.encode("utf-8"))
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class JobLedger:
+    def __init__(self, path, max_attempts=3):
+        self.path = Path(path)
+        self.max_attempts = max_attempts
+        self.jobs = {}
+        self.session_start = time.time()
+        self.session_done = 0
+        self._load()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._compact()
+        self.f = open(self.path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # torn write from a crash
+                self.jobs[rec["key"]] = rec
+
+    def _compact(self):
+        # One line per key, rewritten atomically, so the log doesn't grow across restarts
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for rec in self.jobs.values():
+                f.write(json.dumps(rec) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _append(self, rec):
+        self.jobs[rec["key"]] = rec
+        self.f.write(json.dumps(rec) + "\n")
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+    def is_done(self, key):
+        return self.jobs.get(key, {}).get("status") == "done"
+
+    def should_run(self, key):
+        rec = self.jobs.get(key)
+        if rec is None:
+            return True
+        return rec["status"] != "done" and rec.get("attempts", 0) < self.max_attempts
+
+    def mark_done(self, key, chunk, pairs, tokens=0):
+        attempts = self.jobs.get(key, {}).get("attempts", 0) + 1
+        self._append({"key": key, "chunk": chunk, "status": "done", "attempts": attempts,
+                      "pairs": pairs, "tokens": tokens, "ts": time.time()})
+        self.session_done += 1
+
+    def mark_failed(self, key, chunk, error):
+        attempts = self.jobs.get(key, {}).get("attempts", 0) + 1
+        self._append({"key": key, "chunk": chunk, "status": "failed", "attempts": attempts,
+                      "error": str(error)[:500], "ts": time.time()})
+
+    def pairs_done(self, keys):
+        return sum(self.jobs[k].get("pairs", 0) for k in keys if self.is_done(k))
+
+    def progress(self, keys):
+        # Done / failed-for-good / remaining over this run's chunk set, ETA from this session's rate
+        done = sum(1 for k in keys if self.is_done(k))
+        gave_up = sum(1 for k in keys if not self.is_done(k) and not self.should_run(k))
+        remaining = len(keys) - done - gave_up
+        elapsed = time.time() - self.session_start
+        rate = self.session_done / elapsed if elapsed > 0 else 0.0
+        eta = remaining / rate if rate > 0 else None
+        return {"total": len(keys), "done": done, "gave_up": gave_up, "remaining": remaining,
+                "chunks_per_min": rate * 60, "eta_s": eta}
+
+    def format_progress(self, keys):
+        p = self.progress(keys)
+        eta = time.strftime("%H:%M:%S", time.gmtime(p["eta_s"])) if p["eta_s"] is not None else "?"
+        return (f"[ledger] {p['done']}/{p['total']} chunks done, {p['gave_up']} failed for good, "
+                f"{p['chunks_per_min']:.1f} chunks/min, ETA {eta}")
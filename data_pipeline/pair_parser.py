@@ -0,0 +1,125 @@
+# pair_parser.py - incremental JSONL parser for stage 4 output + early-stop criterion
+# Scans text as it streams in, tracking brace depth outside/inside JSON strings, so nested
+# objects and braces inside code samples are handled. Each top-level {...} is validated
+# as soon as it closes; the caller can stop generation once enough pairs have arrived.
+import json
+
+
+def valid_pair(ex):
+    convs = ex.get("conversations") if isinstance(ex, dict) else None
+    if not isinstance(convs, list) or len(convs) < 2:
+        return False
+    return all(isinstance(t, dict) and isinstance(t.get("from"), str) and isinstance(t.get("value"), str) for t in convs)
+
+
+class PairParser:
+    # target: stop once this many valid pairs are in (None = never)
+    # max_garbage: non-whitespace chars outside any object before we call it derailed
+    # max_bad_run: consecutive objects that fail to parse/validate before we call it derailed
+    # (both are for stopping generation early; None = never derail, for parsing a finished output)
+    def __init__(self, target=None, max_garbage=400, max_bad_run=3):
+        self.target = target
+        self.max_garbage = max_garbage
+        self.max_bad_run = max_bad_run
+        self.pairs = []
+        self.invalid = 0
+        self.bad_run = 0
+        self.garbage = 0
+        self.chars = 0        # everything fed so far
+        self.valid_chars = 0  # chars inside objects that became pairs
+        self.stop_reason = None
+        self.obj = []
+        self.depth = 0
+        self.in_str = False
+        self.esc = False
+
+    def feed(self, text):
+        # Returns True once generation should stop
+        for ch in text:
+            if self.stop_reason:
+                break
+            self.chars += 1
+            if self.depth == 0:
+                if ch == "{":
+                    self.depth = 1
+                    self.obj = [ch]
+                elif not ch.isspace() and ch != "`":  # ``` fences are tolerated
+                    self.garbage += 1
+                    if self.max_garbage is not None and self.garbage > self.max_garbage:
+                        self.stop_reason = "derailed"
+                continue
+            self.obj.append(ch)
+            if self.in_str:
+                if self.esc:
+                    self.esc = False
+                elif ch == "\\":
+                    self.esc = True
+                elif ch == '"':
+                    self.in_str = False
+            elif ch == '"':
+                self.in_str = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self._close("".join(self.obj))
+        return self.stop_reason is not None
+
+    def _close(self, raw):
+        try:
+            ex = json.loads(raw, strict=False)  # models put raw newlines in code strings
+        except ValueError:
+            ex = None
+        if ex is not None and valid_pair(ex):
+            self.pairs.append(ex)
+            self.valid_chars += len(raw)
+            self.bad_run = 0
+            if self.target and len(self.pairs) >= self.target:
+                self.stop_reason = "target"
+        else:
+            self.invalid += 1
+            self.bad_run += 1
+            if self.max_bad_run is not None and self.bad_run >= self.max_bad_run:
+                self.stop_reason = "derailed"
+
+    def wasted_fraction(self):
+        # Share of the output that did not end up in a valid pair
+        return 1.0 - self.valid_chars / self.chars if self.chars else 0.0
+
+
+def parse_pairs(text):
+    # Every valid pair in a finished output: no derail limits, whatever surrounds them
+    parser = PairParser(max_garbage=None, max_bad_run=None)
+    parser.feed(text)
+    return parser.pairs
+
+
+class PairStopper:
+    # transformers stopping criterion: one PairParser per row, fed with incrementally
+    # detokenized text (prefix/read offsets as in vLLM, so multi-byte characters and
+    # leading spaces come out right). Rows stop independently.
+    def __init__(self, tokenizer, batch_size, target):
+        self.tokenizer = tokenizer
+        self.parsers = [PairParser(target) for _ in range(batch_size)]
+        self.ids = [[] for _ in range(batch_size)]
+        self.offsets = [(0, 0) for _ in range(batch_size)]
+
+    def __call__(self, input_ids, scores=None, **kwargs):
+        import torch
+        for i, tok in enumerate(input_ids[:, -1].tolist()):
+            parser = self.parsers[i]
+            if parser.stop_reason:
+                continue
+            ids = self.ids[i]
+            ids.append(tok)
+            prefix_offset, read_offset = self.offsets[i]
+            prefix_text = self.tokenizer.decode(ids[prefix_offset:read_offset], skip_special_tokens=True)
+            new_text = self.tokenizer.decode(ids[prefix_offset:], skip_special_tokens=True)
+            if len(new_text) > len(prefix_text) and not new_text.endswith("�"):
+                self.offsets[i] = (read_offset, len(ids))
+                parser.feed(new_text[len(prefix_text):])
+        return torch.tensor([p.stop_reason is not None for p in self.parsers], device=input_ids.device)
+
+    def stop_reasons(self):
+        return [p.stop_reason for p in self.parsers]
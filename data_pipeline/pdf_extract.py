@@ -0,0 +1,194 @@
+# pdf_extract.py - page-sharded PDF extraction with a (file hash, page) cache
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from tqdm import tqdm
+from downloader import sha256_file
+from instrument import count, cpu_times, peak_rss_mb, worker_usage
+
+BACKENDS = ("pymupdf4llm", "pymupdf", "pdftotext")
+
+
+def page_count(pdf_path):
+    try:
+        import pymupdf
+        with pymupdf.open(pdf_path) as doc:
+            return doc.page_count
+    except ImportError:
+        result = subprocess.run(['pdfinfo', str(pdf_path)], capture_output=True, text=True, timeout=60)
+        for line in result.stdout.splitlines():
+            if line.startswith("Pages:"):
+                return int(line.split()[1])
+        raise Exception(f"pdfinfo failed: {result.stderr}")
+
+
+def _pymupdf4llm_pages(pdf_path, pages):
+    import pymupdf4llm
+    chunks = pymupdf4llm.to_markdown(str(pdf_path), pages=pages, page_chunks=True, show_progress=False)
+    return [c["text"] for c in chunks]
+
+
+def _pymupdf_pages(pdf_path, pages):
+    import pymupdf
+    with pymupdf.open(pdf_path) as doc:
+        return [doc[p].get_text() for p in pages]
+
+
+def _pdftotext_pages(pdf_path, pages):
+    # pdftotext pages are 1-based and separated by form feeds
+    first, last = pages[0] + 1, pages[-1] + 1
+    result = subprocess.run(['pdftotext', '-f', str(first), '-l', str(last), str(pdf_path), '-'],
+                            capture_output=True, text=True, timeout=60)
+    if result.returncode != 0:
+        raise Exception(f"pdftotext failed: {result.stderr}")
+    texts = result.stdout.split("\f")
+    by_page = dict(zip(range(first - 1, last), texts))
+    return [by_page.get(p, "") for p in pages]
+
+
+EXTRACTORS = {
+    "pymupdf4llm": _pymupdf4llm_pages,
+    "pymupdf": _pymupdf_pages,
+    "pdftotext": _pdftotext_pages,
+}
+
+
+def extract_shard(pdf_path, pages, backend):
+    # Runs in a worker process; falls back to pdftotext if the in-process backend chokes.
+    # -> (results, backend used, (CPU seconds incl. pdftotext, worker peak RSS MB))
+    cpu0 = cpu_times()
+    try:
+        texts = EXTRACTORS[backend](pdf_path, pages)
+        used = backend
+    except Exception as e:
+        if backend == "pdftotext":
+            raise
+        print(f"⚠️ {Path(pdf_path).name} pages {pages[0]}-{pages[-1]}: {backend} failed ({e}), using pdftotext")
+        texts = _pdftotext_pages(pdf_path, pages)
+        used = "pdftotext"
+    cpu1 = cpu_times()
+    return list(zip(pages, texts)), used, (sum(cpu1) - sum(cpu0), peak_rss_mb())
+
+
+class PageCache:
+    # <cache_dir>/<backend>/<pdf stem>/<sha256>/<page>.md - one directory per file version.
+    # Pages the fallback backend produced go under its own directory: they stand in for the
+    # missing ones in the output but don't count as cached, so the next run retries them
+    def __init__(self, cache_dir, backend, fallback="pdftotext"):
+        self.cache_dir = Path(cache_dir) / backend
+        self.fallback_dir = Path(cache_dir) / fallback if fallback and fallback != backend else None
+
+    def doc_dir(self, stem, file_hash, fallback=False):
+        return (self.fallback_dir if fallback else self.cache_dir) / stem / file_hash
+
+    def missing_pages(self, stem, file_hash, n_pages):
+        d = self.doc_dir(stem, file_hash)
+        have = {int(p.stem) for p in d.glob("*.md")} if d.exists() else set()
+        return [p for p in range(n_pages) if p not in have]
+
+    def put(self, stem, file_hash, page, text, fallback=False):
+        d = self.doc_dir(stem, file_hash, fallback)
+        d.mkdir(parents=True, exist_ok=True)
+        tmp = d / f"{page:05d}.tmp"
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, d / f"{page:05d}.md")
+
+    def pages(self, stem, file_hash, n_pages):
+        d = self.doc_dir(stem, file_hash)
+        for p in range(n_pages):
+            path = d / f"{p:05d}.md"
+            if not path.exists() and self.fallback_dir:
+                path = self.doc_dir(stem, file_hash, fallback=True) / f"{p:05d}.md"
+            yield path.read_text(encoding="utf-8")
+
+    def prune(self, stem, keep_hash):
+        # Drop page caches of older versions of this document
+        for root in filter(None, (self.cache_dir, self.fallback_dir)):
+            for d in (root / stem).glob("*"):
+                if d.is_dir() and d.name != keep_hash:
+                    shutil.rmtree(d, ignore_errors=True)
+
+
+def file_hash(pdf_path, manifest_path=None):
+    # Reuse stage 1's manifest hash when the file on disk still matches it
+    if manifest_path and Path(manifest_path).exists():
+        try:
+            entry = json.loads(Path(manifest_path).read_text(encoding="utf-8")).get(Path(pdf_path).stem, {})
+        except ValueError:
+            entry = {}
+        if entry.get("complete") and entry.get("size") == Path(pdf_path).stat().st_size:
+            return entry["sha256"]
+    return sha256_file(pdf_path)
+
+
+def extract_pdfs(pdf_files, out_dir, cache_dir, backend="pymupdf4llm", pages_per_shard=32, workers=None, manifest_path=None):
+    # Shards every PDF into page ranges and runs them all through one process pool,
+    # so a 1700-page reference manual is spread across cores next to the small app notes.
+    cache = PageCache(cache_dir, backend)
+    docs = {}
+    for pdf_file in pdf_files:
+        try:
+            h = file_hash(pdf_file, manifest_path)
+            n = page_count(pdf_file)
+        except Exception as e:
+            print(f"⚠️ Failed {pdf_file.name}: {e}")
+            continue
+        missing = cache.missing_pages(pdf_file.stem, h, n)
+        docs[pdf_file] = {"hash": h, "pages": n, "missing": missing, "failed": False}
+        cached = n - len(missing)
+        print(f"Extracting {pdf_file.name}: {n} pages ({cached} cached)")
+        count("pdf_pages", n)
+        count("pdf_pages_cached", cached)
+
+    shards = []
+    for pdf_file, doc in docs.items():
+        missing = doc["missing"]
+        for i in range(0, len(missing), pages_per_shard):
+            shards.append((pdf_file, missing[i:i + pages_per_shard]))
+
+    fallbacks = 0
+    if shards:
+        # forkserver, not fork: main.py runs this next to other nodes' threads, and forking a
+        # multithreaded process can copy a lock some other thread holds
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=multiprocessing.get_context("forkserver")) as pool:
+            futures = {pool.submit(extract_shard, str(pdf_file), pages, backend): (pdf_file, pages) for pdf_file, pages in shards}
+            for fut in tqdm(as_completed(futures), total=len(futures), unit="shard"):
+                pdf_file, pages = futures[fut]
+                doc = docs[pdf_file]
+                try:
+                    results, used, usage = fut.result()
+                except Exception as e:
+                    tqdm.write(f"⚠️ Failed {pdf_file.name} pages {pages[0]}-{pages[-1]}: {e}")
+                    doc["failed"] = True
+                    continue
+                worker_usage(*usage)
+                fallbacks += used != backend
+                for page, text in results:
+                    cache.put(pdf_file.stem, doc["hash"], page, text, fallback=used != backend)
+
+    written = []
+    for pdf_file, doc in docs.items():
+        if doc["failed"]:
+            continue  # keep the pages we got cached, retry the rest next run
+        out_path = Path(out_dir) / f"pdf_{pdf_file.stem}.md"
+        chars = 0
+        tmp = out_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for i, text in enumerate(cache.pages(pdf_file.stem, doc["hash"], doc["pages"])):
+                if i:
+                    f.write("\n\n")
+                f.write(text)
+                chars += len(text)
+        os.replace(tmp, out_path)
+        cache.prune(pdf_file.stem, doc["hash"])
+        written.append(out_path)
+        print(f"✓ Extracted {pdf_file.name}: {chars} chars")
+    if fallbacks:
+        print(f"⚠️ {fallbacks} shards fell back to pdftotext")
+    count("pdfs", len(written))
+    count("pdf_shards_fallback", fallbacks)
+    return written
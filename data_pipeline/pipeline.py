@@ -0,0 +1,190 @@
+# pipeline.py - bounded-queue producer/consumer pipeline for stage 4
+#   prep thread:  read chunk + build prompt + tokenize (count_tokens)  ──► prep queue
+#   gen thread:   plan batches from whatever is queued, backend.generate ──► result queue
+#   post pool:    parse + write (caller's function), results handed back in the main thread
+# Bounded queues give backpressure both ways: prep stays at most `prefetch` prompts ahead
+# and generation stalls rather than piling up unprocessed results.
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+_END = object()
+
+
+class StageTimer:
+    def __init__(self):
+        self.busy = 0.0
+        self.items = 0
+        self.lock = threading.Lock()
+
+    def add(self, seconds, items=1):
+        with self.lock:
+            self.busy += seconds
+            self.items += items
+
+
+class TrackedQueue(queue.Queue):
+    # Samples depth on every put so we can report mean/max occupancy
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.samples = 0
+        self.depth_sum = 0
+        self.depth_max = 0
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        depth = self.qsize()
+        self.samples += 1
+        self.depth_sum += depth
+        self.depth_max = max(self.depth_max, depth)
+
+    def report(self):
+        return {"capacity": self.maxsize, "mean_depth": self.depth_sum / self.samples if self.samples else 0.0,
+                "max_depth": self.depth_max}
+
+
+class GenerationPipeline:
+    def __init__(self, engine, prepare, postprocess, prefetch=64, results=64, post_workers=4, window=256):
+        # prepare(item) -> (key, prompt); postprocess(key, result) -> anything
+        self.engine = engine
+        self.prepare = prepare
+        self.postprocess = postprocess
+        self.window = window
+        self.post_workers = post_workers
+        self.prep_q = TrackedQueue(prefetch)
+        self.result_q = TrackedQueue(results)
+        self.timers = {"prep": StageTimer(), "generate": StageTimer(), "post": StageTimer()}
+        self.stop = threading.Event()
+        self.error = None
+        self.wall = 0.0
+
+    def _put(self, q, item):
+        # Blocking put that gives up when the consumer has stopped (early exit / error)
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _prep(self, items):
+        try:
+            group = []
+            for item in items:
+                if self.stop.is_set():
+                    return
+                start = time.perf_counter()
+                group.append(self.prepare(item))
+                self.timers["prep"].add(time.perf_counter() - start, 0)
+                if len(group) >= self.engine.max_batch_size:
+                    self._prep_flush(group)
+                    group = []
+            if group:
+                self._prep_flush(group)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(self.prep_q, _END)
+
+    def _prep_flush(self, group):
+        # Tokenize a batch-sized group at once (fast tokenizers batch well)
+        start = time.perf_counter()
+        counts = self.engine.backend.count_tokens([p for _, p in group])
+        self.timers["prep"].add(time.perf_counter() - start, len(group))
+        for (key, prompt), n in zip(group, counts):
+            if not self._put(self.prep_q, (key, prompt, n)):
+                return
+
+    def _generate(self):
+        try:
+            done = False
+            while not done and not self.stop.is_set():
+                # Wait for one prompt, then take whatever else is already prepared (up to a
+                # window) so batches can still be bucketed by length
+                try:
+                    item = self.prep_q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                pending = []
+                while item is not _END:
+                    pending.append(item)
+                    if len(pending) >= self.window:
+                        break
+                    try:
+                        item = self.prep_q.get_nowait()
+                    except queue.Empty:
+                        break
+                done = item is _END
+                for batch in self.engine.plan_batches(pending):
+                    start = time.perf_counter()
+                    results = self.engine.generate_batch(batch)
+                    self.timers["generate"].add(time.perf_counter() - start, len(batch))
+                    for (key, _, _), result in zip(batch, results):
+                        if not self._put(self.result_q, (key, result)):
+                            return
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(self.result_q, _END)
+
+    def _post(self, key, result):
+        start = time.perf_counter()
+        out = self.postprocess(key, result)
+        self.timers["post"].add(time.perf_counter() - start)
+        return key, result, out
+
+    def run(self, items):
+        # Yields (key, result, postprocess output) in generation order. Breaking out of the
+        # loop stops the prep and generation threads after their current step.
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._prep, args=(items,), daemon=True),
+                   threading.Thread(target=self._generate, daemon=True)]
+        for t in threads:
+            t.start()
+        in_flight = deque()
+        try:
+            with ThreadPoolExecutor(max_workers=self.post_workers) as pool:
+                while True:
+                    try:
+                        item = self.result_q.get(timeout=0.05)
+                    except queue.Empty:
+                        # Hand back finished work while generation is busy on the next batch
+                        while in_flight and in_flight[0].done():
+                            yield in_flight.popleft().result()
+                        continue
+                    if item is _END:
+                        break
+                    in_flight.append(pool.submit(self._post, *item))
+                    while in_flight and (in_flight[0].done() or len(in_flight) >= 2 * self.post_workers):
+                        yield in_flight.popleft().result()
+                while in_flight:
+                    yield in_flight.popleft().result()
+            if self.error:
+                raise self.error
+        finally:
+            self.stop.set()
+            for t in threads:
+                t.join()
+            self.wall = time.perf_counter() - start
+
+    def metrics(self):
+        # Utilization = busy time / wall time (post is averaged over its workers); "serial"
+        # is what the same work would take one step after another, i.e. without the overlap
+        wall = self.wall or 1e-9
+        busy = {name: t.busy for name, t in self.timers.items()}
+        serial = sum(busy.values())
+        return {
+            "wall_s": self.wall,
+            "serial_s": serial,
+            "overlap_saved_s": max(0.0, serial - self.wall),
+            "utilization": {
+                "prep": busy["prep"] / wall,
+                "generate": busy["generate"] / wall,
+                "post": busy["post"] / (wall * self.post_workers),
+            },
+            "busy_s": busy,
+            "queues": {"prep": self.prep_q.report(), "results": self.result_q.report()},
+        }
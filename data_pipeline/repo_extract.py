@@ -0,0 +1,148 @@
+# repo_extract.py - stream tracked source files from a git checkout into one markdown file
+# Next to code_<repo>.md goes code_<repo>.files.json: the commit it was extracted at and
+# the byte range of every file's section. When the checkout moves to a new commit, only
+# files changed in between are read and rendered again; the rest is copied from the old
+# markdown.
+import json
+import mmap
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import git
+from instrument import count, peak_rss_mb
+from repo_sync import changed_files, head_commit
+
+CODE_GLOB = "*.[chmd]"  # .c .h .m .d, same pattern stage 2 always used
+
+
+def pathspecs(include_folders=None):
+    if include_folders:
+        return [f":(glob){folder.strip('/')}/**/{CODE_GLOB}" for folder in include_folders]
+    return [f":(glob)**/{CODE_GLOB}"]
+
+
+def tracked_files(repo_dir, include_folders=None):
+    # Ask the git index instead of walking the tree: no .git/, no build output, no untracked junk
+    repo_dir = Path(repo_dir)
+    folders = include_folders or ["."]
+    try:
+        repo = git.Repo(repo_dir)
+        out = repo.git.ls_files("-z", "--", *pathspecs(include_folders))
+        return [p for p in out.split("\0") if p]
+    except (git.InvalidGitRepositoryError, git.NoSuchPathError):
+        # Plain directory (e.g. unpacked archive): walk only the include folders
+        files = []
+        for folder in folders:
+            for root, dirs, names in os.walk(repo_dir / folder):
+                dirs[:] = sorted(d for d in dirs if d not in (".git", "__pycache__"))
+                for name in sorted(names):
+                    if Path(name).match(CODE_GLOB):
+                        files.append((Path(root) / name).relative_to(repo_dir).as_posix())
+        return files
+
+
+def _render(repo_dir, rel):
+    path = repo_dir / rel
+    try:
+        text = path.read_text(encoding='utf-8', errors='ignore')
+    except OSError:
+        return None  # e.g. outside a sparse checkout
+    return f"### File: {Path(rel)}\n```{path.suffix[1:]}\n{text}\n```\n"
+
+
+def sections_path(out_path):
+    return Path(out_path).with_suffix(".files.json")
+
+
+def extracted_commit(out_path):
+    # Commit code_<repo>.md was extracted at (None: unknown, extract again)
+    try:
+        return json.loads(sections_path(out_path).read_text(encoding="utf-8")).get("commit")
+    except (OSError, ValueError):
+        return None
+
+
+def _previous(repo_dir, out_path, include_folders, commit):
+    # -> ({path: [start, end]} in the old markdown, changed paths), or None: extract everything
+    try:
+        index = json.loads(sections_path(out_path).read_text(encoding="utf-8"))
+        size = Path(out_path).stat().st_size
+    except (OSError, ValueError):
+        return None
+    if not commit or not index.get("commit") or index.get("include_folders") != include_folders or index.get("bytes") != size or not size:
+        return None
+    changed = set() if index["commit"] == commit else changed_files(repo_dir, index["commit"], commit, pathspecs(include_folders))
+    if changed is None:
+        print(f"⚠️ {repo_dir.name}: can't diff {index['commit'][:10]}..{commit[:10]} (shallow clone?), extracting everything")
+        return None
+    return index["sections"], changed
+
+
+def extract_repo(repo_dir, out_path, include_folders=None, workers=8, incremental=True):
+    # Files are read on a thread pool but written strictly in index order through a
+    # bounded window, so memory holds at most `window` files regardless of repo size.
+    # incremental: reuse sections of files unchanged since the last extraction.
+    start = time.perf_counter()
+    repo_dir = Path(repo_dir)
+    files = tracked_files(repo_dir, include_folders)
+    commit = head_commit(repo_dir)
+    old_sections, changed = (_previous(repo_dir, out_path, include_folders, commit) if incremental else None) or ({}, set())
+    old_file = open(out_path, "rb") if old_sections else None
+    old = mmap.mmap(old_file.fileno(), 0, access=mmap.ACCESS_READ) if old_file else b""  # paged in as sections are copied
+
+    def job(rel):
+        span = old_sections.get(rel)
+        if span is not None and rel not in changed:
+            return old[span[0]:span[1]]
+        return pool.submit(_render, repo_dir, rel)
+
+    window = workers * 4
+    written = 0
+    n_files = 0
+    reused = 0
+    sections = {}
+    tmp = Path(out_path).with_suffix(".tmp")
+    with ThreadPoolExecutor(max_workers=workers) as pool, open(tmp, "wb") as f:
+        pending = deque()
+        paths = iter(files)
+        for rel in paths:
+            pending.append((rel, job(rel)))
+            if len(pending) >= window:
+                break
+        while pending:
+            rel, item = pending.popleft()
+            if isinstance(item, bytes):
+                data = item
+                reused += 1
+            else:
+                section = item.result()
+                data = section.encode("utf-8") if section is not None else None
+            nxt = next(paths, None)
+            if nxt is not None:
+                pending.append((nxt, job(nxt)))
+            if data is None:
+                continue
+            if n_files:
+                f.write(b"\n")
+                written += 1
+            sections[rel] = [written, written + len(data)]
+            f.write(data)
+            written += len(data)
+            n_files += 1
+    if old_file:
+        old.close()
+        old_file.close()
+    index = {"commit": commit, "include_folders": include_folders, "bytes": written, "sections": sections}
+    index_tmp = sections_path(out_path).with_suffix(".json.tmp")
+    index_tmp.write_text(json.dumps(index), encoding="utf-8")
+    os.replace(tmp, out_path)
+    os.replace(index_tmp, sections_path(out_path))
+    elapsed = time.perf_counter() - start
+    print(f"✓ {repo_dir.name}: {n_files}/{len(files)} tracked files, {written / 2**20:.1f} MB in {elapsed:.1f}s "
+          f"({n_files - reused} read, {reused} unchanged since the last extraction; peak RSS {peak_rss_mb():.0f} MB)")
+    count("source_files", n_files)
+    count("source_files_read", n_files - reused)
+    count("source_files_reused", reused)
+    return n_files
@@ -0,0 +1,100 @@
+# repo_sync.py - shallow, blobless, sparse clones of the source repos, updated in place
+# A clone fetches one commit (--depth), no file contents up front (--filter=blob:none) and
+# checks out only the include_folders (sparse cone), so blobs are downloaded for just the
+# files stage 2 reads. An existing clone is brought up to date with a fetch + reset to
+# the fetched commit instead of being deleted and cloned again. Submodules below the
+# include_folders are checked out too, just as shallow (STM32CubeF4's HAL driver and CMSIS
+# device headers are submodules).
+from pathlib import Path
+import git
+
+
+def remote_url(url):
+    # Local paths (e.g. a bare repo in a test) as file:// URLs: git ignores --depth and
+    # --filter for plain-path clones
+    path = Path(url).expanduser()
+    if "://" not in url and path.exists():
+        return path.resolve().as_uri()
+    return url
+
+
+def head_commit(repo_dir):
+    try:
+        return git.Repo(repo_dir).head.commit.hexsha
+    except (git.InvalidGitRepositoryError, git.NoSuchPathError, ValueError):
+        return None  # not a git checkout (or no commits)
+
+
+def set_sparse(repo, include_folders):
+    if include_folders:
+        repo.git.sparse_checkout("set", "--cone", *[folder.strip("/") for folder in include_folders])
+    else:
+        repo.git.sparse_checkout("disable")
+
+
+def update_submodules(repo, include_folders=None, depth=1):
+    # -> submodule paths initialized / updated to the commit the superproject records
+    try:
+        out = repo.git.config("-f", ".gitmodules", "--get-regexp", r"^submodule\..*\.path$")
+    except git.GitCommandError:
+        return []  # no .gitmodules
+    folders = [folder.strip("/") + "/" for folder in include_folders or []]
+    paths = [line.split(" ", 1)[1] for line in out.splitlines()]
+    paths = [p for p in paths if not folders or any((p + "/").startswith(f) for f in folders)]
+    if paths:
+        options = [f"--depth={depth}"] if depth else []
+        repo.git.submodule("update", "--init", *options, "--", *paths)
+    return paths
+
+
+def clone(url, path, include_folders=None, ref=None, depth=1):
+    options = ["--filter=blob:none", "--no-checkout"]
+    if depth:
+        options.append(f"--depth={depth}")
+    if ref:
+        options.append(f"--branch={ref}")
+    repo = git.Repo.clone_from(remote_url(url), path, multi_options=options)
+    set_sparse(repo, include_folders)
+    repo.git.reset("--hard", "HEAD")  # the index is empty after --no-checkout: this fills in the sparse tree
+    update_submodules(repo, include_folders, depth)
+    return repo
+
+
+def update(path, url, include_folders=None, ref=None, depth=1):
+    # -> (previous commit, new commit)
+    repo = git.Repo(path)
+    previous = head_commit(path)
+    repo.remotes.origin.set_url(remote_url(url))
+    set_sparse(repo, include_folders)  # include_folders may have changed since the clone
+    if not ref:
+        ref = "HEAD" if repo.head.is_detached else repo.active_branch.name
+    options = [f"--depth={depth}"] if depth else []
+    if repo.config_reader().has_option('remote "origin"', "promisor"):
+        options.append("--filter=blob:none")  # full clones from before this module stay full
+    repo.git.fetch(*options, "origin", ref)
+    repo.git.reset("--hard", "FETCH_HEAD")
+    update_submodules(repo, include_folders, depth)
+    return previous, repo.head.commit.hexsha
+
+
+def sync_repo(url, path, include_folders=None, ref=None, depth=1, refresh=False):
+    # -> {"status": cloned | updated | unchanged | present, "commit", "previous_commit"}
+    path = Path(path)
+    if not path.exists():
+        repo = clone(url, path, include_folders, ref, depth)
+        return {"status": "cloned", "commit": repo.head.commit.hexsha, "previous_commit": None}
+    commit = head_commit(path)
+    if not refresh or commit is None:  # plain directories (unpacked archives) are left alone
+        return {"status": "present", "commit": commit, "previous_commit": commit}
+    previous, commit = update(path, url, include_folders, ref, depth)
+    return {"status": "updated" if commit != previous else "unchanged", "commit": commit, "previous_commit": previous}
+
+
+def changed_files(repo_dir, old, new, pathspecs=()):
+    # Paths added, modified or deleted between two commits (renames count as delete + add).
+    # None when the diff can't be computed, e.g. the old commit is gone from a shallow clone.
+    try:
+        out = git.Repo(repo_dir).git.diff("--name-only", "--no-renames", "-z", old, new, "--", *pathspecs)
+    except (git.GitCommandError, git.InvalidGitRepositoryError, git.NoSuchPathError):
+        return None
+    return {p for p in out.split("\0") if p}
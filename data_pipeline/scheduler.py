@@ -0,0 +1,154 @@
+# scheduler.py - novelty-scored generation order for chunks (stage 3b)
+# Every chunk gets three cheap CPU features:
+#   density     share of non-boilerplate lines (license text, TOC dot leaders, empty
+#               CubeMX USER CODE markers, banner lines) times how much distinct
+#               vocabulary is left, so templates and near-empty files sink
+#   symbols     STM32 peripheral / HAL / LL / register names it mentions
+#   signature   MinHash signature (dedup.py), for redundancy with chunks already scheduled;
+#               its shingles are whole tokens, so the register tables of different
+#               peripherals share their layout but not their shingles
+# The order is built greedily; each pick maximizes
+#   density * (BASE_GAIN + log1p(symbols nobody scheduled yet covers)) * (1 - similarity)
+# Coverage gain and similarity can only get worse as chunks are scheduled, so a lazy
+# max-heap works: re-score the top chunk and take it if it still beats the runner-up.
+import heapq
+import math
+import re
+import time
+import numpy as np
+from dedup import MinHashLSH
+
+PERIPHERALS = ["ADC", "CAN", "CORTEX", "CRC", "CRYP", "DAC", "DBGMCU", "DCMI", "DMA2D", "DMA", "ETH",
+               "EXTI", "FLASH", "FMC", "FSMC", "GPIO", "HASH", "I2C", "I2S", "IWDG", "LTDC", "NVIC",
+               "OTG", "PCD", "PWR", "QSPI", "RCC", "RNG", "RTC", "SAI", "SDIO", "SPI", "SYSCFG",
+               "SysTick", "TIM", "UART", "USART", "USB", "WWDG"]
+_PERIPH = "|".join(sorted(PERIPHERALS, key=len, reverse=True))
+_INSTANCE = rf"(?:{_PERIPH})(?:\d{{1,2}}|x)?"  # TIM2, USART1, GPIOx
+SYMBOL_RE = re.compile(rf"\b(?:_*(?:HAL|LL)_[A-Za-z0-9_]+|GPIO[A-K]|{_INSTANCE}(?:_[A-Z0-9]+)+|{_INSTANCE})\b")
+FAMILY_RE = re.compile(rf"_*(?:(?:HAL|LL)_)?({_PERIPH})")
+WORD_RE = re.compile(r"[a-z_][a-z0-9_]{2,}")
+BOILERPLATE_RE = re.compile("|".join([
+    r"(?i:copyright|all rights reserved|licen[cs]e|spdx-license|permission is hereby|warrant|liabilit|redistribution)",
+    r"(?i:user code (?:begin|end))",
+    r"\.{5,}\s*\d+\s*$",  # table of contents: "8.4.1 GPIO port mode register ....... 281"
+    r"^\W*$",  # banners and separators: /*****, ----, ```
+]))
+BASE_GAIN = 0.25  # worth of a dense chunk that adds no new symbols
+DISTINCT_FULL = 150  # distinct words at which a chunk counts as fully dense
+
+
+def density(text):
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return 0.0
+    kept = [line for line in lines if not BOILERPLATE_RE.search(line)]
+    distinct = len(set(WORD_RE.findall("\n".join(kept).lower())))
+    return len(kept) / len(lines) * min(1.0, distinct / DISTINCT_FULL)
+
+
+def symbols(text):
+    return set(SYMBOL_RE.findall(text))
+
+
+def family(symbol):
+    m = FAMILY_RE.match(symbol)
+    return m.group(1) if m else None
+
+
+class ChunkScheduler:
+    def __init__(self, num_perm=128, similarity=0.5, batch_size=2048):
+        # similarity: LSH threshold for the redundancy check (lower than dedup's, since these
+        # are partial overlaps to penalize, not copies to drop)
+        self.lsh = MinHashLSH(threshold=similarity, num_perm=num_perm)
+        self.batch_size = batch_size
+        self.names = []
+        self.density = []
+        self.symbols = []
+        self.sigs = []
+        self.keys = []
+        self.elapsed = 0.0
+
+    def add(self, chunks):
+        # chunks: (name, text) stream; only features are kept, not the text
+        batch = []
+        for item in chunks:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._add_batch(batch)
+                batch = []
+        if batch:
+            self._add_batch(batch)
+
+    def _add_batch(self, batch):
+        start = time.perf_counter()
+        texts = [text for _, text in batch]
+        sigs = self.lsh.signatures(texts)
+        self.keys.extend(self.lsh.band_keys(sigs))
+        self.sigs.extend(sigs)
+        for name, text in batch:
+            self.names.append(name)
+            self.density.append(density(text))
+            self.symbols.append(symbols(text))
+        self.elapsed += time.perf_counter() - start
+
+    def _score(self, i, covered):
+        new = len(self.symbols[i] - covered)
+        redundancy = self.lsh.max_similarity(self.sigs[i], self.keys[i])
+        score = self.density[i] * (BASE_GAIN + math.log1p(new)) * (1 - redundancy)
+        return score, new, redundancy
+
+    def order(self):
+        # -> [{"chunk", "score", "density", "new_symbols", "redundancy"}] in generation order
+        start = time.perf_counter()
+        covered = set()
+        heap = [(-self._score(i, covered)[0], i) for i in range(len(self.names))]
+        heapq.heapify(heap)
+        rows = []
+        while heap:
+            _, i = heapq.heappop(heap)
+            score, new, redundancy = self._score(i, covered)
+            if heap and score < -heap[0][0]:
+                heapq.heappush(heap, (-score, i))  # stale: someone else is better now
+                continue
+            covered |= self.symbols[i]
+            self.lsh.insert(self.sigs[i], self.keys[i])
+            rows.append({"chunk": self.names[i], "score": round(score, 4), "density": round(self.density[i], 3),
+                         "new_symbols": new, "redundancy": round(redundancy, 3)})
+        self.elapsed += time.perf_counter() - start
+        return rows
+
+    def coverage(self, names, n):
+        # (symbols, peripheral families) covered by the first n of names
+        index = {name: i for i, name in enumerate(self.names)}
+        syms = set()
+        for name in names[:n]:
+            syms |= self.symbols[index[name]]
+        return syms, {f for f in map(family, syms) if f}
+
+    def report(self, rows, target_chunks):
+        # Score distribution, plus coverage after target_chunks (about where stage 4 stops)
+        # for this order vs. plain name order
+        scores = np.array([r["score"] for r in rows]) if rows else np.zeros(1)
+        all_syms, all_families = self.coverage(self.names, len(self.names))
+        scheduled = [r["chunk"] for r in rows]
+        n = min(target_chunks, len(rows))
+
+        def cov(names, k):
+            syms, fams = self.coverage(names, k)
+            return {"chunks": k, "symbols": len(syms), "symbol_fraction": round(len(syms) / max(1, len(all_syms)), 3),
+                    "families": len(fams), "family_fraction": round(len(fams) / max(1, len(all_families)), 3)}
+
+        hist, edges = np.histogram(scores, bins=10)
+        return {
+            "chunks": len(rows),
+            "target_chunks": target_chunks,
+            "symbols_total": len(all_syms),
+            "families_total": len(all_families),
+            "score_percentiles": {f"p{p}": round(float(np.percentile(scores, p)), 4) for p in (0, 10, 25, 50, 75, 90, 100)},
+            "score_histogram": {"counts": hist.tolist(), "edges": [round(float(e), 4) for e in edges]},
+            "low_density_chunks": int(sum(d < 0.2 for d in self.density)),
+            "coverage_at_target": {"scheduled": cov(scheduled, n), "name_order": cov(sorted(self.names), n)},
+            "coverage_curve": [cov(scheduled, max(1, round(len(rows) * f))) for f in (0.1, 0.25, 0.5, 0.75, 1.0)] if rows else [],
+            "families_missed_at_target": sorted(all_families - self.coverage(scheduled, n)[1]),
+            "seconds": round(self.elapsed, 3),
+        }
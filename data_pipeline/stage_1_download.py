@@ -1,48 +1,65 @@
 # stage_1_download.py
 import os
+import time
 from pathlib import Path
-import requests
-from tqdm import tqdm
 import git
 from config import CONFIG
+from instrument import add_instrument_args, count, instrumented
+from downloader import Downloader, Manifest, parse_links_file
+from repo_sync import sync_repo
 
 def ensure_dir(path): os.makedirs(path, exist_ok=True)
 
+@instrumented("stage_1_download")
 def stage_1_download(args):
     print("=== Stage 1: Download (idempotent) ===")
     ensure_dir(CONFIG["raw_pdfs_dir"])
     ensure_dir(CONFIG["raw_repos_dir"])
     ensure_dir(CONFIG["raw_web_dir"])
     
-    # PDFs
-    for name, url in CONFIG["pdfs"].items():
-        path = Path(CONFIG["raw_pdfs_dir"]) / f"{name}.pdf"
-        if path.exists() and not args.force:
-            print(f"✓ {name}.pdf already exists")
-            continue
-        print(f"↓ Downloading {name}...")
-        headers = {
-            'accept-language': 'en-GB,en;q=0.7',
-            'sec-ch-ua': '"Not(A:Brand";v="8", "Chromium";v="144", "Brave";v="144"',
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36'
-        }
-        r = requests.get(url, headers=headers, stream=True)
-        with open(path, "wb") as f:
-            for chunk in tqdm(r.iter_content(chunk_size=8192), unit="MB", total=int(r.headers.get("content-length", 0))//8192):
-                f.write(chunk)
+    # PDFs (pooled session, bounded concurrency, Range resume, manifest revalidation)
+    pdfs = dict(CONFIG["pdfs"])
+    if args.links:
+        known_urls = set(pdfs.values())
+        for name, url in parse_links_file(CONFIG["pdf_links_file"]).items():
+            if url not in known_urls and name not in pdfs:
+                pdfs[name] = url
+    jobs = {name: (url, Path(CONFIG["raw_pdfs_dir"]) / f"{name}.pdf") for name, url in pdfs.items()}
+    print(f"↓ Checking {len(jobs)} PDFs ({args.workers} at a time)...")
+    downloader = Downloader(Manifest(CONFIG["download_manifest"]), workers=args.workers, verify=args.verify)
+    results = downloader.fetch_all(jobs, force=args.force)
+    for status in sorted(set(results.values())):
+        names = [n for n, s in results.items() if s == status]
+        print(f"{'⚠️' if status == 'failed' else '✓'} {status}: {len(names)}" + (f" ({', '.join(sorted(names))})" if status == "failed" else ""))
+        count(f"pdfs_{status.replace('-', '_')}", len(names))
     
-    # Repos
+    # Repos (shallow, blobless, sparse to include_folders; --update/--force fetch instead of re-cloning)
+    repo_manifest = Manifest(CONFIG["repo_manifest"])
     for name, repo_config in CONFIG["repos"].items():
         url = repo_config["url"]
         path = Path(CONFIG["raw_repos_dir"]) / name
-        if path.exists() and not args.force:
-            print(f"✓ Repo {name} already cloned")
-            continue
-        print(f"↓ Cloning {name}...")
+        refresh = args.update or args.force
+        if not path.exists():
+            print(f"↓ Cloning {name}...")
+        elif refresh:
+            print(f"↓ Fetching {name}...")
         try:
-            git.Repo.clone_from(url, path)
-        except Exception as e:
-            print(f"⚠️ Could not clone {name}: {e} (skipping)")
+            result = sync_repo(url, path, repo_config.get("include_folders"), ref=repo_config.get("ref"),
+                               depth=CONFIG["repo_clone_depth"], refresh=refresh)
+        except git.GitCommandError as e:
+            print(f"⚠️ Could not {'update' if path.exists() else 'clone'} {name}: {e} (skipping)")
+            continue
+        status, commit = result["status"], result["commit"]
+        if status == "present":
+            print(f"✓ Repo {name} already cloned" + (f" ({commit[:10]})" if commit else ""))
+        elif status == "updated":
+            print(f"✓ {name}: {result['previous_commit'][:10]} → {commit[:10]}")
+        else:
+            print(f"✓ {name} {status} at {commit[:10]}")
+        count(f"repos_{status}")
+        if commit and (status != "present" or not repo_manifest.get(name)):
+            repo_manifest.update(name, url=url, ref=repo_config.get("ref"), include_folders=repo_config.get("include_folders"),
+                                 commit=commit, previous_commit=result["previous_commit"], fetched_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
     
     # Web
     for name, url in CONFIG["web"].items():
@@ -55,12 +72,20 @@ def stage_1_download(args):
         downloaded = trafilatura.fetch_url(url)
         text = trafilatura.extract(downloaded, include_comments=False, include_tables=True)
         path.write_text(text or "No content", encoding="utf-8")
+        count("web_pages")
     
     print("Stage 1 complete!")
 
-if __name__ == "__main__":
+def parse_args(argv=None):
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--force", action="store_true")
-    args = parser.parse_args()
-    stage_1_download(args)
\ No newline at end of file
+    parser.add_argument("--links", action="store_true", help="also fetch every PDF listed in website-pdf-links.txt")
+    parser.add_argument("--update", action="store_true", help="fetch the latest commit into repos that are already cloned")
+    parser.add_argument("--workers", type=int, default=CONFIG["download_workers"])
+    parser.add_argument("--verify", action="store_true", help="re-hash local files against the manifest")
+    add_instrument_args(parser)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    stage_1_download(parse_args())
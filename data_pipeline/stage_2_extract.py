@@ -1,74 +1,86 @@
 # stage2.py - Isolated Stage 2 for debugging PDF extraction
 import os
-import subprocess
 from pathlib import Path
 from config import CONFIG
+from instrument import add_instrument_args, count, instrumented
+from pdf_extract import BACKENDS, extract_pdfs
+from repo_extract import extract_repo, extracted_commit
+from repo_sync import head_commit
 
 def ensure_dir(path): os.makedirs(path, exist_ok=True)
 
+def pdf_outputs():
+    # raw PDF → extracted markdown it produces
+    return {pdf_file: Path(CONFIG["extracted_dir"]) / f"pdf_{pdf_file.stem}.md"
+            for pdf_file in sorted(Path(CONFIG["raw_pdfs_dir"]).glob("*.pdf"))}
+
+def repo_outputs():
+    return {repo_dir: Path(CONFIG["extracted_dir"]) / f"code_{repo_dir.name}.md"
+            for repo_dir in sorted(Path(CONFIG["raw_repos_dir"]).glob("*")) if repo_dir.is_dir()}
+
+def local_outputs():
+    outputs = {}
+    for src_dir, prefix in [(CONFIG["raw_web_dir"], "web_"), (CONFIG["local_code_dir"], "mycode_"), (CONFIG["local_extra_pdfs"], "extra_")]:
+        for f in sorted(Path(src_dir).glob("**/*")):
+            if f.is_file() and f.suffix in [".md", ".txt", ".c", ".h"]:
+                outputs[f] = Path(CONFIG["extracted_dir"]) / f"{prefix}{f.stem}.md"
+    return outputs
+
+def extract_pdf_sources(args, pdf_files):
+    # PDFs → Markdown (page shards across a process pool, pages cached by file hash)
+    if pdf_files:
+        extract_pdfs(pdf_files, CONFIG["extracted_dir"], CONFIG["pdf_page_cache_dir"],
+                     backend=args.backend, pages_per_shard=CONFIG["pdf_pages_per_shard"],
+                     workers=args.workers, manifest_path=CONFIG["download_manifest"])
+
+def extract_repo_sources(args, repo_dirs):
+    # Repos → structured Markdown (tracked files from the git index, streamed to disk; only
+    # files changed since the commit last extracted are read again, unless --force)
+    outputs = repo_outputs()
+    for repo_dir in repo_dirs:
+        repo_config = CONFIG["repos"].get(repo_dir.name, {})
+        include_folders = repo_config.get("include_folders")
+        print(f"Extracting code from {repo_dir.name}...")
+        extract_repo(repo_dir, outputs[repo_dir], include_folders, workers=CONFIG["repo_read_workers"], incremental=not args.force)
+
+def extract_local_sources(args, files):
+    # Web + Local
+    outputs = local_outputs()
+    for f in files:
+        text = f.read_text(encoding="utf-8", errors="ignore")
+        if f.suffix in [".c", ".h"]:
+            text = f"### File: {f.name}\n```c\n{text}\n```"
+        outputs[f].write_text(text, encoding="utf-8")
+        count("local_files")
+
+@instrumented("stage_2_extract")
 def stage_2_extract(args):
-    print("=== Stage 2: Extract to Markdown (with pdftotext) ===")
+    print(f"=== Stage 2: Extract to Markdown (with {args.backend}) ===")
     ensure_dir(CONFIG["extracted_dir"])
     
-    # PDFs → Markdown
-    for pdf_file in Path(CONFIG["raw_pdfs_dir"]).glob("*.pdf"):
-        out_path = Path(CONFIG["extracted_dir"]) / f"pdf_{pdf_file.stem}.md"
-        if out_path.exists() and not args.force:
+    pdf_files = []
+    for pdf_file, out_path in pdf_outputs().items():
+        if out_path.exists() and out_path.stat().st_mtime >= pdf_file.stat().st_mtime and not args.force:
             print(f"Skipping {pdf_file.name} (already exists)")
             continue
-        print(f"Extracting {pdf_file.name}...")
-        try:
-            result = subprocess.run(['pdftotext', str(pdf_file), '-'], capture_output=True, text=True, timeout=60)
-            if result.returncode != 0:
-                raise Exception(f"pdftotext failed: {result.stderr}")
-            md = result.stdout
-            out_path.write_text(md, encoding="utf-8")
-            print(f"✓ Extracted {len(md)} chars")
-        except Exception as e:
-            print(f"⚠️ Failed {pdf_file.name}: {e}")
+        pdf_files.append(pdf_file)
+    extract_pdf_sources(args, pdf_files)
     
-    # Repos → structured Markdown
-    for repo_dir in Path(CONFIG["raw_repos_dir"]).glob("*"):
-        if not repo_dir.is_dir():
-            continue
-        repo_name = repo_dir.name
-        repo_config = CONFIG["repos"].get(repo_name, {})
-        include_folders = repo_config.get("include_folders")
-        out_path = Path(CONFIG["extracted_dir"]) / f"code_{repo_dir.name}.md"
-        if out_path.exists() and not args.force:
-            continue
-        print(f"Extracting code from {repo_dir.name}...")
-        content = []
-        for file in repo_dir.rglob("*.[chmd]"):  # .c .h .md
-            if any(ex in str(file) for ex in [".git", "__pycache__"]):
-                continue
-            if include_folders:
-                if not any(str(file).startswith(str(repo_dir / folder)) for folder in include_folders):
-                    continue
-            try:
-                rel = file.relative_to(repo_dir)
-                content.append(f"### File: {rel}\n```{file.suffix[1:]}\n{file.read_text(encoding='utf-8', errors='ignore')}\n```\n")
-            except:  # noqa: E722
-                pass
-        out_path.write_text("\n".join(content), encoding="utf-8")
+    extract_repo_sources(args, [d for d, out_path in repo_outputs().items()
+                                if args.force or not out_path.exists() or extracted_commit(out_path) != head_commit(d)])
     
-    # Web + Local
-    for src_dir, prefix in [(CONFIG["raw_web_dir"], "web_"), (CONFIG["local_code_dir"], "mycode_"), (CONFIG["local_extra_pdfs"], "extra_")]:
-        for f in Path(src_dir).glob("**/*"):
-            if f.is_file() and f.suffix in [".md", ".txt", ".c", ".h"]:
-                out_path = Path(CONFIG["extracted_dir"]) / f"{prefix}{f.stem}.md"
-                if out_path.exists() and not args.force:
-                    continue
-                text = f.read_text(encoding="utf-8", errors="ignore")
-                if f.suffix in [".c", ".h"]:
-                    text = f"### File: {f.name}\n```c\n{text}\n```"
-                out_path.write_text(text, encoding="utf-8")
+    extract_local_sources(args, [f for f, out_path in local_outputs().items() if args.force or not out_path.exists()])
     
     print("Stage 2 complete!")
 
-if __name__ == "__main__":
+def parse_args(argv=None):
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--force", action="store_true")  # Not used, but for consistency
-    args = parser.parse_args()
-    stage_2_extract(args)
\ No newline at end of file
+    parser.add_argument("--backend", choices=BACKENDS, default=CONFIG["pdf_backend"])
+    parser.add_argument("--workers", type=int, default=None, help="extraction processes (default: all cores)")
+    add_instrument_args(parser)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    stage_2_extract(parse_args())
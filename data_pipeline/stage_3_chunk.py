@@ -1,104 +1,87 @@
 # stage_3_chunk.py
 import os
-from pathlib import Path
 from config import CONFIG
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from instrument import add_instrument_args, count, instrumented, note
+from chunker import Chunker, ChunkPacker
+from dedup import ChunkDeduper
+from token_budget import get_counter
+from bm25_index import build_index
+from artifact_store import ArtifactStore
 
 def ensure_dir(path): os.makedirs(path, exist_ok=True)
 
+@instrumented("stage_3_chunk")
 def stage_3_chunk(args):
     print("=== Stage 3: Chunking ===")
-    ensure_dir(CONFIG["chunks_dir"])
+    store = ArtifactStore(CONFIG["artifact_db"])
     chunks = []
-    code_stats = {"whole": 0, "split_files": 0, "split_chunks": 0, "total_size": 0}
-    
-    for md_file in Path(CONFIG["extracted_dir"]).glob("*.md"):
-        text = md_file.read_text(encoding="utf-8")
-        file_type = md_file.stem.split('_')[0]  # e.g., 'code', 'pdf', 'web'
-        
-        if file_type == 'code':
-            # Pre-split on file boundaries
-            file_sections = text.split("\n### ")
-            for i, section in enumerate(file_sections):
-                if i == 0 and not section.startswith("### "):
-                    # First part before any ###, skip if empty
-                    continue
-                section = ("### " + section) if i > 0 else section
-                if len(section) < 8000:
-                    # Keep whole
-                    chunk_name = f"{md_file.stem}_file{i:04d}.txt"
-                    Path(CONFIG["chunks_dir"]).joinpath(chunk_name).write_text(section, encoding="utf-8")
-                    chunks.append(chunk_name)
-                    code_stats["whole"] += 1
-                    code_stats["total_size"] += len(section)
-                else:
-                    # Split with enhanced separators
-                    separators = ["\n### ", "\n## ", "\n# ", "\nenum ", "\nstruct ", "\nunion ", "\nvoid ", "\nint ", "\n#define ", "\n\n", "\n", " "]
-                    splitter = RecursiveCharacterTextSplitter(
-                        separators=separators,
-                        chunk_size=10000,  # Large to allow buffering
-                        chunk_overlap=0,
-                        length_function=len,
-                        is_separator_regex=False
-                    )
-                    sub_chunks = splitter.split_text(section)
-                    # Buffer sub-chunks
-                    buffer = []
-                    buffer_size = 0
-                    chunk_count = 0
-                    for sub in sub_chunks:
-                        if buffer_size + len(sub) > 8000 and buffer:
-                            # Yield buffer
-                            combined = "\n".join(buffer)
-                            chunk_name = f"{md_file.stem}_file{i:04d}_chunk{chunk_count:03d}.txt"
-                            Path(CONFIG["chunks_dir"]).joinpath(chunk_name).write_text(combined, encoding="utf-8")
-                            chunks.append(chunk_name)
-                            code_stats["total_size"] += len(combined)
-                            chunk_count += 1
-                            buffer = [sub]
-                            buffer_size = len(sub)
-                        else:
-                            buffer.append(sub)
-                            buffer_size += len(sub)
-                    # Yield remaining buffer
-                    if buffer:
-                        combined = "\n".join(buffer)
-                        chunk_name = f"{md_file.stem}_file{i:04d}_chunk{chunk_count:03d}.txt"
-                        Path(CONFIG["chunks_dir"]).joinpath(chunk_name).write_text(combined, encoding="utf-8")
-                        chunks.append(chunk_name)
-                        code_stats["total_size"] += len(combined)
-                        chunk_count += 1
-                    if chunk_count > 0:
-                        code_stats["split_files"] += 1
-                        code_stats["split_chunks"] += chunk_count
-        else:
-            # PDFs and web: paragraph-based
-            separators = ["\n\n", "\n", " ", ""]
-            splitter = RecursiveCharacterTextSplitter(
-                separators=separators,
-                chunk_size=2000,
-                chunk_overlap=200,
-                length_function=len,
-                is_separator_regex=False
-            )
-            doc_chunks = splitter.split_text(text)
-            for i, chunk in enumerate(doc_chunks):
-                if len(chunk) < 200:
-                    continue
-                chunk_name = f"{md_file.stem}_chunk{i:03d}.txt"
-                Path(CONFIG["chunks_dir"]).joinpath(chunk_name).write_text(chunk, encoding="utf-8")
-                chunks.append(chunk_name)
-    
+    code_stats = {"whole": 0, "split_files": 0, "split_chunks": 0, "total_size": 0, "total_tokens": 0}
+
+    # Chunks are produced lazily (mmap + generators) and written to the store in batches.
+    # Sizes are in tokens of the generation model's tokenizer
+    counter = get_counter()
+    chunker = Chunker(counter, args.max_tokens, CONFIG["chunk_overlap_tokens"], CONFIG["chunk_min_tokens"])
+    stream = chunker.iter_chunks(CONFIG["extracted_dir"], code_stats)
+    deduper = None
+    if not args.no_dedup:
+        # Near-duplicate pass (MinHash + LSH): one representative per cluster goes to stage 4
+        deduper = ChunkDeduper(threshold=args.dedup_threshold, num_perm=CONFIG["dedup_num_perm"])
+        stream = deduper.filter(stream)
+    packer = None
+    if not args.no_pack:
+        # After dedup, so a pack never carries a copy of another chunk
+        packer = ChunkPacker(counter, args.max_tokens)
+        stream = packer.pack(stream)
+
+    def track(stream):
+        for chunk_name, text in stream:
+            chunks.append(chunk_name)
+            yield chunk_name, text
+
+    # This run's chunks replace the previous run's (dropped copies, members now inside a
+    # pack, old sizes) as the active set in one transaction, so stage 4 only sees these
+    store.replace_chunks(track(stream))
+    if deduper:
+        deduper.write_report(CONFIG["dedup_report"])
+    if not args.no_index:
+        # BM25 index over the final chunks, for stage 4's related context and index_server.py
+        index = build_index(((name, text) for _, name, text in store.iter_chunks()), CONFIG["index_dir"])
+        note("index", {k: v for k, v in index.items() if k != "names"})
+        print(f"Index: {index['docs']} chunks, {index['terms']} terms, {index['bytes'] / 2**20:.1f} MB in {index['build_seconds']:.1f}s → {CONFIG['index_dir']}")
+
     # Print stats
     total_chunks = len(chunks)
+    count("chunks", total_chunks)
+    note("code_stats", code_stats)
     if code_stats["whole"] + code_stats["split_chunks"] > 0:
-        avg_size = code_stats["total_size"] / (code_stats["whole"] + code_stats["split_chunks"])
-        print(f"Code stats: {code_stats['whole']} whole files, {code_stats['split_files']} split files into {code_stats['split_chunks']} chunks, avg size {avg_size:.0f} chars")
-    print(f"Created {total_chunks} chunks total. Ready for generation.")
+        n_code = code_stats["whole"] + code_stats["split_chunks"]
+        print(f"Code stats: {code_stats['whole']} whole files, {code_stats['split_files']} split files into {code_stats['split_chunks']} chunks, "
+              f"avg size {code_stats['total_size'] / n_code:.0f} chars / {code_stats['total_tokens'] / n_code:.0f} tokens")
+    if deduper:
+        count("chunks_in", deduper.seen)
+        count("chunks_dropped_duplicate", deduper.dropped)
+        note("dedup_seconds", round(deduper.elapsed, 3))
+        print(f"Dedup: {deduper.seen} chunks → {len(deduper.clusters)} duplicate clusters, dropped {deduper.dropped} ({deduper.elapsed:.1f}s, report in {CONFIG['dedup_report']})")
+    if packer:
+        count("chunks_packed", packer.packed)
+        print(f"Packing: {packer.packed} small chunks from the same source merged into {packer.packs} chunks of ≤{args.max_tokens} tokens")
+    t = counter.stats()
+    note("token_counter", t)
+    print(f"Token counts: {t['tokenizer']}{'' if t['exact'] else ' (estimated)'}, {t['cache_hits']} cache hits / {t['cache_misses']} tokenized")
+    print(f"Created {total_chunks} chunks total in {CONFIG['artifact_db']}. Ready for generation.")
+    store.close()
     return chunks
 
-if __name__ == "__main__":
+def parse_args(argv=None):
     import argparse
     parser = argparse.ArgumentParser()
-    args = parser.parse_args()  # No args needed
-    stage_3_chunk(args)
\ No newline at end of file
+    parser.add_argument("--no-dedup", action="store_true", help="keep near-duplicate chunks")
+    parser.add_argument("--dedup-threshold", type=float, default=CONFIG["dedup_threshold"])
+    parser.add_argument("--max-tokens", type=int, default=CONFIG["max_chunk_tokens"], help="chunk size budget in model tokens")
+    parser.add_argument("--no-index", action="store_true", help="skip building the BM25 retrieval index")
+    parser.add_argument("--no-pack", action="store_true", help="don't merge small chunks from the same source")
+    add_instrument_args(parser)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    stage_3_chunk(parse_args())
@@ -0,0 +1,58 @@
+# stage_3b_schedule.py
+import json
+import math
+import os
+import time
+from pathlib import Path
+from config import CONFIG
+from instrument import add_instrument_args, count, instrumented, note
+from scheduler import ChunkScheduler
+from artifact_store import ArtifactStore
+
+def ensure_dir(path): os.makedirs(path, exist_ok=True)
+
+@instrumented("stage_3b_schedule")
+def stage_3b_schedule(args):
+    print("=== Stage 3b: Schedule chunks by novelty ===")
+    scheduler = ChunkScheduler(num_perm=CONFIG["dedup_num_perm"], similarity=args.similarity)
+    store = ArtifactStore(CONFIG["artifact_db"])
+    scheduler.add((name, text) for _, name, text in store.iter_chunks())
+    store.close()
+    rows = scheduler.order()
+
+    # Stage 4 reads the order from here; chunks it doesn't list go last
+    ensure_dir(Path(CONFIG["chunk_schedule"]).parent)
+    tmp = Path(CONFIG["chunk_schedule"] + ".tmp")
+    tmp.write_text(json.dumps({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "chunks": rows}, indent=1), encoding="utf-8")
+    os.replace(tmp, CONFIG["chunk_schedule"])
+
+    # About where stage 4 will stop: target_pairs * 1.2 at pairs_per_chunk each
+    target_chunks = math.ceil(CONFIG["target_pairs"] * 1.2 / CONFIG["pairs_per_chunk"])
+    report = scheduler.report(rows, target_chunks)
+    ensure_dir(Path(CONFIG["schedule_report"]).parent)
+    Path(CONFIG["schedule_report"]).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    count("chunks", len(rows))
+    count("chunks_low_density", report["low_density_chunks"])
+    note("schedule", {k: v for k, v in report.items() if k != "coverage_curve"})
+    p = report["score_percentiles"]
+    print(f"Scored {len(rows)} chunks in {report['seconds']:.1f}s: score p10 {p['p10']:.3f}, median {p['p50']:.3f}, "
+          f"p90 {p['p90']:.3f}; {report['low_density_chunks']} look like boilerplate (density < 0.2)")
+    if rows:
+        s, n = report["coverage_at_target"]["scheduled"], report["coverage_at_target"]["name_order"]
+        print(f"First {s['chunks']} chunks (≈ target_pairs) cover {s['symbols']}/{report['symbols_total']} STM32 symbols "
+              f"({s['symbol_fraction']:.0%}) and {s['families']}/{report['families_total']} peripherals; "
+              f"name order would cover {n['symbol_fraction']:.0%} and {n['families']}")
+    print(f"Order → {CONFIG['chunk_schedule']}, report → {CONFIG['schedule_report']}")
+    return rows
+
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--similarity", type=float, default=CONFIG["schedule_similarity"],
+                        help="MinHash similarity from which an already scheduled chunk makes one redundant")
+    add_instrument_args(parser)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    stage_3b_schedule(parse_args())
@@ -1,45 +1,29 @@
 # stage_4_generate.py
 import os
+import hashlib
 from pathlib import Path
-from tqdm import tqdm
-import re
 import json
-from unsloth import FastLanguageModel
 from config import CONFIG
+from instrument import add_instrument_args, count, instrumented, note
+from generation import GenerationEngine, make_backend
+from ledger import JobLedger, job_key
+from pair_parser import PairParser
+from pipeline import GenerationPipeline
+from token_budget import get_counter
+from bm25_index import BM25Index
+from artifact_store import ArtifactStore
 
 def ensure_dir(path): os.makedirs(path, exist_ok=True)
 
-def stage_4_generate(args):
-    print("=== Stage 4: Generate ShareGPT pairs with base model ===")
-    ensure_dir(CONFIG["generated_dir"])
-    
-    # Load base model for inference (fast on your 4080)
-    model, tokenizer = FastLanguageModel.from_pretrained(
-        model_name="unsloth/Qwen2.5-Coder-7B-Instruct",
-        max_seq_length=8192,
-        dtype=None,
-        load_in_4bit=True,
-    )
-    FastLanguageModel.for_inference(model)
-    
-    system_prompt = f"""You are an expert STM32 embedded C/C++ engineer specializing in the {CONFIG['board_name']} ({CONFIG['mcu']}). 
+SYSTEM_PROMPT = f"""You are an expert STM32 embedded C/C++ engineer specializing in the {CONFIG['board_name']} ({CONFIG['mcu']}). 
 You know HAL, LL, CMSIS, register-level details, SparkFun pinout (LED on PC13, Qwiic I2C on PB6/PB7, etc.), common pitfalls, debugging, and best practices.
 Always respond with complete, commented, production-ready code when asked. Include board-specific notes."""
 
-    chunk_files = list(Path(CONFIG["chunks_dir"]).glob("*.txt"))
-    if args.max_chunks:
-        chunk_files = chunk_files[:args.max_chunks]
-    
-    total_pairs = 0
-    for chunk_file in tqdm(chunk_files):
-        chunk_text = chunk_file.read_text(encoding="utf-8")
-        prompt = f"""{system_prompt}
-
-Here is a document chunk from STM32F4 / SparkFun documentation or examples:
-
-{chunk_text[:CONFIG['max_chunk_tokens']]}
+# Everything except the chunk lives in one fixed prefix, so its KV cache can be
+# computed once and shared by every prompt (see TransformersBackend.set_prefix)
+PROMPT_PREFIX = f"""{SYSTEM_PROMPT}
 
-Generate exactly {CONFIG['pairs_per_chunk']} diverse, realistic multi-turn ShareGPT conversations a developer would have with Continue.dev in VSCode while working on this board.
+Generate exactly {CONFIG['pairs_per_chunk']} diverse, realistic multi-turn ShareGPT conversations a developer would have with Continue.dev in VSCode while working on this board, based on the document chunk below.
 Each conversation must:
 - Start with a realistic user question (code generation, explanation, debugging, refactoring, HAL vs LL, board-specific pinout, etc.)
 - Have 2-6 turns (user/assistant)
@@ -50,34 +34,241 @@ Each conversation must:
 Output ONLY valid JSONL. Each line must be a complete JSON object:
 {{"conversations": [ {{"from": "system", "value": "..."}}, {{"from": "user", "value": "..."}}, {{"from": "assistant", "value": "..."}} , ... ] }}
 No extra text, no markdown.
+
+Here is a document chunk from STM32F4 / SparkFun documentation or examples:
+
 """
-        
-        inputs = tokenizer(prompt, return_tensors="pt").to("cuda")
-        #outputs = model.generate(**inputs, max_new_tokens=4096, temperature=0.7, top_p=0.95, do_sample=True)
-        outputs = model.generate(**inputs, max_new_tokens=4096, temperature=0.6, top_p=0.92, do_sample=True, repetition_penalty=1.1)
-        response = tokenizer.decode(outputs[0], skip_special_tokens=True).split("Output ONLY valid JSONL")[-1].strip()
-        
-        json_lines = re.findall(r'\{.*?\}(?=\s*\{|\s*$)', response, re.DOTALL | re.MULTILINE)
-        for i, line in enumerate(json_lines):
-            try:
-                # Remove any markdown code fences the model sometimes adds
-                cleaned = re.sub(r'```json|```', '', line).strip()
-                ex = json.loads(cleaned)
-                if isinstance(ex.get("conversations"), list) and len(ex["conversations"]) >= 2:
-                    out_file = Path(CONFIG["generated_dir"]) / f"{chunk_file.stem}_pairs_{i:03d}.jsonl"
-                    out_file.write_text(json.dumps(ex, ensure_ascii=False) + "\n", encoding="utf-8")
-                    total_pairs += 1
-            except Exception:
-                pass  # silently skip any malformed output
-        
-        if total_pairs >= CONFIG["target_pairs"] * 1.2:
-            break  # safety buffer
-    
-    print(f"Generated ~{total_pairs} pairs. Review them in data_pipeline/generated_pairs/")
 
-if __name__ == "__main__":
+def build_prompt(chunk_text):
+    return f"""{PROMPT_PREFIX}{chunk_text}
+
+Now output the {CONFIG['pairs_per_chunk']} JSONL conversations:
+"""
+
+def chunk_token_budget(counter):
+    # Tokens left for the chunk once the prompt template and the generation are accounted for
+    room = CONFIG["gen_max_seq_length"] - CONFIG["gen_max_new_tokens"] - counter.count(build_prompt(""))
+    return min(CONFIG["max_chunk_tokens"], room)
+
+def add_context(text, name, index, counter, room, k):
+    # Appends up to k related chunks (BM25 over data/index) while they fit in room tokens
+    for other, _ in index.related(name, text, k):
+        piece = f"\n\n--- Related excerpt ({other}), for reference ---\n{index.text(other)}"
+        n = counter.count(piece)
+        if n > room:
+            if room < 200:
+                break
+            piece, _ = counter.truncate(piece, room)
+            n = room
+        text += piece
+        room -= n
+        count("context_chunks")
+    return text
+
+def schedule_order(names):
+    # Stage 3b's priority order; chunks it hasn't scored (or no schedule at all) go last, by name
+    path = Path(CONFIG["chunk_schedule"])
+    if not path.exists():
+        return names
+    rank = {row["chunk"]: i for i, row in enumerate(json.loads(path.read_text(encoding="utf-8"))["chunks"])}
+    return sorted(names, key=lambda name: (rank.get(name, len(rank)), name))
+
+def write_yield_report(records, path):
+    # Per-chunk yield (valid pairs / pairs_per_chunk) and tokens spent on output that became no pair
+    completion = sum(r["completion_tokens"] for r in records)
+    wasted = sum(r["wasted_tokens"] for r in records)
+    stops = {}
+    for r in records:
+        reason = r["stop_reason"] or "eos/max_tokens"
+        stops[reason] = stops.get(reason, 0) + 1
+    summary = {
+        "chunks": len(records),
+        "pairs": sum(r["pairs"] for r in records),
+        "mean_yield": sum(r["yield"] for r in records) / len(records) if records else 0.0,
+        "completion_tokens": completion,
+        "wasted_tokens": wasted,
+        "wasted_fraction": wasted / completion if completion else 0.0,
+        "stop_reasons": stops,
+    }
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(json.dumps({"summary": summary, "chunks": records}, indent=2), encoding="utf-8")
+    return summary
+
+@instrumented("stage_4_generate")
+def stage_4_generate(args):
+    print(f"=== Stage 4: Generate ShareGPT pairs ({args.backend} backend) ===")
+    store = ArtifactStore(CONFIG["artifact_db"])
+
+    backend = make_backend(args.backend, CONFIG, args)
+    params = {
+        "max_new_tokens": CONFIG["gen_max_new_tokens"],
+        "temperature": CONFIG["gen_temperature"],
+        "top_p": CONFIG["gen_top_p"],
+        "repetition_penalty": CONFIG["gen_repetition_penalty"],
+        # Parse the output while it streams and stop once all pairs are in (or it derails)
+        "stop_after_pairs": None if args.no_early_stop else CONFIG["pairs_per_chunk"],
+    }
+    if not args.no_prefix_cache:
+        backend.set_prefix(PROMPT_PREFIX)
+    engine = GenerationEngine(backend, params, max_batch_size=args.batch_size, max_batch_tokens=CONFIG["gen_max_batch_tokens"])
+
+    # Chunks are cut to a token budget that leaves room for gen_max_new_tokens
+    counter = get_counter()
+    budget = chunk_token_budget(counter)
+    if budget < CONFIG["max_chunk_tokens"]:
+        print(f"⚠️ Only {budget} tokens fit per chunk (gen_max_seq_length - gen_max_new_tokens - prompt); "
+              f"chunks sized for max_chunk_tokens={CONFIG['max_chunk_tokens']} will be truncated")
+
+    # Ledger: chunk content hash + generation settings → done/failed, so restarts skip finished work
+    job_params = {
+        "backend": args.backend,
+        "model": {"unsloth": CONFIG["gen_model"], "openai": args.endpoint_model or CONFIG["openai_model"]}.get(args.backend, args.backend),
+        "prompt": hashlib.sha256(build_prompt("{chunk}").encode("utf-8")).hexdigest(),
+        "chunk_tokens": budget,
+        "context_chunks": args.context_chunks,
+        "tokenizer": counter.name,
+        **params,
+    }
+    ledger = JobLedger(CONFIG["gen_ledger"], max_attempts=CONFIG["gen_max_attempts"])
+    keys, hashes = {}, {}
+    for chunk_hash, name, text in store.iter_chunks():
+        keys[name] = job_key(text, job_params)
+        hashes[name] = chunk_hash
+    names = sorted(keys)
+    if not args.no_schedule:
+        names = schedule_order(names)
+    all_keys = list(keys.values())
+    todo = [name for name in names if ledger.should_run(keys[name])]
+    if args.max_chunks:
+        todo = todo[:args.max_chunks]
+
+    total_pairs = ledger.pairs_done(all_keys)
+    print(ledger.format_progress(all_keys) + f", {total_pairs} pairs so far, {len(todo)} chunks to run now")
+    if total_pairs >= CONFIG["target_pairs"] * 1.2:
+        print("Target already reached, nothing to do.")
+        todo = []
+
+    # Related chunks fill whatever budget a chunk leaves unused
+    index = None
+    if args.context_chunks:
+        if (Path(CONFIG["index_dir"]) / "meta.json").exists():
+            index = BM25Index(CONFIG["index_dir"])
+        else:
+            print(f"⚠️ No index in {CONFIG['index_dir']} (run stage 3); generating without related context")
+
+    def prepare(name):
+        # Runs on the prep thread (which gets its own store connection)
+        text, truncated = counter.truncate(store.chunk_text(hashes[name]), budget)
+        if truncated:
+            count("chunks_truncated")
+        if index is not None:
+            text = add_context(text, name, index, counter, budget - counter.count(text), args.context_chunks)
+        return name, build_prompt(text)
+
+    def postprocess(name, result):
+        # Runs on the post pool, overlapped with generation of the next batch. The derail
+        # limits only decide when to stop generating: here every valid pair counts
+        parser = PairParser(max_garbage=None, max_bad_run=None)
+        parser.feed(result["text"])
+        return parser.pairs, parser.invalid, parser.wasted_fraction()
+
+    # Results go to the store in bulk transactions of flush_every chunks; the ledger only
+    # marks a chunk once the transaction holding its pairs has committed
+    pending_gens, pending_pairs, pending_marks = [], [], []
+
+    def flush():
+        if pending_gens:
+            stored = store.add_results(pending_gens, pending_pairs)
+            count("pairs_already_stored", sum(len(p[3]) for p in pending_pairs) - stored)
+        for mark, mark_args in pending_marks:
+            mark(*mark_args)
+        pending_gens.clear()
+        pending_pairs.clear()
+        pending_marks.clear()
+
+    processed = 0
+    records = []
+    pipeline = GenerationPipeline(engine, prepare, postprocess, prefetch=args.prefetch, post_workers=args.post_workers)
+    try:
+        for name, result, (pairs, n_invalid, wasted) in pipeline.run(todo):
+            key = keys[name]
+            n_pairs = len(pairs)
+            processed += 1
+            count("prompts")
+            count("prompt_tokens", result["prompt_tokens"])
+            count("generated_tokens", result["completion_tokens"])
+            count("pairs_kept", n_pairs)
+            count("pairs_rejected", n_invalid)
+            if "error" not in result:
+                records.append({
+                    "chunk": name,
+                    "pairs": n_pairs,
+                    "yield": round(n_pairs / CONFIG["pairs_per_chunk"], 3),
+                    "completion_tokens": result["completion_tokens"],
+                    "wasted_tokens": round(result["completion_tokens"] * wasted),
+                    "stop_reason": result["stop_reason"],
+                })
+            pending_gens.append({"key": key, "chunk_hash": hashes[name], "model": job_params["model"],
+                                 "prompt_tokens": result.get("prompt_tokens"), "completion_tokens": result.get("completion_tokens"),
+                                 "stop_reason": result.get("stop_reason"), "pairs": n_pairs, "invalid": n_invalid,
+                                 "error": result.get("error"), "output": result.get("text")})
+            if not n_pairs:
+                count("chunks_failed")
+                pending_marks.append((ledger.mark_failed, (key, name, result.get("error", "no valid pairs in output"))))
+            else:
+                pending_pairs.append((name, hashes[name], key, pairs))
+                pending_marks.append((ledger.mark_done, (key, name, n_pairs, result["completion_tokens"])))
+                total_pairs += n_pairs
+            if len(pending_gens) >= args.flush_every:
+                flush()
+
+            if processed % args.batch_size == 0 or processed == len(todo):
+                print(ledger.format_progress(all_keys) + f", {total_pairs} pairs")
+            if total_pairs >= CONFIG["target_pairs"] * 1.2:
+                break  # safety buffer
+    finally:
+        # Even when the run dies midway: results already generated are stored (and their
+        # chunks marked) and the ledger file is closed
+        flush()
+        ledger.close()
+        store.close()
+
+    t = engine.throughput()
+    print(f"[{t['backend']}] {t['prompts']} prompts in {t['batches']} batches: {t['prompts_per_s']:.2f} prompts/s, "
+          f"{t['tokens_per_s']:.0f} tok/s ({t['completion_tokens_per_s']:.0f} generated tok/s), padding efficiency {t['padding_efficiency']:.0%}")
+    y = write_yield_report(records, CONFIG["gen_yield_report"])
+    print(f"Yield: {y['pairs']} pairs from {y['chunks']} chunks (mean {y['mean_yield']:.0%} of {CONFIG['pairs_per_chunk']}/chunk), "
+          f"{y['wasted_tokens']}/{y['completion_tokens']} generated tokens wasted ({y['wasted_fraction']:.0%}), stops {y['stop_reasons']}")
+    m = pipeline.metrics()
+    u, q = m["utilization"], m["queues"]
+    print(f"Pipeline: {m['wall_s']:.1f}s wall vs {m['serial_s']:.1f}s of stage work ({m['overlap_saved_s']:.1f}s saved by overlap); "
+          f"utilization prep {u['prep']:.0%}, generate {u['generate']:.0%}, post {u['post']:.0%}; "
+          f"queue depth prep {q['prep']['mean_depth']:.1f}/{q['prep']['capacity']}, results {q['results']['mean_depth']:.1f}/{q['results']['capacity']}")
+    note("throughput", t)
+    note("yield", y)
+    note("pipeline", m)
+    if getattr(backend, "prefix_hits", 0):
+        print(f"Shared prefix KV cache reused for {backend.prefix_hits}/{t['prompts']} prompts")
+    print(f"Generated ~{total_pairs} pairs into {CONFIG['artifact_db']} (python artifact_store.py export writes them out as files)")
+
+def parse_args(argv=None):
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--max-chunks", type=int, default=None)
-    args = parser.parse_args()
-    stage_4_generate(args)
\ No newline at end of file
+    parser.add_argument("--backend", choices=["unsloth", "openai", "stub"], default=CONFIG["gen_backend"])
+    parser.add_argument("--batch-size", type=int, default=CONFIG["gen_max_batch_size"], help="upper bound; batches also respect gen_max_batch_tokens")
+    parser.add_argument("--endpoint", default=None, help="OpenAI-compatible base URL (openai backend)")
+    parser.add_argument("--endpoint-model", default=None, help="model name on the endpoint (openai backend)")
+    parser.add_argument("--no-prefix-cache", action="store_true", help="re-encode the shared prompt prefix for every chunk")
+    parser.add_argument("--context-chunks", type=int, default=CONFIG["gen_context_chunks"],
+                        help="add up to this many related chunks (BM25) to each prompt while the token budget allows")
+    parser.add_argument("--no-schedule", action="store_true", help="ignore stage 3b's order, go by chunk name")
+    parser.add_argument("--no-early-stop", action="store_true", help="always generate up to gen_max_new_tokens")
+    parser.add_argument("--prefetch", type=int, default=CONFIG["gen_prefetch"], help="prompts prepared ahead of generation")
+    parser.add_argument("--post-workers", type=int, default=CONFIG["gen_post_workers"], help="threads parsing outputs")
+    parser.add_argument("--flush-every", type=int, default=CONFIG["gen_flush_every"], help="chunks per bulk transaction into the artifact store")
+    add_instrument_args(parser)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    stage_4_generate(parse_args())
@@ -0,0 +1,158 @@
+# stage_4b_compile_check.py
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import orjson
+from config import CONFIG
+from instrument import add_instrument_args, count, instrumented, note
+from artifact_store import ArtifactStore
+from compile_check import Toolchain, error_kind, extract_blocks, find_compiler, header_dirs
+
+def ensure_dir(path): os.makedirs(path, exist_ok=True)
+
+def pair_blocks(data):
+    try:
+        ex = orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return []  # stage 5 drops it anyway
+    return extract_blocks(ex) if isinstance(ex, dict) else []
+
+@instrumented("stage_4b_compile_check")
+def stage_4b_compile_check(args):
+    print("=== Stage 4b: Compile-check generated C code ===")
+    cc = find_compiler(args.cc)
+    if not cc:
+        print(f"⚠️ No compiler found ({args.cc or 'arm-none-eabi-gcc / gcc'}): pairs stay unchecked")
+        return None
+    cube_dir = Path(CONFIG["raw_repos_dir"]) / "stm32cubef4"
+    dirs = header_dirs(cube_dir) + CONFIG["compile_check_include_dirs"]
+    if not dirs:
+        # Every pair using the HAL would fail and stage 5 would drop it: record nothing instead
+        print(f"⚠️ No STM32F4 HAL headers under {cube_dir}/Drivers (submodules not checked out? "
+              f"python stage_1_download.py --update): pairs stay unchecked")
+        return None
+    toolchain = Toolchain(cc, dirs, CONFIG["compile_check_defines"], CONFIG["compile_check_dir"])
+    built = toolchain.prepare()
+    print(f"Compiler: {toolchain.version} ({len(dirs)} header dirs{f', {built} precompiled preludes built' if built else ''})")
+
+    # Pairs already checked with this toolchain are skipped, and a code block seen before
+    # (same code in another pair, or an earlier run) takes its verdict from the cache, so
+    # only new code reaches the compiler
+    store = ArtifactStore(CONFIG["artifact_db"])
+    stats = Counter()
+    errors = Counter()
+    failures = []
+    start = time.perf_counter()
+    compile_seconds = 0.0
+    after = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        while True:
+            rows = store.pairs_to_check(toolchain.signature, after, args.batch_size, recheck=args.force)
+            if not rows:
+                break
+            after = rows[-1][0]
+            pairs = []
+            blocks = {}
+            for _, pair_hash, data in rows:
+                keys = []
+                for lang, code in pair_blocks(data):
+                    key = toolchain.key(lang, code)
+                    blocks[key] = (lang, code)
+                    keys.append(key)
+                pairs.append((pair_hash, keys))
+            verdicts = {} if args.force else store.cached_checks(list(blocks))
+            todo = [key for key in blocks if key not in verdicts]
+            stats["blocks_cached"] += len(verdicts)
+            stats["blocks_checked"] += len(todo)
+
+            t = time.perf_counter()
+            results = pool.map(toolchain.check, [blocks[key][0] for key in todo], [blocks[key][1] for key in todo])
+            verdicts.update(zip(todo, results))
+            compile_seconds += time.perf_counter() - t
+
+            # A timed-out block has no verdict: it isn't cached and its pair is retried next run
+            checks = [(key, verdicts[key][0], verdicts[key][1]) for key in todo if verdicts[key][0] is not None]
+            pair_checks = []
+            for pair_hash, keys in pairs:
+                results = [verdicts[key] for key in keys]
+                if any(ok is None for ok, _ in results):
+                    stats["pairs_timed_out"] += 1
+                    continue
+                failed = [error for ok, error in results if not ok]
+                verdict = "fail" if failed else "pass" if keys else "none"
+                pair_checks.append((pair_hash, toolchain.signature, len(keys), len(failed), verdict, failed[0] if failed else None))
+                stats[f"pairs_{verdict}"] += 1
+                stats["blocks"] += len(keys)
+                stats["blocks_failed"] += len(failed)
+                for error in failed:
+                    errors[error_kind(error)] += 1
+                if failed and len(failures) < 20:
+                    failures.append({"pair": pair_hash, "error": failed[0]})
+            store.add_checks(checks, pair_checks)
+    elapsed = time.perf_counter() - start
+    summary = store.check_summary()
+    store.close()
+
+    checked = stats["pairs_pass"] + stats["pairs_fail"]
+    total_checked = summary.get("pass", 0) + summary.get("fail", 0)
+    report = {
+        "compiler": toolchain.version,
+        "include_dirs": dirs,
+        "pairs": sum(summary.values()),
+        "pairs_pass": summary.get("pass", 0),
+        "pairs_fail": summary.get("fail", 0),
+        "pairs_no_code": summary.get("none", 0),
+        "pass_rate": summary.get("pass", 0) / total_checked if total_checked else None,
+        "run": {
+            "pairs_checked": checked + stats["pairs_none"],
+            "pass_rate": stats["pairs_pass"] / checked if checked else None,
+            "blocks": stats["blocks"],
+            "blocks_failed": stats["blocks_failed"],
+            "blocks_checked": stats["blocks_checked"],
+            "blocks_cached": stats["blocks_cached"],
+            "compiler_runs": toolchain.compiles,
+            "pairs_timed_out": stats["pairs_timed_out"],
+            "seconds": round(elapsed, 3),
+            "checks_per_second": round(stats["blocks_checked"] / compile_seconds, 1) if compile_seconds else None,
+        },
+        "top_errors": errors.most_common(15),
+        "sample_failures": failures,
+    }
+    ensure_dir(Path(CONFIG["compile_check_report"]).parent)
+    Path(CONFIG["compile_check_report"]).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    run = report["run"]
+    count("pairs_checked", run["pairs_checked"])
+    count("pairs_compile_failed", stats["pairs_fail"])
+    count("blocks_compiled", stats["blocks_checked"])
+    count("blocks_cached", stats["blocks_cached"])
+    note("compile_check", {k: v for k, v in report.items() if k not in ("top_errors", "sample_failures")})
+    if run["pairs_checked"]:
+        print(f"Checked {run['pairs_checked']} new pairs ({stats['pairs_none']} without C code): {run['blocks']} code blocks, "
+              f"{run['blocks_checked']} compiled ({run['checks_per_second'] or 0:.1f}/s on {args.workers} workers), "
+              f"{run['blocks_cached']} from the cache, in {elapsed:.1f}s")
+    else:
+        print("✓ No new pairs to check")
+    if report["pass_rate"] is not None:
+        print(f"Pass rate: {report['pairs_pass']}/{report['pairs_pass'] + report['pairs_fail']} pairs with C code "
+              f"({report['pass_rate']:.0%}); stage 5 will {CONFIG['compile_check_failures']} the {report['pairs_fail']} failures")
+    for kind, n in errors.most_common(3):
+        print(f"   {n:5d}× {kind}")
+    print(f"Report → {CONFIG['compile_check_report']}")
+    return report
+
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cc", default=CONFIG["compile_check_cc"], help="compiler (default: arm-none-eabi-gcc, else gcc)")
+    parser.add_argument("--workers", type=int, default=CONFIG["compile_check_workers"], help="compiler processes at a time")
+    parser.add_argument("--batch-size", type=int, default=1000, help="pairs per store transaction")
+    parser.add_argument("--force", action="store_true", help="re-check every pair, ignoring cached verdicts")
+    add_instrument_args(parser)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    stage_4b_compile_check(parse_args())
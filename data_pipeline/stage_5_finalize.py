@@ -1,60 +1,102 @@
 # stage_5_finalize.py
 import os
-import json
-import hashlib
 from pathlib import Path
 from tqdm import tqdm
-from datasets import Dataset
-import random
+import orjson
 from config import CONFIG
+from instrument import add_instrument_args, count, instrumented, note
+from artifact_store import ArtifactStore
 
 def ensure_dir(path): os.makedirs(path, exist_ok=True)
 
+SPLITS = ("train", "val", "test")
+
+def split_for(digest, val_fraction, test_fraction):
+    # digest: the pair's hash in the store (artifact_store.pair_hash, hex). It is uniform,
+    # so its leading 8 bytes act as a per-example random draw that never changes: an
+    # example lands in the same split on every run, however much data is added around it
+    u = int(digest[:16], 16) / 2**64
+    if u < test_fraction:
+        return "test"
+    if u < test_fraction + val_fraction:
+        return "val"
+    return "train"
+
+def iter_examples(store, stats, compile_failures="keep"):
+    # compile_failures: what to do with pairs whose C code failed stage 4b's compile check
+    # (drop / tag / keep); pairs it hasn't checked pass through untagged
+    # -> (pair_hash, example)
+    for _, digest, data, verdict in tqdm(store.iter_pairs(checks=True), total=store.counts()["pairs"]):
+        if verdict == "fail" and compile_failures == "drop":
+            stats["compile_failed"] += 1
+            continue
+        try:
+            ex = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            stats["bad"] += 1
+            continue
+        if not isinstance(ex, dict) or not isinstance(ex.get("conversations"), list):
+            stats["bad"] += 1
+            continue
+        if verdict and compile_failures == "tag":
+            ex["compile_check"] = verdict
+        yield digest, ex
+
+@instrumented("stage_5_finalize")
 def stage_5_finalize(args):
     print("=== Stage 5: Finalize dataset ===")
     ensure_dir(CONFIG["final_dir"])
-    
-    all_files = list(Path(CONFIG["generated_dir"]).glob("*.jsonl"))
-    examples = []
+
+    # Streams examples from the artifact store straight to the split files; only the digests
+    # of seen examples stay in memory (the store already keeps one row per conversation)
+    store = ArtifactStore(CONFIG["artifact_db"])
+    if not store.counts()["pairs"] and any(Path(CONFIG["generated_dir"]).glob("*.jsonl")):
+        print(f"⚠️ No pairs in {CONFIG['artifact_db']} but {CONFIG['generated_dir']} has pair files: "
+              f"load them with python artifact_store.py import")
+    stats = {"bad": 0, "duplicates": 0, "compile_failed": 0}
+    counts = dict.fromkeys(SPLITS, 0)
     seen = set()
-    
-    for f in tqdm(all_files):
-        for line in f.read_text(encoding="utf-8").splitlines():
-            if not line.strip():
+    paths = {name: Path(CONFIG["final_dir"]) / f"stm32_f405_{name}.jsonl" for name in SPLITS}
+    outs = {name: open(path.with_suffix(".jsonl.tmp"), "wb", buffering=1 << 20) for name, path in paths.items()}
+    try:
+        for digest, ex in iter_examples(store, stats, args.compile_failures):
+            if digest in seen:
+                stats["duplicates"] += 1
                 continue
-            try:
-                ex = json.loads(line)
-                # dedup by hash of conversations
-                h = hashlib.md5(str(ex["conversations"]).encode()).hexdigest()
-                if h not in seen:
-                    seen.add(h)
-                    examples.append(ex)
-            except:  # noqa: E722
-                pass
-    
-    # Shuffle & split
-    random.shuffle(examples)
-    n = len(examples)
-    train = examples[:int(n*0.90)]
-    val = examples[int(n*0.90):int(n*0.95)]
-    test = examples[int(n*0.95):]
-    
-    def save_split(data, name):
-        ds = Dataset.from_list(data)
-        ds.to_json(Path(CONFIG["final_dir"]) / f"stm32_f405_{name}.jsonl")
-    
-    save_split(train, "train")
-    save_split(val, "val")
-    save_split(test, "test")
-    
+            seen.add(digest)
+            name = split_for(digest, args.val_fraction, args.test_fraction)
+            outs[name].write(orjson.dumps(ex) + b"\n")
+            counts[name] += 1
+    finally:
+        for out in outs.values():
+            out.close()
+    for name, path in paths.items():
+        os.replace(path.with_suffix(".jsonl.tmp"), path)
+    store.close()
+
+    count("pairs_kept", sum(counts.values()))
+    count("pairs_duplicate", stats["duplicates"])
+    count("lines_malformed", stats["bad"])
+    count("pairs_compile_failed", stats["compile_failed"])
+    note("splits", counts)
     print("Final dataset ready!")
-    print(f"   Train: {len(train)} pairs")
-    print(f"   Val:   {len(val)} pairs")
-    print(f"   Test:  {len(test)} pairs")
-    print("Files in data_pipeline/final/ — ready for training!")
+    print(f"   Train: {counts['train']} pairs")
+    print(f"   Val:   {counts['val']} pairs")
+    print(f"   Test:  {counts['test']} pairs")
+    print(f"   Skipped {stats['duplicates']} duplicates and {stats['bad']} malformed lines")
+    if stats["compile_failed"]:
+        print(f"   Dropped {stats['compile_failed']} pairs whose C code doesn't compile (stage 4b)")
+    print(f"Files in {CONFIG['final_dir']} — ready for training!")
 
-if __name__ == "__main__":
+def parse_args(argv=None):
     import argparse
     parser = argparse.ArgumentParser()
-    args = parser.parse_args()  # No args needed
-    stage_5_finalize(args)
\ No newline at end of file
+    parser.add_argument("--val-fraction", type=float, default=CONFIG["val_fraction"])
+    parser.add_argument("--test-fraction", type=float, default=CONFIG["test_fraction"])
+    parser.add_argument("--compile-failures", choices=["drop", "tag", "keep"], default=CONFIG["compile_check_failures"],
+                        help="pairs that failed the stage 4b compile check")
+    add_instrument_args(parser)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    stage_5_finalize(parse_args())
@@ -0,0 +1,97 @@
+# token_budget.py - token counts from the generation model's tokenizer, cached
+# Stage 3 sizes chunks with it and stage 4 truncates prompts with it, so both agree on
+# what fits. Counts are memoized by content hash: the splitters ask about the same
+# paragraphs and separators over and over. The model's tokenizer.json is loaded with the
+# tokenizers library directly (importing transformers would cost seconds per stage); if it
+# can't be had (offline and not cached) a rough regex estimate is used, with a warning.
+import re
+import threading
+from pathlib import Path
+import xxhash
+from config import CONFIG
+
+# Roughly one token per word, number group, punctuation mark or whitespace run
+_PIECES = re.compile(r"[A-Za-z]+|\d{1,3}|\s+|[^\sA-Za-z\d]")
+
+_counters = {}
+
+
+class TokenCounter:
+    def __init__(self, tokenizer=None, name=None):
+        # tokenizer: a tokenizers.Tokenizer, or None to estimate
+        self.tokenizer = tokenizer
+        self.name = name or "estimate"
+        self.exact = tokenizer is not None
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # HF fast tokenizers aren't thread-safe
+
+    def _encode(self, texts):
+        if not self.exact:
+            return [max(len(_PIECES.findall(t)), len(t.encode("utf-8")) // 4) for t in texts]
+        with self.lock:
+            return [len(e.ids) for e in self.tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+    def count_many(self, texts):
+        keys = [xxhash.xxh3_64_intdigest(t.encode("utf-8")) for t in texts]
+        todo = {k: t for k, t in zip(keys, texts) if k not in self.cache}
+        self.hits += len(keys) - len(todo)
+        self.misses += len(todo)
+        if todo:
+            if len(self.cache) > 200_000:
+                self.cache.clear()
+            self.cache.update(zip(todo, self._encode(list(todo.values()))))
+        return [self.cache[k] for k in keys]
+
+    def count(self, text):
+        if not text:
+            return 0
+        return self.count_many([text])[0]
+
+    def fits(self, text, budget):
+        # Byte-level BPE never makes more tokens than UTF-8 bytes, so short texts need no tokenizing
+        return len(text.encode("utf-8")) <= budget or self.count(text) <= budget
+
+    def truncate(self, text, budget):
+        # -> (prefix of text with at most budget tokens, truncated?)
+        if self.fits(text, budget):
+            return text, False
+        if self.exact:
+            with self.lock:
+                offsets = self.tokenizer.encode(text, add_special_tokens=False).offsets
+            return text[:offsets[budget - 1][1]] if budget > 0 else "", True
+        end = len(text) * budget // self.count(text)
+        while end > 0 and self.count(text[:end]) > budget:
+            end = end * 9 // 10
+        return text[:end], True
+
+    def stats(self):
+        return {"tokenizer": self.name, "exact": self.exact, "cache_hits": self.hits, "cache_misses": self.misses}
+
+
+def load_counter(model_name):
+    # model_name: HF repo id or a local directory / tokenizer.json path
+    try:
+        from tokenizers import Tokenizer
+        path = Path(model_name)
+        if path.is_dir():
+            path = path / "tokenizer.json"
+        if not path.is_file():
+            from huggingface_hub import hf_hub_download
+            try:
+                path = hf_hub_download(model_name, "tokenizer.json", local_files_only=True)
+            except Exception:
+                path = hf_hub_download(model_name, "tokenizer.json")
+        return TokenCounter(Tokenizer.from_file(str(path)), model_name)
+    except Exception as e:
+        print(f"⚠️ Could not load tokenizer {model_name} ({type(e).__name__}); token counts are estimates")
+        return TokenCounter(name=f"estimate ({model_name})")
+
+
+def get_counter(model_name=None):
+    # One counter per tokenizer per process
+    model_name = model_name or CONFIG["tokenizer_model"]
+    if model_name not in _counters:
+        _counters[model_name] = load_counter(model_name)
+    return _counters[model_name]
@@ -1,5 +1,420 @@
+# main.py - incremental runner for data_pipeline stages 1-5 (and 3b, 4b)
+# The stages form a small DAG. Each node fingerprints what it reads (input file stats,
+# the CONFIG keys it uses, the source of the modules that implement it) and only runs
+# when that fingerprint changed since the last successful run. Stage 2 goes further and
+# tracks one fingerprint per PDF / repo / local file, so only changed sources are
+# re-extracted. Nodes whose dependencies are done run concurrently (PDF and repo
+# extraction). Heavy stage modules are imported only when they actually run, which keeps
+# a no-op run to stat() calls plus a few small file hashes.
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+PIPELINE_DIR = Path(__file__).resolve().parent / "data_pipeline"
+sys.path.insert(0, str(PIPELINE_DIR))
+from config import CONFIG  # noqa: E402
+from instrument import StageRun  # noqa: E402
+
+STATE_FILE = Path(CONFIG["gen_ledger"]).parent / "pipeline_state.json"
+
+
+def digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+_code_hashes = {}
+
+def code_hash(*modules):
+    # Source of the modules a node runs; editing any of them invalidates the node
+    h = hashlib.sha256()
+    for module in modules:
+        if module not in _code_hashes:
+            _code_hashes[module] = hashlib.sha256((PIPELINE_DIR / module).read_bytes()).hexdigest()
+        h.update(_code_hashes[module].encode())
+    return h.hexdigest()
+
+
+def file_sig(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def tree_sig(root):
+    # (relative path, size, mtime) of every file below root, hashed
+    h = hashlib.sha256()
+    stack = [str(root)]
+    entries = []
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    entries.append(f"{os.path.relpath(entry.path, root)}\0{st.st_size}\0{st.st_mtime_ns}")
+    for e in sorted(entries):
+        h.update(e.encode("utf-8", "surrogateescape") + b"\n")
+    return h.hexdigest()
+
+
+def store_sig(table):
+    # Content signature of one table of the artifact store (chunks / pairs)
+    if not os.path.exists(CONFIG["artifact_db"]):
+        return None
+    from artifact_store import ArtifactStore
+    store = ArtifactStore(CONFIG["artifact_db"])
+    try:
+        return store.signature(table)
+    finally:
+        store.close()
+
+
+def git_head(repo_dir):
+    # Commit the working tree is at, read straight from .git (no subprocess)
+    git_dir = Path(repo_dir) / ".git"
+    try:
+        head = (git_dir / "HEAD").read_text().strip()
+        if head.startswith("ref: "):
+            ref = head[5:]
+            ref_file = git_dir / ref
+            if ref_file.exists():
+                return ref_file.read_text().strip()
+            for line in (git_dir / "packed-refs").read_text().splitlines():
+                if line.endswith(" " + ref):
+                    return line.split()[0]
+        return head
+    except OSError:
+        return tree_sig(repo_dir)  # not a git checkout
+
+
+def config_keys(*keys):
+    return {k: CONFIG.get(k) for k in keys}
+
+
+class Node:
+    # name, upstream node names, and how to fingerprint / run it.
+    # Whole-stage nodes implement fingerprint() + run(); per-unit nodes implement
+    # units() -> {unit: (fingerprint, output path)} + run_units(changed units).
+    deps = ()
+    per_unit = False
+
+    def __init__(self, opts):
+        self.opts = opts
+
+    def fingerprint(self):
+        raise NotImplementedError
+
+    def outputs(self):
+        # Paths that must exist for a matching fingerprint to count as up to date
+        return []
+
+    def run(self):
+        raise NotImplementedError
+
+    def record(self):
+        # Whether a successful run may be remembered (partial runs must not be)
+        return True
+
+    def argv(self, *extra):
+        # Stage CLI arguments, plus the instrumentation flags main.py was given
+        return list(extra) + ["--profile"] * self.opts.profile + ["--trace-mem"] * self.opts.trace_mem
+
+
+class Download(Node):
+    name = "download"
+
+    def fingerprint(self):
+        return digest(code_hash("stage_1_download.py", "downloader.py", "repo_sync.py"),
+                      config_keys("pdfs", "repos", "web", "download_manifest", "repo_clone_depth"),
+                      file_sig(CONFIG["pdf_links_file"]) if self.opts.links else None,
+                      time.time() if self.opts.update_repos else None)  # upstream commits can't be seen from here
+
+    def outputs(self):
+        return ([Path(CONFIG["raw_pdfs_dir"]) / f"{name}.pdf" for name in CONFIG["pdfs"]]
+                + [Path(CONFIG["raw_repos_dir"]) / name for name in CONFIG["repos"]])
+
+    def run(self):
+        import stage_1_download
+        extra = ["--links"] * self.opts.links + ["--update"] * self.opts.update_repos
+        stage_1_download.stage_1_download(stage_1_download.parse_args(self.argv(*extra)))
+
+    def record(self):
+        # Failed downloads/clones are only printed by stage 1; try again next time
+        return all(p.exists() for p in self.outputs())
+
+
+class ExtractPdfs(Node):
+    name = "extract_pdfs"
+    deps = ("download",)
+    per_unit = True
+
+    def units(self):
+        import stage_2_extract
+        code = code_hash("stage_2_extract.py", "pdf_extract.py", "downloader.py")
+        return {str(pdf_file): (digest(code, CONFIG["pdf_backend"], file_sig(pdf_file)), str(out))
+                for pdf_file, out in stage_2_extract.pdf_outputs().items()}
+
+    def run_units(self, units):
+        import stage_2_extract
+        os.makedirs(CONFIG["extracted_dir"], exist_ok=True)
+        args = stage_2_extract.parse_args(self.argv())
+        with StageRun(self.name, args):  # stage 2 runs as three nodes, so one report each
+            stage_2_extract.extract_pdf_sources(args, [Path(u) for u in units])
+
+
+class ExtractRepos(Node):
+    name = "extract_repos"
+    deps = ("download",)
+    per_unit = True
+
+    def units(self):
+        import stage_2_extract
+        code = code_hash("stage_2_extract.py", "repo_extract.py", "repo_sync.py")
+        return {str(repo_dir): (digest(code, CONFIG["repos"].get(repo_dir.name, {}).get("include_folders"), git_head(repo_dir)), str(out))
+                for repo_dir, out in stage_2_extract.repo_outputs().items()}
+
+    def run_units(self, units):
+        import stage_2_extract
+        os.makedirs(CONFIG["extracted_dir"], exist_ok=True)
+        args = stage_2_extract.parse_args(self.argv())
+        with StageRun(self.name, args):  # stage 2 runs as three nodes, so one report each
+            stage_2_extract.extract_repo_sources(args, [Path(u) for u in units])
+
+
+class ExtractLocal(Node):
+    name = "extract_local"
+    deps = ("download",)
+    per_unit = True
+
+    def units(self):
+        import stage_2_extract
+        code = code_hash("stage_2_extract.py")
+        return {str(f): (digest(code, file_sig(f)), str(out)) for f, out in stage_2_extract.local_outputs().items()}
+
+    def run_units(self, units):
+        import stage_2_extract
+        os.makedirs(CONFIG["extracted_dir"], exist_ok=True)
+        args = stage_2_extract.parse_args(self.argv())
+        with StageRun(self.name, args):  # stage 2 runs as three nodes, so one report each
+            stage_2_extract.extract_local_sources(args, [Path(u) for u in units])
+
+
+class Chunk(Node):
+    name = "chunk"
+    deps = ("extract_pdfs", "extract_repos", "extract_local")
+
+    def fingerprint(self):
+        return digest(code_hash("stage_3_chunk.py", "chunker.py", "dedup.py", "token_budget.py", "bm25_index.py", "artifact_store.py"),
+                      config_keys("dedup_threshold", "dedup_num_perm", "max_chunk_tokens", "chunk_overlap_tokens",
+                                  "chunk_min_tokens", "tokenizer_model"),
+                      tree_sig(CONFIG["extracted_dir"]))
+
+    def outputs(self):
+        return [CONFIG["artifact_db"], CONFIG["index_dir"]]
+
+    def run(self):
+        import stage_3_chunk
+        stage_3_chunk.stage_3_chunk(stage_3_chunk.parse_args(self.argv()))
+
+
+class Schedule(Node):
+    name = "schedule"
+    deps = ("chunk",)
+
+    def fingerprint(self):
+        return digest(code_hash("stage_3b_schedule.py", "scheduler.py", "dedup.py"),
+                      config_keys("schedule_similarity", "dedup_num_perm", "target_pairs", "pairs_per_chunk"),
+                      store_sig("chunks"))
+
+    def outputs(self):
+        return [CONFIG["chunk_schedule"]]
+
+    def run(self):
+        import stage_3b_schedule
+        stage_3b_schedule.stage_3b_schedule(stage_3b_schedule.parse_args(self.argv()))
+
+
+class Generate(Node):
+    name = "generate"
+    deps = ("schedule",)
+
+    def fingerprint(self):
+        # Per-chunk reruns are the job ledger's business (stage 4 skips finished chunks)
+        keys = [k for k in CONFIG if k.startswith("gen_") or k.startswith("openai_")]
+        return digest(code_hash("stage_4_generate.py", "generation.py", "pair_parser.py", "pipeline.py", "ledger.py", "token_budget.py",
+                                "bm25_index.py", "artifact_store.py"),
+                      config_keys("board_name", "mcu", "target_pairs", "pairs_per_chunk", "max_chunk_tokens", "tokenizer_model", *keys),
+                      self.opts.gen_backend, store_sig("chunks"), file_sig(CONFIG["chunk_schedule"]),
+                      file_sig(Path(CONFIG["index_dir"]) / "meta.json"))
+
+    def run(self):
+        import stage_4_generate
+        argv = []
+        if self.opts.gen_backend:
+            argv += ["--backend", self.opts.gen_backend]
+        if self.opts.max_chunks:
+            argv += ["--max-chunks", str(self.opts.max_chunks)]
+        stage_4_generate.stage_4_generate(stage_4_generate.parse_args(self.argv(*argv)))
+
+    def record(self):
+        return not self.opts.max_chunks  # a trial run leaves chunks for the next one
+
+
+class CompileCheck(Node):
+    name = "compile_check"
+    deps = ("generate",)
+
+    def fingerprint(self):
+        # Per-pair and per-block reruns are the verdict cache's business
+        return digest(code_hash("stage_4b_compile_check.py", "compile_check.py", "artifact_store.py"),
+                      config_keys("compile_check_cc", "compile_check_defines", "compile_check_include_dirs"),
+                      store_sig("pairs"), git_head(Path(CONFIG["raw_repos_dir"]) / "stm32cubef4"))
+
+    def outputs(self):
+        return [CONFIG["compile_check_report"]]
+
+    def run(self):
+        import stage_4b_compile_check
+        stage_4b_compile_check.stage_4b_compile_check(stage_4b_compile_check.parse_args(self.argv()))
+
+
+class Finalize(Node):
+    name = "finalize"
+    deps = ("compile_check",)
+
+    def fingerprint(self):
+        return digest(code_hash("stage_5_finalize.py", "artifact_store.py"),
+                      config_keys("val_fraction", "test_fraction", "compile_check_failures"),
+                      store_sig("pairs"), store_sig("pair_checks"))
+
+    def outputs(self):
+        return [Path(CONFIG["final_dir"]) / f"stm32_f405_{name}.jsonl" for name in ("train", "val", "test")]
+
+    def run(self):
+        import stage_5_finalize
+        stage_5_finalize.stage_5_finalize(stage_5_finalize.parse_args(self.argv()))
+
+
+NODES = [Download, ExtractPdfs, ExtractRepos, ExtractLocal, Chunk, Schedule, Generate, CompileCheck, Finalize]
+
+
+class Runner:
+    def __init__(self, opts):
+        self.opts = opts
+        self.nodes = {cls.name: cls(opts) for cls in NODES}
+        self.state = json.loads(STATE_FILE.read_text()) if STATE_FILE.exists() else {}
+        self.results = {}
+
+    def save(self):
+        STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = STATE_FILE.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state, indent=1))
+        os.replace(tmp, STATE_FILE)
+
+    def selected(self, name):
+        return not self.opts.only or name in self.opts.only
+
+    def execute(self, node):
+        # -> "ran", "skipped", "failed"; state is only updated after a successful run
+        forced = self.opts.force
+        if not node.per_unit:
+            fp = node.fingerprint()
+            if not forced and self.state.get(node.name) == fp and all(os.path.exists(p) for p in node.outputs()):
+                return "skipped"
+            if self.opts.dry_run:
+                return "would run"
+            print(f"▶ {node.name}")
+            node.run()
+            if node.record():
+                self.state[node.name] = fp
+            return "ran"
+
+        units = node.units()
+        old = self.state.get(node.name, {})
+        changed = [u for u, (fp, out) in units.items()
+                   if forced or old.get(u, [None])[0] != fp or not os.path.exists(out)]
+        gone = [u for u in old if u not in units]
+        if not changed and not gone:
+            return "skipped"
+        if self.opts.dry_run:
+            return f"would run {len(changed)} unit(s), drop {len(gone)}"
+        for u in gone:
+            # Source disappeared: remove what it produced so downstream stops seeing it
+            Path(old[u][1]).unlink(missing_ok=True)
+        if changed:
+            print(f"▶ {node.name}: {len(changed)}/{len(units)} unit(s) changed")
+            node.run_units(changed)
+        # Units the stage failed on produced no output; leave them out so they're retried
+        self.state[node.name] = {u: [fp, out] for u, (fp, out) in units.items()
+                                 if os.path.exists(out) or u not in changed}
+        return "ran"
+
+    def run(self):
+        start = time.perf_counter()
+        done, failed = set(), set()
+        futures = {}
+        # cProfile and tracemalloc are process-wide (one stage's exit would stop the other's
+        # tracing), so profiling or tracing memory runs nodes one at a time
+        with ThreadPoolExecutor(max_workers=1 if self.opts.profile or self.opts.trace_mem else len(self.nodes)) as pool:
+            while len(done) + len(failed) < len(self.nodes):
+                for name, node in self.nodes.items():
+                    if name in done or name in failed or name in futures.values():
+                        continue
+                    if any(d in failed for d in node.deps):
+                        failed.add(name)
+                        self.results[name] = "blocked"
+                    elif all(d in done for d in node.deps):
+                        if self.selected(name):
+                            futures[pool.submit(self.execute, node)] = name
+                        else:
+                            done.add(name)
+                            self.results[name] = "not selected"
+                if not futures:
+                    continue
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    name = futures.pop(f)
+                    try:
+                        self.results[name] = f.result()
+                        done.add(name)
+                    except Exception as e:
+                        print(f"⚠️ {name} failed: {e}")
+                        self.results[name] = "failed"
+                        failed.add(name)
+                    if not self.opts.dry_run:
+                        self.save()
+        for name in self.nodes:
+            print(f"  {name:14s} {self.results.get(name)}")
+        print(f"Pipeline finished in {time.perf_counter() - start:.2f}s")
+        return not failed
+
+
 def main():
-    print("Hello from stm32-coder-ft!")
+    parser = argparse.ArgumentParser(description="Run the data pipeline, re-running only what changed")
+    parser.add_argument("--only", nargs="+", choices=[cls.name for cls in NODES], help="run just these nodes")
+    parser.add_argument("--force", action="store_true", help="ignore fingerprints and re-run everything selected")
+    parser.add_argument("--dry-run", action="store_true", help="show what would run")
+    parser.add_argument("--links", action="store_true", help="stage 1: also fetch the PDFs in website-pdf-links.txt")
+    parser.add_argument("--update-repos", action="store_true", help="stage 1: fetch new upstream commits (stage 2 then re-reads changed files only)")
+    parser.add_argument("--gen-backend", choices=["unsloth", "openai", "stub"], default=None)
+    parser.add_argument("--max-chunks", type=int, default=None, help="stage 4 trial run (not recorded as done)")
+    parser.add_argument("--profile", action="store_true", help="cProfile each stage (see data/reports/runs/)")
+    parser.add_argument("--trace-mem", action="store_true", help="tracemalloc each stage")
+    opts = parser.parse_args()
+    os.chdir(PIPELINE_DIR)  # stages resolve some CONFIG paths relative to data_pipeline/
+    sys.exit(0 if Runner(opts).run() else 1)
 
 
 if __name__ == "__main__":
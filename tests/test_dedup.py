@@ -0,0 +1,57 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "data_pipeline"))
+from dedup import ChunkDeduper, MinHashLSH  # noqa: E402
+
+
+def register_table(periph, reg, fields):
+    # CMSIS-style bit definitions: "#define RCC_AHB1ENR_GPIOAEN_Pos (0U)" and friends
+    lines = [f"/********************  Bit definition for {periph}_{reg} register  ********************/"]
+    for bit, field in enumerate(fields):
+        name = f"{periph}_{reg}_{field}"
+        lines += [f"#define {name}_Pos (%dU)" % bit,
+                  f"#define {name}_Msk (0x1UL << {name}_Pos) /*!< 0x%08X */" % (1 << bit),
+                  f"#define {name} {name}_Msk"]
+    return "\n".join(lines)
+
+
+TABLES = [
+    register_table("RCC", "AHB1ENR", ["GPIOAEN", "GPIOBEN", "GPIOCEN", "GPIODEN", "GPIOEEN", "GPIOHEN", "CRCEN", "DMA1EN", "DMA2EN"]),
+    register_table("RCC", "AHB2ENR", ["DCMIEN", "CRYPEN", "HASHEN", "RNGEN", "OTGFSEN"]),
+    register_table("TIM", "CR1", ["CEN", "UDIS", "URS", "OPM", "DIR", "CMS_0", "CMS_1", "ARPE", "CKD_0", "CKD_1"]),
+    register_table("USART", "SR", ["PE", "FE", "NE", "ORE", "IDLE", "RXNE", "TC", "TXE", "LBD", "CTS"]),
+]
+
+HAL_FILE = "\n".join(
+    f"HAL_StatusTypeDef HAL_TIM_Step{i}(TIM_HandleTypeDef *htim)\n{{\n"
+    f"  assert_param(IS_TIM_INSTANCE(htim->Instance));\n"
+    f"  htim->State = HAL_TIM_STATE_BUSY;\n"
+    f"  __HAL_TIM_ENABLE_IT(htim, TIM_IT_CC{i % 4 + 1});\n"
+    f"  htim->Instance->CCR{i % 4 + 1} = {i * 100}U;\n"
+    f"  return HAL_OK;\n}}\n" for i in range(30))
+
+
+def similarity(a, b):
+    sig = MinHashLSH(num_perm=256).signatures([a, b])
+    return (sig[0] == sig[1]).mean()
+
+
+def test_register_blocks_stay_separate():
+    # Same layout, different symbols: byte-prefix shingles saw these as near copies
+    for i, a in enumerate(TABLES):
+        for b in TABLES[i + 1:]:
+            assert similarity(a, b) < 0.3
+    deduper = ChunkDeduper(threshold=0.85, num_perm=128)
+    chunks = [(str(i), t) for i, t in enumerate(TABLES)]
+    assert len(list(deduper.filter(chunks))) == len(TABLES)
+
+
+def test_copied_hal_files_still_cluster():
+    # A vendored copy with its own header comment and reindented
+    copy = "/* Copied from STM32CubeF4 v1.27.1 */\n" + HAL_FILE.replace("  ", "\t")
+    assert similarity(HAL_FILE, copy) > 0.9
+    deduper = ChunkDeduper(threshold=0.85, num_perm=128)
+    chunks = [("a", HAL_FILE), ("b", TABLES[0]), ("c", copy)]
+    assert [name for name, _ in deduper.filter(chunks)] == ["a", "b"]
+    assert deduper.dropped == 1
@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "data_pipeline"))
+from downloader import Downloader, Manifest, make_session  # noqa: E402
+
+PDF = b"%PDF-1.4\n" + os.urandom(200_000)
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Serves server.files {path: (body, etag)} with ETag / If-None-Match / Range / If-Range,
+    # gzip when the client accepts it (as CDNs do), and can cut the next GET short
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond(head=False)
+
+    def respond(self, head):
+        server = self.server
+        server.requests.append((self.command, self.headers))
+        body, etag = server.files[self.path]
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        status, headers = 200, {"ETag": etag}
+        rng = self.headers.get("Range")
+        if rng and self.headers.get("If-Range") in (None, etag):
+            start = int(rng.split("=")[1].rstrip("-"))
+            status, headers["Content-Range"] = 206, f"bytes {start}-{len(body) - 1}/{len(body)}"
+            body = body[start:]
+        elif "gzip" in self.headers.get("Accept-Encoding", ""):
+            body, headers["Content-Encoding"] = gzip.compress(body), "gzip"
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if head:
+            return
+        if server.cut_next_get:
+            body, server.cut_next_get = body[:server.cut_next_get], 0
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(files):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.files, server.requests, server.cut_next_get = files, [], 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def downloader(tmp_path):
+    return Downloader(Manifest(tmp_path / "manifest.json"), workers=1, session=make_session(pool_size=1, retries=0), timeout=10)
+
+
+def test_interrupted_download_resumes(tmp_path):
+    server, base = serve({"/doc.pdf": (PDF, '"v1"')})
+    try:
+        jobs = {"doc": (base + "/doc.pdf", tmp_path / "doc.pdf")}
+        server.cut_next_get = 150_000  # two full CHUNK_SIZE blocks reach the .part
+        assert downloader(tmp_path).fetch_all(jobs) == {"doc": "failed"}
+        part = tmp_path / "doc.pdf.part"
+        assert not (tmp_path / "doc.pdf").exists() and 0 < part.stat().st_size < len(PDF)
+        offset = part.stat().st_size
+
+        assert downloader(tmp_path).fetch_all(jobs) == {"doc": "resumed"}
+        method, headers = server.requests[-1]
+        assert headers["Range"] == f"bytes={offset}-" and headers["If-Range"] == '"v1"'
+        assert (tmp_path / "doc.pdf").read_bytes() == PDF and not part.exists()
+        entry = Manifest(tmp_path / "manifest.json").get("doc")
+        assert entry["complete"] and entry["size"] == len(PDF) and entry["sha256"] == hashlib.sha256(PDF).hexdigest()
+        # Byte offsets only line up with an uncompressed body
+        assert all(h.get("Accept-Encoding") == "identity" for _, h in server.requests)
+    finally:
+        server.shutdown()
+
+
+def test_revalidation_304_and_changed_etag(tmp_path):
+    server, base = serve({"/doc.pdf": (PDF, '"v1"')})
+    try:
+        jobs = {"doc": (base + "/doc.pdf", tmp_path / "doc.pdf")}
+        assert downloader(tmp_path).fetch_all(jobs) == {"doc": "downloaded"}
+
+        assert downloader(tmp_path).fetch_all(jobs) == {"doc": "not-modified"}
+        method, headers = server.requests[-1]
+        assert method == "HEAD" and headers["If-None-Match"] == '"v1"'
+
+        new = PDF[:-10] + b"revision 2"
+        server.files["/doc.pdf"] = (new, '"v2"')
+        assert downloader(tmp_path).fetch_all(jobs) == {"doc": "downloaded"}
+        assert (tmp_path / "doc.pdf").read_bytes() == new
+        entry = Manifest(tmp_path / "manifest.json").get("doc")
+        assert entry["etag"] == '"v2"' and entry["sha256"] == hashlib.sha256(new).hexdigest()
+    finally:
+        server.shutdown()
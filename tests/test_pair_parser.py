@@ -0,0 +1,25 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "data_pipeline"))
+from pair_parser import PairParser, parse_pairs  # noqa: E402
+
+PAIR = {"conversations": [{"from": "human", "value": "Blink PA5?"}, {"from": "gpt", "value": "```c\nHAL_GPIO_TogglePin(GPIOA, GPIO_PIN_5);\n```"}]}
+
+
+def test_prose_preamble_keeps_pairs():
+    text = "Here are the conversations you asked for. " * 16 + "\n" + json.dumps(PAIR) + "\n" + json.dumps(PAIR)
+    assert len(text.split("{", 1)[0]) > 400
+    assert len(parse_pairs(text)) == 2
+    # The streaming limits still stop a generation that derails
+    parser = PairParser()
+    parser.feed(text)
+    assert parser.stop_reason == "derailed" and not parser.pairs
+
+
+def test_invalid_objects_before_a_pair():
+    text = '{"a": 1}\n{"b": 2}\n{"conversations": []}\n' + json.dumps(PAIR)
+    parser = PairParser(max_garbage=None, max_bad_run=None)
+    parser.feed(text)
+    assert len(parser.pairs) == 1 and parser.invalid == 3 and parser.stop_reason is None
@@ -0,0 +1,23 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "data_pipeline"))
+from pdf_extract import PageCache  # noqa: E402
+
+
+def test_fallback_pages_are_not_cached_as_primary(tmp_path):
+    cache = PageCache(tmp_path, "pymupdf4llm")
+    cache.put("rm0090", "abc", 0, "# page 0")
+    cache.put("rm0090", "abc", 1, "page 1 (pdftotext)", fallback=True)
+    assert not (tmp_path / "pymupdf4llm" / "rm0090" / "abc" / "00001.md").exists()
+    # The fallback page fills in the output but is retried with pymupdf4llm next run
+    assert cache.missing_pages("rm0090", "abc", 2) == [1]
+    assert list(cache.pages("rm0090", "abc", 2)) == ["# page 0", "page 1 (pdftotext)"]
+    cache.put("rm0090", "abc", 1, "# page 1")
+    assert cache.missing_pages("rm0090", "abc", 2) == []
+    assert list(cache.pages("rm0090", "abc", 2)) == ["# page 0", "# page 1"]
+
+    cache.put("rm0090", "new", 0, "x", fallback=True)
+    cache.prune("rm0090", "new")
+    assert not (tmp_path / "pymupdf4llm" / "rm0090" / "abc").exists()
+    assert not (tmp_path / "pdftotext" / "rm0090" / "abc").exists()
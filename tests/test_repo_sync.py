@@ -0,0 +1,103 @@
+import json
+import sys
+from pathlib import Path
+import git
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "data_pipeline"))
+from repo_extract import _previous, extract_repo, pathspecs, sections_path  # noqa: E402
+from repo_sync import changed_files, sync_repo  # noqa: E402
+
+FOLDERS = ["Drivers"]
+
+
+class Upstream:
+    # A working repo that pushes to a local bare repo, which is what the pipeline clones
+    def __init__(self, root, files):
+        self.work = git.Repo.init(root / "work", initial_branch="main")
+        with self.work.config_writer() as cfg:
+            cfg.set_value("user", "name", "test")
+            cfg.set_value("user", "email", "test@example.com")
+        self.commit(files, "initial")
+        self.bare = root / "upstream.git"
+        git.Repo.clone_from(self.work.working_dir, self.bare, bare=True)
+        git.Repo(self.bare).git.config("uploadpack.allowFilter", "true")  # serve --filter=blob:none
+        self.work.create_remote("origin", str(self.bare))
+
+    def commit(self, files, message):
+        # files: {path: text, or None to delete}
+        for rel, text in files.items():
+            path = Path(self.work.working_dir) / rel
+            if text is None:
+                self.work.index.remove([rel], working_tree=True)
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(text, encoding="utf-8")
+            self.work.index.add([rel])
+        self.work.git.commit("-m", message)
+        if self.work.remotes:
+            self.work.git.push("origin", "main")
+        return self.work.head.commit.hexsha
+
+
+FILES = {
+    "Drivers/stm32f4xx_hal_gpio.c": "void HAL_GPIO_Init(void) {}\n",
+    "Drivers/stm32f4xx_hal_gpio.h": "void HAL_GPIO_Init(void);\n",
+    "Drivers/Inc/stm32f4xx_hal_tim.h": "void HAL_TIM_Base_Start(void);\n",
+    "Examples/main.c": "int main(void) { return 0; }\n",
+}
+UPDATE = {
+    "Drivers/stm32f4xx_hal_gpio.c": "void HAL_GPIO_Init(void) { /* v2 */ }\n",
+    "Drivers/stm32f4xx_hal_uart.c": "void HAL_UART_Init(void) {}\n",
+    "Drivers/stm32f4xx_hal_gpio.h": None,
+    "Examples/main.c": "int main(void) { for (;;) {} }\n",
+}
+
+
+def test_sparse_clone_fetch_and_incremental_extract(tmp_path):
+    upstream = Upstream(tmp_path, FILES)
+    clone = tmp_path / "clone"
+    first = sync_repo(str(upstream.bare), clone, FOLDERS, depth=1)
+    assert first["status"] == "cloned"
+    assert (clone / "Drivers/Inc/stm32f4xx_hal_tim.h").exists() and not (clone / "Examples").exists()
+    out = tmp_path / "code_clone.md"
+    assert extract_repo(clone, out, FOLDERS, workers=2) == 3
+
+    assert sync_repo(str(upstream.bare), clone, FOLDERS, depth=1, refresh=True)["status"] == "unchanged"
+    new = upstream.commit(UPDATE, "update")
+    second = sync_repo(str(upstream.bare), clone, FOLDERS, depth=1, refresh=True)
+    assert second == {"status": "updated", "commit": new, "previous_commit": first["commit"]}
+    assert not (clone / "Examples").exists()
+    assert changed_files(clone, first["commit"], new, pathspecs(FOLDERS)) == {
+        "Drivers/stm32f4xx_hal_gpio.c", "Drivers/stm32f4xx_hal_gpio.h", "Drivers/stm32f4xx_hal_uart.c"}
+
+    # Only the changed files are rendered again, and the result matches a full extraction
+    sections, changed = _previous(clone, out, FOLDERS, new)
+    assert "Drivers/Inc/stm32f4xx_hal_tim.h" in sections and "Drivers/Inc/stm32f4xx_hal_tim.h" not in changed
+    assert extract_repo(clone, out, FOLDERS, workers=2) == 3
+    full = tmp_path / "code_full.md"
+    extract_repo(clone, full, FOLDERS, workers=2, incremental=False)
+    assert out.read_bytes() == full.read_bytes()
+    assert json.loads(sections_path(out).read_text())["commit"] == new
+
+
+def test_changed_files_fallback(tmp_path):
+    upstream = Upstream(tmp_path, FILES)
+    clone = tmp_path / "clone"
+    sync_repo(str(upstream.bare), clone, FOLDERS, depth=1)
+    out = tmp_path / "code_clone.md"
+    extract_repo(clone, out, FOLDERS, workers=2)
+    assert changed_files(tmp_path / "missing", "HEAD~1", "HEAD") is None
+
+    # The commit the markdown was extracted at is gone (e.g. history rewritten upstream):
+    # no diff, so everything is extracted again
+    index = json.loads(sections_path(out).read_text())
+    index["commit"] = "0" * 40
+    sections_path(out).write_text(json.dumps(index))
+    new = upstream.commit(UPDATE, "update")
+    sync_repo(str(upstream.bare), clone, FOLDERS, depth=1, refresh=True)
+    assert changed_files(clone, "0" * 40, new) is None
+    assert _previous(clone, out, FOLDERS, new) is None
+    extract_repo(clone, out, FOLDERS, workers=2)
+    full = tmp_path / "code_full.md"
+    extract_repo(clone, full, FOLDERS, workers=2, incremental=False)
+    assert out.read_bytes() == full.read_bytes() and b"/* v2 */" in out.read_bytes()
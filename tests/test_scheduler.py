@@ -0,0 +1,46 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "data_pipeline"))
+from scheduler import ChunkScheduler  # noqa: E402
+
+
+def register_chunk(periph, regs):
+    # CMSIS device header excerpt: bit definitions of a few registers of one peripheral
+    lines = []
+    for reg, fields in regs.items():
+        lines.append(f"/********************  Bit definition for {periph}_{reg} register  ********************/")
+        for bit, field in enumerate(fields):
+            name = f"{periph}_{reg}_{field}"
+            lines += [f"#define {name}_Pos (%dU)" % bit,
+                      f"#define {name}_Msk (0x1UL << {name}_Pos) /*!< 0x%08X */" % (1 << bit),
+                      f"#define {name} {name}_Msk"]
+    return "\n".join(lines)
+
+
+CHUNKS = {
+    "rcc": register_chunk("RCC", {"AHB1ENR": ["GPIOAEN", "GPIOBEN", "GPIOCEN", "CRCEN", "DMA1EN", "DMA2EN"],
+                                  "APB1ENR": ["TIM2EN", "TIM3EN", "TIM4EN", "USART2EN", "I2C1EN", "PWREN"]}),
+    "tim": register_chunk("TIM", {"CR1": ["CEN", "UDIS", "URS", "OPM", "DIR", "ARPE"],
+                                  "DIER": ["UIE", "CC1IE", "CC2IE", "CC3IE", "CC4IE", "TIE"]}),
+    "usart": register_chunk("USART", {"SR": ["PE", "FE", "NE", "ORE", "IDLE", "RXNE", "TC", "TXE"],
+                                      "CR1": ["SBK", "RWU", "RE", "TE", "IDLEIE", "RXNEIE", "TCIE", "TXEIE"]}),
+    "adc": register_chunk("ADC", {"SR": ["AWD", "EOC", "JEOC", "JSTRT", "STRT", "OVR"],
+                                  "CR2": ["ADON", "CONT", "DMA", "DDS", "EOCS", "ALIGN", "SWSTART"]}),
+}
+
+
+def test_distinct_register_chunks_not_redundant():
+    scheduler = ChunkScheduler(num_perm=128, similarity=0.5)
+    scheduler.add(CHUNKS.items())
+    rows = scheduler.order()
+    assert sorted(r["chunk"] for r in rows) == sorted(CHUNKS)
+    assert all(r["redundancy"] < 0.2 for r in rows), rows
+
+
+def test_repeated_chunk_is_redundant():
+    scheduler = ChunkScheduler(num_perm=128, similarity=0.5)
+    scheduler.add([*CHUNKS.items(), ("rcc_copy", "/* stm32f405xx.h */\n" + CHUNKS["rcc"])])
+    rows = {r["chunk"]: r for r in scheduler.order()}
+    # Whichever of the two goes second is scored against the other
+    assert max(rows["rcc"]["redundancy"], rows["rcc_copy"]["redundancy"]) > 0.8
@@ -0,0 +1,262 @@
+# train_cache.py - tokenize the training split once into a memory-mapped cache
+# The ChatML rendering below is exactly the Modelfile TEMPLATE, so the model is trained on
+# the same byte layout Ollama feeds it at inference time. Each cache lives in
+# data/train_cache/<key>/, where key = hash(tokenizer, data file, template, max_seq_length):
+#   tokens.bin  uint32 token ids of every example, back to back
+#   mask.bin    uint8, 1 where the token belongs to an assistant reply (the loss targets)
+#   offsets.npy int64 [n + 1] example boundaries; lengths are np.diff(offsets)
+#   meta.json   counts, length stats, provenance
+# Everything here runs on CPU; only the tokenizer is needed.
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import random
+from pathlib import Path
+
+import numpy as np
+
+CACHE_ROOT = Path(__file__).resolve().parent / "data" / "train_cache"
+TEMPLATE_VERSION = 1  # bump when render_chatml changes
+ROLES = {"system": "system", "human": "user", "user": "user", "gpt": "assistant", "assistant": "assistant"}
+
+
+def render_chatml(conversations):
+    # -> [(text, is_target)] segments. Mirrors the Modelfile TEMPLATE: every block starts
+    # with "\n" (the {{- trims eat the newline after each <|im_end|>), system turns become
+    # .System, and assistant content + <|im_end|> is what the loss is computed on.
+    turns = [(ROLES.get(t.get("from"), t.get("from")), t.get("value", "")) for t in conversations]
+    system = "\n".join(v for r, v in turns if r == "system")
+    segments = []
+    if system:
+        segments.append((f"\n<|im_start|>system\n{system}<|im_end|>", False))
+    for role, value in turns:
+        if role == "user":
+            segments.append((f"\n<|im_start|>user\n{value}<|im_end|>", False))
+        elif role == "assistant":
+            segments.append(("\n<|im_start|>assistant\n", False))
+            segments.append((f"{value}<|im_end|>", True))
+    return segments
+
+
+def tokenizer_fingerprint(tokenizer):
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    spec = backend.to_str() if backend is not None else json.dumps(tokenizer.get_vocab(), sort_keys=True)
+    return hashlib.sha256(spec.encode("utf-8")).hexdigest()
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_dir(tokenizer, data_file, max_seq_length, root=CACHE_ROOT):
+    key = hashlib.sha256(f"{tokenizer_fingerprint(tokenizer)}|{file_hash(data_file)}|{TEMPLATE_VERSION}|{max_seq_length}".encode()).hexdigest()[:16]
+    return Path(root) / key
+
+
+def encode(tokenizer, conversations, max_seq_length):
+    # Segments are tokenized separately so the mask lines up exactly. Every boundary sits
+    # next to a special token or right after "assistant\n", where Qwen's pre-tokenizer
+    # splits anyway, so this equals tokenizing the whole string (a reply that itself starts
+    # with a newline is the one case where a whitespace run could have merged)
+    texts, targets = zip(*render_chatml(conversations))
+    ids, mask = [], []
+    for seg_ids, target in zip(tokenizer(list(texts), add_special_tokens=False)["input_ids"], targets):
+        ids.extend(seg_ids)
+        mask.extend([target] * len(seg_ids))
+    return ids[:max_seq_length], mask[:max_seq_length], len(ids) > max_seq_length
+
+
+def build_cache(tokenizer, data_file, max_seq_length=4096, root=CACHE_ROOT):
+    # Returns the cache directory, building it only if this tokenizer/data/length combo is new
+    out = cache_dir(tokenizer, data_file, max_seq_length, root)
+    if (out / "meta.json").exists():
+        return out
+    tmp = out.with_name(out.name + ".tmp")
+    tmp.mkdir(parents=True, exist_ok=True)
+    offsets = [0]
+    truncated = 0
+    with open(data_file, "rb") as src, open(tmp / "tokens.bin", "wb") as tok_f, open(tmp / "mask.bin", "wb") as mask_f:
+        for line in src:
+            if not line.strip():
+                continue
+            ex = json.loads(line)
+            ids, mask, cut = encode(tokenizer, ex["conversations"], max_seq_length)
+            truncated += cut
+            tok_f.write(np.asarray(ids, dtype=np.uint32).tobytes())
+            mask_f.write(np.asarray(mask, dtype=np.uint8).tobytes())
+            offsets.append(offsets[-1] + len(ids))
+    offsets = np.asarray(offsets, dtype=np.int64)
+    np.save(tmp / "offsets.npy", offsets)
+    lengths = np.diff(offsets)
+    meta = {
+        "source": str(data_file),
+        "tokenizer": getattr(tokenizer, "name_or_path", None),
+        "template_version": TEMPLATE_VERSION,
+        "max_seq_length": max_seq_length,
+        "examples": int(len(lengths)),
+        "tokens": int(offsets[-1]),
+        "truncated": int(truncated),
+        "length_p50": int(np.percentile(lengths, 50)) if len(lengths) else 0,
+        "length_p95": int(np.percentile(lengths, 95)) if len(lengths) else 0,
+        "length_max": int(lengths.max()) if len(lengths) else 0,
+    }
+    (tmp / "meta.json").write_text(json.dumps(meta, indent=2))
+    os.replace(tmp, out)
+    return out
+
+
+class TokenCache:
+    # Read-only view over a built cache; examples are memmap slices, nothing is loaded up front
+    def __init__(self, path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / "meta.json").read_text())
+        self.offsets = np.load(self.path / "offsets.npy")
+        self.lengths = np.diff(self.offsets)
+        n = int(self.offsets[-1])
+        self.tokens = np.memmap(self.path / "tokens.bin", dtype=np.uint32, mode="r", shape=(n,)) if n else np.zeros(0, np.uint32)
+        self.mask = np.memmap(self.path / "mask.bin", dtype=np.uint8, mode="r", shape=(n,)) if n else np.zeros(0, np.uint8)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def example(self, i):
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return self.tokens[a:b], self.mask[a:b]
+
+
+def grouped_batches(lengths, batch_size, seed=3407, mega=50):
+    # Like HF's LengthGroupedSampler: shuffle, sort by length inside mega-batches, then
+    # shuffle the batches, so each batch holds similar lengths but order stays random
+    rng = random.Random(seed)
+    idx = list(range(len(lengths)))
+    rng.shuffle(idx)
+    batches = []
+    for m in range(0, len(idx), batch_size * mega):
+        group = sorted(idx[m:m + batch_size * mega], key=lambda i: -lengths[i])
+        batches += [group[i:i + batch_size] for i in range(0, len(group), batch_size)]
+    rng.shuffle(batches)
+    return batches
+
+
+def random_batches(lengths, batch_size, seed=3407):
+    rng = random.Random(seed)
+    idx = list(range(len(lengths)))
+    rng.shuffle(idx)
+    return [idx[i:i + batch_size] for i in range(0, len(idx), batch_size)]
+
+
+def pack(lengths, max_seq_length):
+    # Best-fit decreasing: -> rows, each a list of example indices totalling <= max_seq_length.
+    # Open rows are kept sorted by free space so each placement is a bisect.
+    rows, room = [], []  # room: sorted [(free, row)]
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        n = int(lengths[i])
+        k = bisect.bisect_left(room, (n, -1))
+        if k < len(room):
+            free, r = room.pop(k)
+            rows[r].append(i)
+            bisect.insort(room, (free - n, r))
+        else:
+            rows.append([i])
+            bisect.insort(room, (max_seq_length - n, len(rows) - 1))
+    return rows
+
+
+def padding_report(cache, batch_size, max_seq_length):
+    # Share of tokens in each padded batch that are real, per batching mode
+    lengths = cache.lengths
+    real = int(lengths.sum())
+
+    def efficiency(batches):
+        padded = sum(len(b) * max(lengths[i] for i in b) for b in batches)
+        return float(real / padded) if padded else 1.0
+
+    rows = pack(lengths, max_seq_length)
+    return {
+        "examples": len(cache),
+        "tokens": real,
+        "random": efficiency(random_batches(lengths, batch_size)),
+        "grouped": efficiency(grouped_batches(lengths, batch_size)),
+        # Packed rows are padded to max_seq_length (fixed shapes) in batches of batch_size
+        "packed": real / (len(rows) * max_seq_length) if rows else 1.0,
+        "packed_rows": len(rows),
+    }
+
+
+class CachedDataset:
+    # torch-style dataset over the cache. mode="packed" yields best-fit-decreasing packed
+    # rows with position_ids restarting per example (use with flash-attention varlen /
+    # padding-free training so examples don't attend to each other); otherwise one example
+    # per item, with lengths exposed for length-grouped sampling.
+    def __init__(self, cache, mode="grouped", max_seq_length=4096, train_on_responses_only=True):
+        self.cache = cache
+        self.mode = mode
+        self.train_on_responses_only = train_on_responses_only
+        self.rows = pack(cache.lengths, max_seq_length) if mode == "packed" else [[i] for i in range(len(cache))]
+        self.lengths = [int(sum(cache.lengths[i] for i in row)) for row in self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, k):
+        ids, labels, positions = [], [], []
+        for i in self.rows[k]:
+            tokens, mask = self.cache.example(i)
+            tokens = tokens.astype(np.int64).tolist()
+            ids += tokens
+            keep = [t if (m or not self.train_on_responses_only) else -100 for t, m in zip(tokens, mask.tolist())]
+            labels += [-100] + keep[1:]  # nothing predicts an example's first token across a pack boundary
+            positions += list(range(len(tokens)))
+        return {"input_ids": ids, "labels": labels, "position_ids": positions}
+
+
+def collate(pad_token_id, packed=False):
+    # Right-pads a batch to its longest row; padding never reaches the loss. Unpacked rows get
+    # an attention_mask. Packed rows get none: position_ids restarting at 0 mark where each
+    # example (and the padding tail) begins, which flash-attention turns into varlen
+    # boundaries, like transformers' DataCollatorWithFlattening.
+    def fn(items):
+        import torch
+        width = max(len(it["input_ids"]) for it in items)
+        batch = {"input_ids": [], "labels": [], "position_ids": []}
+        if not packed:
+            batch["attention_mask"] = []
+        for it in items:
+            n = len(it["input_ids"])
+            batch["input_ids"].append(it["input_ids"] + [pad_token_id] * (width - n))
+            batch["labels"].append(it["labels"] + [-100] * (width - n))
+            batch["position_ids"].append(it["position_ids"] + list(range(width - n)))
+            if not packed:
+                batch["attention_mask"].append([1] * n + [0] * (width - n))
+        return {k: torch.tensor(v) for k, v in batch.items()}
+    return fn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build / inspect the tokenized training cache (CPU only)")
+    parser.add_argument("--data", default="data/final/stm32_f405_train.jsonl")
+    parser.add_argument("--tokenizer", default="unsloth/Qwen2.5-Coder-7B-Instruct", help="HF name or local path")
+    parser.add_argument("--max-seq-length", type=int, default=4096)
+    parser.add_argument("--batch-size", type=int, default=2)
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    path = build_cache(tokenizer, args.data, args.max_seq_length)
+    cache = TokenCache(path)
+    m = cache.meta
+    print(f"✓ Cache {path}: {m['examples']} examples, {m['tokens']} tokens "
+          f"(p50 {m['length_p50']}, p95 {m['length_p95']}, max {m['length_max']}, {m['truncated']} truncated)")
+    r = padding_report(cache, args.batch_size, args.max_seq_length)
+    print(f"Padding efficiency at batch size {args.batch_size}: random {r['random']:.0%}, "
+          f"length-grouped {r['grouped']:.0%}, packed {r['packed']:.0%} ({r['packed_rows']} rows of {args.max_seq_length})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 from unsloth import FastLanguageModel
 from trl import SFTTrainer
-from datasets import load_dataset
 import torch
+from train_cache import build_cache, TokenCache, CachedDataset, collate, padding_report
 
 max_seq_length = 4096
+batch_mode = "grouped"   # "grouped" (length-bucketed batches) or "packed" (needs flash-attention)
 model, tokenizer = FastLanguageModel.from_pretrained(
     model_name = "unsloth/Qwen2.5-Coder-7B-Instruct",
     max_seq_length = max_seq_length,
@@ -25,19 +26,26 @@ model = FastLanguageModel.get_peft_model(
     loftq_config = None,
 )
 
-# Load your dataset (change path)
-dataset = load_dataset("json", data_files="stm32_dataset.jsonl", split="train")
+# Tokenized once (ChatML exactly as in the Modelfile) into data/train_cache/, reused while the
+# tokenizer, data file and max_seq_length stay the same. Build it ahead on CPU with train_cache.py
+cache = TokenCache(build_cache(tokenizer, "data/final/stm32_f405_train.jsonl", max_seq_length))
+dataset = CachedDataset(cache, batch_mode, max_seq_length, train_on_responses_only = True)
+report = padding_report(cache, 2, max_seq_length)
+print(f"{cache.meta['examples']} examples, {cache.meta['tokens']} tokens; padding efficiency "
+      f"random {report['random']:.0%}, grouped {report['grouped']:.0%}, packed {report['packed']:.0%} → using {batch_mode}")
 
 trainer = SFTTrainer(
     model = model,
     tokenizer = tokenizer,
     train_dataset = dataset,
-    dataset_text_field = "conversations",   # or "text" depending on format
+    data_collator = collate(tokenizer.pad_token_id, packed = batch_mode == "packed"),
+    dataset_kwargs = {"skip_prepare_dataset": True},   # already tokenized + masked
     max_seq_length = max_seq_length,
-    dataset_num_proc = 4,
-    packing = False,   # set True if you want faster but less precise
+    packing = False,   # packing (if any) is done by the cache
     args = SFTTrainer.get_training_args(
         per_device_train_batch_size = 2,
+        group_by_length = batch_mode == "grouped",
+        remove_unused_columns = False,
         gradient_accumulation_steps = 8,   # effective batch ~16
         warmup_steps = 10,
         max_steps = 300,                   # ~1 epoch on 800 examples; change to -1 for full